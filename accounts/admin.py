@@ -1,6 +1,57 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
 
+from transactions import services
 from .models import UserBankAccount, UserAddress
 
-admin.site.register(UserBankAccount)
+
+class UserBankAccountForm(forms.ModelForm):
+    adjustment = forms.DecimalField(
+        max_digits=12, decimal_places=2, required=False,
+        help_text='Add this amount to the balance, or take it out if negative. Posted to the ledger as an adjustment.',
+    )
+
+    class Meta:
+        model = UserBankAccount
+        fields = '__all__'
+
+
+@admin.register(UserBankAccount)
+class UserBankAccountAdmin(admin.ModelAdmin):
+    form = UserBankAccountForm
+    list_display = ['account_no', 'user', 'account_type', 'balance', 'balance_shards']
+    list_select_related = ['user']
+    # Money and loan state only move through transactions.services, which
+    # also posts to the ledger: the balance with the adjustment field, the
+    # shards with `manage.py shard_balance`
+    readonly_fields = ['balance', 'pending_loan_count', 'outstanding_loan_amount', 'balance_shards']
+    ordering = ['account_no']
+    search_fields = ['account_no', 'user__username']
+
+    def get_search_results(self, request, queryset, search_term):
+        # Exact matches only, so both searches hit a unique index. The account
+        # autocomplete in the transaction admins searches through here too.
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isdigit():
+            return queryset.filter(account_no=int(term)), False
+        return queryset.filter(user__username=term), False
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            # A full save would write back the balance as it was when the
+            # page was loaded, over whatever moved it since
+            obj.save(update_fields=[name for name in form.changed_data if name != 'adjustment'])
+        else:
+            obj.save()
+
+        adjustment = form.cleaned_data.get('adjustment')
+        if adjustment:
+            try:
+                services.adjust_balance(obj, adjustment)
+            except services.InsufficientBalance:
+                messages.warning(request, "The adjustment would make the balance negative, it was not made")
+
+
 admin.site.register(UserAddress)
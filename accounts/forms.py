@@ -111,7 +111,8 @@ class UserUpdateForm(forms.ModelForm):
             user_account.account_type = self.cleaned_data.get('account_type')
             user_account.birth_date = self.cleaned_data.get('birth_date')
             user_account.gender = self.cleaned_data.get('gender')
-            user_account.save()
+            # Not the balance, which may have moved since it was read
+            user_account.save(update_fields=['account_type', 'birth_date', 'gender'])
             
             user_address.street_address = self.cleaned_data.get('street_address')
             user_address.city = self.cleaned_data.get('city')
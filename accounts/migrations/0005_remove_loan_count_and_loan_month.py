@@ -0,0 +1,23 @@
+# Generated by Django 5.2 on 2026-10-18 15:10
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_userbankaccount_loan_month_and_more'),
+        # The backfill still writes these fields
+        ('transactions', '0011_backfill_loan_state'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='userbankaccount',
+            name='loan_count',
+        ),
+        migrations.RemoveField(
+            model_name='userbankaccount',
+            name='loan_month',
+        ),
+    ]
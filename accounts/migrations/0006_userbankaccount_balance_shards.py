@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 15:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_remove_loan_count_and_loan_month'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userbankaccount',
+            name='balance_shards',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
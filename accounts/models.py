@@ -14,7 +14,15 @@ class UserBankAccount(models.Model):
     initial_deposit_date = models.DateField(auto_now_add=True)
     balance = models.DecimalField(default=0, max_digits=12, decimal_places=2)
     last_loan_date = models.DateField(blank=True, null=True)
-    loan_count = models.PositiveIntegerField(default=0)
+    # Loan state kept next to the balance so a loan request is checked with
+    # one conditional UPDATE; rebuilt by `manage.py reconcile_loan_state`.
+    # How many loans an account may take is a quota, see transactions/quotas.py
+    pending_loan_count = models.PositiveIntegerField(default=0)
+    outstanding_loan_amount = models.DecimalField(default=0, max_digits=12, decimal_places=2)
+    # Above 0, the balance is split over this many counter rows for
+    # accounts that take many deposits at once, see transactions/shards.py.
+    # Changed with `manage.py shard_balance`.
+    balance_shards = models.PositiveSmallIntegerField(default=0)
     
     def __str__(self):
         return str(self.account_no)
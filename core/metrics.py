@@ -0,0 +1,88 @@
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+
+# In-process request metrics, exported in the Prometheus text format by
+# core.views.MetricsView. Each process keeps its own numbers; Prometheus
+# adds them up across workers. Recording is a lock plus a few additions.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class ViewStats:
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1) # Last one is +Inf
+        self.requests = 0
+        self.seconds = 0.0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.renders = 0
+        self.render_seconds = 0.0
+
+
+_lock = threading.Lock()
+_stats = defaultdict(ViewStats)
+
+
+def record_request(view, seconds, queries, sql_seconds):
+    with _lock:
+        stats = _stats[view]
+        stats.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        stats.requests += 1
+        stats.seconds += seconds
+        stats.queries += queries
+        stats.sql_seconds += sql_seconds
+
+
+def record_render(view, seconds):
+    with _lock:
+        stats = _stats[view]
+        stats.renders += 1
+        stats.render_seconds += seconds
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def snapshot():
+    # {view name: {field: value}}, a copy taken under the lock
+    with _lock:
+        return {view: {**vars(stats), 'buckets': stats.buckets[:]} for view, stats in _stats.items()}
+
+
+def render_prometheus():
+    views = snapshot()
+
+    lines = [
+        '# HELP empty_bank_request_duration_seconds Request latency by view.',
+        '# TYPE empty_bank_request_duration_seconds histogram',
+    ]
+    for view, stats in sorted(views.items()):
+        label = _label(view)
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), stats['buckets']):
+            cumulative += count
+            lines.append(f'empty_bank_request_duration_seconds_bucket{{view="{label}",le="{bound}"}} {cumulative}')
+        lines.append(f'empty_bank_request_duration_seconds_sum{{view="{label}"}} {stats["seconds"]:.6f}')
+        lines.append(f'empty_bank_request_duration_seconds_count{{view="{label}"}} {stats["requests"]}')
+
+    counters = [
+        ('empty_bank_db_queries_total', 'SQL queries run while handling requests.', 'queries', '{}'),
+        ('empty_bank_db_query_seconds_total', 'Time spent in SQL.', 'sql_seconds', '{:.6f}'),
+        ('empty_bank_template_renders_total', 'Template responses rendered.', 'renders', '{}'),
+        ('empty_bank_template_render_seconds_total', 'Time spent rendering templates.', 'render_seconds', '{:.6f}'),
+    ]
+    for name, help_text, field, number in counters:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for view, stats in sorted(views.items()):
+            lines.append(f'{name}{{view="{_label(view)}"}} {number.format(stats[field])}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,119 @@
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+
+from . import metrics, routers
+
+
+class QueryTimer:
+    # Installed with connection.execute_wrapper() for the length of a request
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.queries += 1
+
+
+def view_name(request):
+    # The URL name ("deposit", "admin:index"), which keeps the label set
+    # small no matter which ids appear in the path
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+
+class MetricsMiddleware:
+    """
+    Records latency, query count, SQL time and template render time for
+    every request, labelled by URL name. Goes first in MIDDLEWARE so the
+    latency covers the rest of the stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with self.timing_queries(timer):
+            response = self.get_response(request)
+        self.record(request, time.perf_counter() - start, timer)
+        return response
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        start = time.perf_counter()
+        # Connections belong to a thread and the ORM runs in the request's
+        # sync_to_async thread, not this one, so the wrappers are installed
+        # (and removed) there
+        stack = await sync_to_async(self.timing_queries)(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.record(request, time.perf_counter() - start, timer)
+        return response
+
+    def timing_queries(self, timer):
+        # Returns an ExitStack with the wrappers already installed
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(timer))
+        return stack
+
+    def record(self, request, seconds, timer):
+        metrics.record_request(view_name(request), seconds, timer.queries, timer.seconds)
+
+    def process_template_response(self, request, response):
+        # TemplateResponse renders after every process_template_response has
+        # run; the post-render callback fires right after that render
+        start = time.perf_counter()
+        name = view_name(request)
+        response.add_post_render_callback(lambda r: metrics.record_render(name, time.perf_counter() - start))
+        return response
+
+
+class ReplicaMiddleware(MiddlewareMixin):
+    """
+    Sends the reads of read-only pages (views with ``replica_reads = True``
+    and admin changelists) to a replica. A request that writes sets a cookie
+    that keeps the user's reads on the primary for REPLICA_PIN_SECONDS, so
+    replica lag never hides their own deposit from them.
+    """
+    cookie_name = 'pin_primary'
+
+    def process_request(self, request):
+        routers.start_request()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in ('GET', 'HEAD') or self.cookie_name in request.COOKIES:
+            return None
+        view_class = getattr(view_func, 'view_class', None)
+        match = request.resolver_match
+        admin_list = match.namespace == 'admin' and (match.url_name or '').endswith('_changelist')
+        if getattr(view_class, 'replica_reads', False) or admin_list:
+            routers.read_from_replica()
+        return None
+
+    def process_response(self, request, response):
+        if routers.request_wrote():
+            response.set_cookie(
+                self.cookie_name, '1',
+                max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+        return response
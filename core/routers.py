@@ -0,0 +1,65 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+
+# Reads go to the primary unless ReplicaMiddleware marked the request as a
+# read-only page. Writes always go to the primary, and the first write in a
+# request moves the rest of its reads there too.
+
+PRIMARY = 'default'
+
+_replica_reads = ContextVar('replica_reads', default=False)
+_wrote = ContextVar('wrote', default=False)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and settings.DATABASE_REPLICAS:
+            return random.choice(settings.DATABASE_REPLICAS)
+        return PRIMARY
+
+    def db_for_write(self, model, **hints):
+        _replica_reads.set(False)
+        _wrote.set(True)
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas get their schema from the primary
+        return db == PRIMARY
+
+
+def start_request():
+    _replica_reads.set(False)
+    _wrote.set(False)
+
+
+def read_from_replica():
+    if not _wrote.get():
+        _replica_reads.set(True)
+
+
+def reading_from_replica():
+    return _replica_reads.get() and bool(settings.DATABASE_REPLICAS)
+
+
+def request_wrote():
+    return _wrote.get()
+
+
+@contextmanager
+def primary_reads():
+    # For reads whose result outlives the request, like cached summaries,
+    # which must not be built from a replica that is behind
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        if not _wrote.get():
+            _replica_reads.reset(token)
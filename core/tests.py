@@ -1,3 +1,96 @@
-from django.test import TestCase
+import os
+import shutil
+import sqlite3
+import tempfile
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from accounts.models import UserBankAccount
+from transactions import services
+from . import metrics
+from .middleware import ReplicaMiddleware
+
+
+class MetricsMiddlewareTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def test_counts_queries(self):
+        self.client.force_login(self.user)
+        self.client.get('/admin/auth/user/')
+        self.assertGreater(metrics.snapshot()['admin:auth_user_changelist']['queries'], 0)
+
+    async def test_counts_queries_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        await self.async_client.get('/admin/auth/user/')
+        self.assertGreater(metrics.snapshot()['admin:auth_user_changelist']['queries'], 0)
+
+    def test_unknown_admin_page(self):
+        # Resolves to the admin's catch-all view, which has no URL name
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/admin/nonexistent/').status_code, 404)
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    # A second SQLite file, copied from the primary in setUp, stands in for
+    # the replica. It never catches up, so a read shows which one it hit.
+    # The test runner only knows the aliases in settings, so this one is
+    # added once the test class is set up.
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.settings['replica'] = {
+            **connections.settings['default'], 'NAME': os.path.join(cls.replica_dir, 'replica.sqlite3'),
+        }
+        cls.databases = cls.databases | {'replica'}
+        cls.enterClassContext(override_settings(DATABASE_REPLICAS=['replica']))
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        shutil.rmtree(cls.replica_dir)
+        super().tearDownClass()
+
+    def setUp(self):
+        user = User.objects.create_user('user1', password='password')
+        self.account = UserBankAccount.objects.create(user=user, account_type='Savings', gender='Male', account_no=1)
+        services.deposit(self.account, Decimal(1000))
+        connections['replica'].close()
+        connections['default'].ensure_connection()
+        replica = sqlite3.connect(connections.settings['replica']['NAME'])
+        connections['default'].connection.backup(replica)
+        replica.close()
+        # Only on the primary from here on
+        services.deposit(self.account, Decimal(500))
+        self.client.force_login(self.account.user)
+
+    def statement_rows(self):
+        response = self.client.get(reverse('statement_export'), {'format': 'jsonl'})
+        return len(b''.join(response.streaming_content).splitlines())
+
+    def test_read_only_pages_read_from_the_replica(self):
+        self.assertEqual(self.statement_rows(), 1)
+
+    def test_reads_stay_on_the_primary_after_a_write(self):
+        response = self.client.post(reverse('deposit'), {'amount': '100'})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(ReplicaMiddleware.cookie_name, response.cookies)
+        self.assertEqual(self.statement_rows(), 3)
+        self.client.cookies.pop(ReplicaMiddleware.cookie_name)
+        self.assertEqual(self.statement_rows(), 1)
+
+    def test_write_and_admin_pages_read_from_the_primary(self):
+        # The replica only has 1000 in the account
+        self.assertEqual(self.client.post(reverse('withdrawal'), {'amount': '1200'}).status_code, 302)
+        User.objects.filter(pk=self.account.user_id).update(is_staff=True, is_superuser=True)
+        response = self.client.get(reverse('admin:accounts_userbankaccount_change', args=[self.account.pk]))
+        self.assertEqual(response.context['original'].balance, Decimal(300))
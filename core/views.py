@@ -1,6 +1,46 @@
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseForbidden
 from django.shortcuts import render
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views import View
 from django.views.generic import TemplateView
 
+from . import metrics
+
+
+HOME_PAGE_KEY = 'home-page'
+HOME_PAGE_TIMEOUT = 60 * 10
+HOME_PAGE_MAX_AGE = 60 # Seconds browsers and proxies may reuse it
+
 
 class HomeView(TemplateView):
     template_name = 'index.html'
+
+    def get(self, request, *args, **kwargs):
+        # Every anonymous visitor gets the same page, so it is rendered once
+        # and served from the cache. Logged in users see their balance in the
+        # navbar, and a page with messages on it is one visitor's only.
+        if request.user.is_authenticated or get_messages(request):
+            response = super().get(request, *args, **kwargs)
+            patch_cache_control(response, private=True)
+            return response
+
+        content = cache.get(HOME_PAGE_KEY)
+        if content is None:
+            content = super().get(request, *args, **kwargs).render().content
+            cache.set(HOME_PAGE_KEY, content, HOME_PAGE_TIMEOUT)
+        response = HttpResponse(content)
+        patch_cache_control(response, public=True, max_age=HOME_PAGE_MAX_AGE)
+        # Logging in sets a session cookie, which must get a fresh page
+        patch_vary_headers(response, ['Cookie'])
+        return response
+
+
+class MetricsView(View):
+    # Scraped by Prometheus from an internal address; staff can look too
+    def get(self, request):
+        if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS and not request.user.is_staff:
+            return HttpResponseForbidden()
+        return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -2,6 +2,9 @@
 ASGI config for empty_bank project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+It runs with empty_bank/settings.py like the WSGI entry point. Set
+DJANGO_SETTINGS_MODULE=empty_bank.settings_asgi to opt in to the ASGI
+profile.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -47,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -58,16 +60,27 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'empty_bank.urls'
 
+# Addresses allowed to scrape /metrics without logging in
+INTERNAL_IPS = ['127.0.0.1']
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [ BASE_DIR / 'templates' ],
-        'APP_DIRS': True,
         'OPTIONS': {
+            # Templates are parsed once per process instead of on every
+            # render; with DEBUG on they are still reloaded when edited
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'transactions.context_processors.account_summary',
             ],
         },
     },
@@ -83,9 +96,127 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # WAL lets readers and a writer work at the same time. Every atomic
+        # block starts with BEGIN IMMEDIATE, so a writer waits for the lock
+        # (up to "timeout" seconds) when the transaction starts, instead of
+        # failing with "database is locked" halfway through. Writes that still
+        # time out are retried by transactions.services.retry_on_lock.
+        # `manage.py bench_sqlite` compares this against the stock setup.
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA mmap_size=134217728;'
+                'PRAGMA cache_size=-20000;'
+            ),
+        },
+        # Keep connections open so the pragmas run once per connection, not
+        # once per request
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        # A file rather than SQLite's in-memory default, so the tests that
+        # run threads (concurrent writes, group commit) get WAL and the busy
+        # timeout like the real database
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    }
+}
+
+# Read replicas. Read-only pages read from one of these, everything else
+# uses the primary, see core/routers.py. To try it locally point
+# EMPTY_BANK_REPLICAS at a copy of db.sqlite3 (comma separated for more than
+# one); the copy never catches up, which makes the routing easy to see.
+DATABASE_REPLICAS = []
+for number, name in enumerate(filter(None, os.environ.get('EMPTY_BANK_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], 'NAME': name, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+
+# How long a user's reads stay on the primary after they write
+REPLICA_PIN_SECONDS = 10
+
+# Serve the report and loan list with the native async views in
+# transactions/async_views.py. On in the ASGI profile (settings_asgi.py),
+# which is opt-in through DJANGO_SETTINGS_MODULE.
+ASYNC_VIEWS = False
+
+# Group commit for DipositView (transactions/group_commit.py): deposits
+# arriving within GROUP_COMMIT_WINDOW_MS of each other are written by one
+# committer thread per process in a single DB transaction, up to
+# GROUP_COMMIT_MAX_BATCH at a time. A longer window means fewer commits and
+# slower deposits; `manage.py bench_group_commit` measures both. A request
+# gives up on its deposit after GROUP_COMMIT_TIMEOUT seconds.
+GROUP_COMMIT_DEPOSITS = False
+GROUP_COMMIT_WINDOW_MS = 2
+GROUP_COMMIT_MAX_BATCH = 200
+GROUP_COMMIT_TIMEOUT = 30
+
+# Sharded balance counters (transactions/shards.py), set up per account with
+# `manage.py shard_balance`. Meant for backends with row locks (PostgreSQL,
+# MySQL), where deposits to different shard rows don't wait on each other.
+# SQLite takes one lock for the whole database on every write, so there the
+# shards only add queries (`manage.py bench_shards` shows it). While this is
+# off no account can be sharded, and money left in old shards moves into
+# the account row on its next write.
+BALANCE_SHARDS = False
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Holds the per-user account summaries and their versions
+# (transactions/summary.py), the quota counters (transactions/quotas.py),
+# the anonymous home page and the report table fragments. The summary
+# versions and the quota counters have to be shared by every process that
+# serves requests: point EMPTY_BANK_REDIS_URL at a Redis server (needs the
+# redis package) to get them. With the in-process cache, summaries and
+# report tables are built on every request and quotas are counted in the
+# database instead (transactions/caches.py).
+
+if os.environ.get('EMPTY_BANK_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['EMPTY_BANK_REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'empty-bank',
+        }
     }
+
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+
+# Sliding-window limits per account type (accounts.constants.ACCOUNT_TYPES),
+# enforced by transactions/quotas.py. None means no limit. Amounts are in $.
+
+ACCOUNT_QUOTAS = {
+    'Savings': {
+        'loans_per_30_days': 3,
+        'withdrawals_per_day': 5,
+        'withdrawn_per_day': 50000,
+    },
+    'Current': {
+        'loans_per_30_days': 3,
+        'withdrawals_per_day': 20,
+        'withdrawn_per_day': 200000,
+    },
 }
 
+# Transactions older than this many days are moved to the archive table by
+# `manage.py archive_transactions` (transactions/archive.py). Must be longer
+# than the longest ACCOUNT_QUOTAS window, which is counted from the hot table.
+ARCHIVE_AFTER_DAYS = 365
+
+# Where `manage.py monthly_statements` writes statements, one directory per
+# month (transactions/statements.py)
+STATEMENTS_DIR = os.environ.get('EMPTY_BANK_STATEMENTS_DIR', BASE_DIR / 'statements')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
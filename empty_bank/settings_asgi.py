@@ -0,0 +1,22 @@
+"""
+Settings for running under an ASGI server, e.g.
+
+    DJANGO_SETTINGS_MODULE=empty_bank.settings_asgi \
+        uvicorn empty_bank.asgi:application --workers 4
+
+It is opt-in: empty_bank/asgi.py defaults to settings.py. Everything not
+set here comes from settings.py. With more than one worker, set
+EMPTY_BANK_REDIS_URL so they share the cache (see CACHES in settings.py).
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES
+
+# The report and loan list pages are served by native async views
+ASYNC_VIEWS = True
+
+# Django advises against persistent connections under ASGI (see
+# "Persistent connections" in its database docs), so they are closed at the
+# end of every request
+for database in DATABASES.values():
+    database['CONN_MAX_AGE'] = 0
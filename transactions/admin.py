@@ -1,31 +1,126 @@
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+from accounts.models import UserBankAccount
 from .models import Transaction, LoanTransaction
 from .constants import LOAN
 from django.contrib import messages
-# from .views import send_transaction_email
+from . import services
+from .summary import invalidate_account_summary
+
+
+class AccountAutocompleteFilter(admin.SimpleListFilter):
+    # Picks one account through the admin autocomplete endpoint instead of
+    # listing every account in the sidebar
+    title = 'account'
+    parameter_name = 'account'
+    template = 'admin/transactions/account_autocomplete_filter.html'
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def account_id(self):
+        value = self.value()
+        if value and value.isascii() and value.isdigit():
+            return int(value)
+        return None
+
+    def queryset(self, request, queryset):
+        if self.value():
+            # The admin doesn't catch anything else a filter raises
+            if self.account_id() is None:
+                raise IncorrectLookupParameters(f'Invalid account id {self.value()!r}')
+            return queryset.filter(account_id=self.account_id())
+
+    def choices(self, changelist):
+        account = None
+        if self.account_id() is not None:
+            account = UserBankAccount.objects.filter(pk=self.account_id()).first()
+        yield {
+            'value': self.value(),
+            'display': str(account) if account else '',
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+        }
+
+
+class CappedCountPaginator(Paginator):
+    # An exact COUNT(*) over tens of millions of rows on every changelist load
+    # is the slowest part of the page. Count at most count_limit rows, which
+    # is a bounded index scan; past that the last pages are simply not linked.
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        return self.object_list[:self.count_limit].count()
+
+
+class AccountTransactionAdmin(admin.ModelAdmin):
+    list_select_related = ['account']
+    date_hierarchy = 'timestamp'
+    search_fields = ['account__account_no']
+    autocomplete_fields = ['account']
+    paginator = CappedCountPaginator
+    show_full_result_count = False
+    list_per_page = 20
+    # A saved row is history. Money only moves through transactions.services,
+    # which posts to the ledger as well; editing these would move neither.
+    history_fields = ['account', 'amount', 'transaction_type', 'balance_after_transaction']
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj is None:
+            return self.readonly_fields
+        return [*self.readonly_fields, *self.history_fields]
+
+    def get_search_results(self, request, queryset, search_term):
+        # Exact account number only, which is an indexed lookup
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if not term.isdigit():
+            return queryset.none(), False
+        return queryset.filter(account__account_no=int(term)), False
+
+    class Media:
+        css = {
+            'all': ['admin/css/vendor/select2/select2.css', 'admin/css/autocomplete.css'],
+        }
+        js = [
+            'admin/js/vendor/jquery/jquery.js',
+            'admin/js/vendor/select2/select2.full.js',
+            'admin/js/jquery.init.js',
+            'admin/js/autocomplete.js',
+            'transactions/js/account_filter.js',
+        ]
 
 
 # Admin for all transactions EXCEPT loans
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(AccountTransactionAdmin):
     list_display = ['account', 'amount', 'balance_after_transaction', 'transaction_type' ,'timestamp']
     exclude = ['loan_approve']
-    list_filter = ['transaction_type', 'timestamp', 'account', 'account__user__username']
-    search_fields = ['account__user__username', 'account__account_number']
-    list_per_page = 20
+    list_filter = ['transaction_type', 'timestamp', AccountAutocompleteFilter]
     
     def get_queryset(self, request):
         qs = super().get_queryset(request)
         return qs.exclude(transaction_type=LOAN)  # Show non-loan transactions only
 
+    def has_add_permission(self, request):
+        # A row added here would move no money; corrections go through the
+        # adjustment field of the account admin
+        return False
+
 
 # Admin for LOAN transactions only
 @admin.register(LoanTransaction)
-class LoanAdmin(admin.ModelAdmin):
+class LoanAdmin(AccountTransactionAdmin):
     list_display = ['account', 'amount', 'balance_after_transaction', 'transaction_type', 'loan_approve', 'timestamp'] 
     # list_editable = ['loan_approve']
-    list_filter = ['loan_approve', 'timestamp', 'account', 'account__user__username']
-    search_fields = ['account__user__username', 'account__account_number']
+    list_filter = ['loan_approve', 'timestamp', AccountAutocompleteFilter]
+    actions = ['approve_selected_loans', 'reverse_selected_loans']
    
 
     def get_queryset(self, request):
@@ -33,6 +128,25 @@ class LoanAdmin(admin.ModelAdmin):
         return qs.filter(transaction_type=LOAN)  # Show only loan transactions
 
 
+    @admin.action(description='Approve selected loans')
+    def approve_selected_loans(self, request, queryset):
+        result = services.bulk_approve_loans(queryset.values_list('pk', flat=True))
+        self.message_user(request, f"{len(result['changed'])} loans approved")
+        if result['ignored']:
+            self.message_user(request, f"Skipped {len(result['ignored'])} loans that were not pending", messages.WARNING)
+
+
+    @admin.action(description='Reverse selected loan approvals')
+    def reverse_selected_loans(self, request, queryset):
+        result = services.bulk_reverse_loans(queryset.values_list('pk', flat=True))
+        self.message_user(request, f"{len(result['changed'])} loans reversed")
+        if result['insufficient']:
+            ids = ', '.join(str(pk) for pk in result['insufficient'])
+            self.message_user(request, f"Insufficient balance to reverse loans: {ids}", messages.WARNING)
+        if result['ignored']:
+            self.message_user(request, f"Skipped {len(result['ignored'])} loans that were not approved", messages.WARNING)
+
+
     def save_model(self, request, obj, form, change):
         account = obj.account
         is_approved = obj.loan_approve
@@ -42,45 +156,49 @@ class LoanAdmin(admin.ModelAdmin):
         # print("Loan approved now:", is_approved)
 
         if change:
+            # changeform_view runs in an atomic block. The account and then
+            # the loan are locked, in pay_loan's order, until the save
+            # commits, so a second admin saving the same loan waits and
+            # sees the first one's approval instead of crediting it again.
+            list(UserBankAccount.objects.select_for_update().filter(pk=obj.account_id).values_list('pk', flat=True))
             try:
-                previous = Transaction.objects.get(pk=obj.pk)
+                previous = Transaction.objects.select_for_update().get(pk=obj.pk)
             except Transaction.DoesNotExist:
                 previous = None
 
+            if previous and previous.transaction_type != LOAN:
+                messages.warning(request, "The loan was repaid meanwhile and can't be changed")
+                return  # Don't save this object
+
             if previous:
                 # print("Previous loan approved:", previous.loan_approve)
 
                 # Approval Cancelled (True -> False)
                 if previous.loan_approve and not is_approved:
-                    if account.balance >= obj.amount:
-                        account.balance -= obj.amount
-                        obj.balance_after_transaction = account.balance
-                        account.save()
+                    try:
+                        services.reverse_loan(obj)
                         # print(f"Loan reversed. New balance: {account.balance}")
-                    else:
+                    except services.InsufficientBalance:
                         messages.warning(request, "Insufficient balance to reverse loan")
                         obj.loan_approve = True  # Revert back
                         return  # Don't save this object
 
                 # New Approval (False -> True)
                 elif not previous.loan_approve and is_approved:
-                    account.balance += obj.amount
-                    obj.balance_after_transaction = account.balance
-                    account.save()
+                    services.approve_loan(obj)
                     # print(f"Loan approved. New balance: {account.balance}")
         else:
             # Initial creation
             if is_approved:
-                account.balance += obj.amount
-                obj.balance_after_transaction = account.balance
-                account.save()
+                services.approve_loan(obj, was_pending=False)
                 # print(f"Loan initially approved. New balance: {account.balance}")
             else:
                 obj.balance_after_transaction = account.balance
+                services.add_pending_loan(obj)
                 # print("Loan requested but not approved yet.")
             
-        # send_transaction_email(obj.account.user, obj.amount, "Loan Approval", "transactions/admin_email.html")
         super().save_model(request, obj, form, change)
+        invalidate_account_summary(account)
 
 
 
@@ -0,0 +1,127 @@
+import hashlib
+
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db.models import OuterRef, Subquery
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.http import condition
+
+from accounts.models import UserBankAccount
+from .models import Transaction, ArchivedTransaction
+from .constants import LOAN, LOAN_PAID, TRANSACTION_TYPES
+from . import archive
+from .pagination import keyset_page, InvalidCursor
+from .summary import get_account_summary
+
+
+# JSON endpoints for mobile clients and dashboards. Every response carries
+# a strong ETag built from the account's latest transaction id, its balance
+# and its loan state, which between them change on every write, including
+# ones that don't add a row, like a loan approval. They are read from the
+# database rather than from the summary version, which is only shared when
+# the cache is (see summary.py). A client sending that ETag back in
+# If-None-Match gets a 304 after one indexed query, without the view running.
+
+TRANSACTION_TYPE_LABELS = dict(TRANSACTION_TYPES)
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def account_etag(request, *args, **kwargs):
+    latest = Transaction.objects.filter(account=OuterRef('pk')).order_by('-timestamp', '-id').values('pk')[:1]
+    row = (
+        UserBankAccount.objects.filter(user_id=request.user.pk)
+        .annotate(latest=Subquery(latest))
+        .values_list('pk', 'balance', 'pending_loan_count', 'outstanding_loan_amount', 'latest')
+        .first()
+    )
+    if row is None:
+        return None
+    # The full path keeps pages of the same account apart
+    raw = f'{request.get_full_path()}|{row}'
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+def transaction_json(row):
+    return {
+        'id': row.pk,
+        'timestamp': row.timestamp,
+        'type': TRANSACTION_TYPE_LABELS.get(row.transaction_type),
+        'amount': row.amount,
+        'balance_after_transaction': row.balance_after_transaction,
+    }
+
+
+class ApiView(LoginRequiredMixin, View):
+    http_method_names = ['get', 'head', 'options']
+
+    def handle_no_permission(self):
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        except UserBankAccount.DoesNotExist:
+            response = JsonResponse({'error': 'No bank account'}, status=404)
+        # Cache it, but ask us every time whether it is still current
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+@method_decorator(condition(etag_func=account_etag), name='get')
+class BalanceApiView(ApiView):
+    def get(self, request):
+        summary = get_account_summary(request.user)
+        account = summary['account']
+        return JsonResponse({
+            'account_no': account.account_no,
+            'balance': summary['balance'],
+            'has_pending_loan': summary['has_pending_loan'],
+            'outstanding_loan_amount': account.outstanding_loan_amount,
+        })
+
+
+@method_decorator(condition(etag_func=account_etag), name='get')
+class TransactionApiView(ApiView):
+    # Newest first, paged with the same cursors as the HTML report
+    def get(self, request):
+        try:
+            limit = min(max(int(request.GET.get('limit', DEFAULT_LIMIT)), 1), MAX_LIMIT)
+        except ValueError:
+            return JsonResponse({'error': 'limit must be a number'}, status=400)
+        account = get_account_summary(request.user)['account']
+        try:
+            rows, next_cursor, previous_cursor = keyset_page(
+                Transaction.objects.filter(account=account),
+                limit,
+                after=request.GET.get('after'),
+                before=request.GET.get('before'),
+                archive=ArchivedTransaction.objects.filter(account=account),
+            )
+        except InvalidCursor:
+            return JsonResponse({'error': 'invalid cursor'}, status=400)
+        return JsonResponse({
+            'results': [transaction_json(row) for row in rows],
+            'next': next_cursor,
+            'previous': previous_cursor,
+        })
+
+
+@method_decorator(condition(etag_func=account_etag), name='get')
+class LoanApiView(ApiView):
+    def get(self, request):
+        account = get_account_summary(request.user)['account']
+        loans = Transaction.objects.filter(account=account, transaction_type__in=[LOAN, LOAN_PAID])
+        # Paid loans may have been archived
+        paid = ArchivedTransaction.objects.filter(account=account, transaction_type=LOAN_PAID)
+        loans = archive.merged(loans.order_by('-timestamp', '-id'), paid.order_by('-timestamp', '-id'), reverse=True)
+        results = []
+        for loan in loans:
+            entry = transaction_json(loan)
+            if loan.transaction_type == LOAN_PAID:
+                entry['status'] = 'paid'
+            else:
+                entry['status'] = 'approved' if loan.loan_approve else 'pending'
+            results.append(entry)
+        return JsonResponse({'results': results})
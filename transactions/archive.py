@@ -0,0 +1,114 @@
+import heapq
+from datetime import datetime, time, timedelta
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import Transaction, ArchivedTransaction
+from .constants import DEPOSIT, WITHDRAWAL, LOAN_PAID
+
+
+# Hot/cold split of the transaction history. `manage.py
+# archive_transactions` moves rows older than settings.ARCHIVE_AFTER_DAYS
+# from Transaction to ArchivedTransaction in small batches, so Transaction
+# and its indexes only hold recent activity.
+#
+# Readers that can reach back that far (report pages, the statement
+# export, monthly statements, reconcile, snapshot rebuilds) read through to
+# the archive only when what they ask for starts at or before the horizon.
+# Everything newer is only ever in Transaction. The horizon is the archive
+# cutoff for the current setting, or the newest archived row if that is
+# newer (ARCHIVE_AFTER_DAYS was raised since), which is cached and refreshed
+# every few minutes.
+#
+# Loans are never archived while they can still be approved or paid, as
+# both update the Transaction row; a paid loan (LOAN_PAID) is.
+
+ARCHIVED_TYPES = (DEPOSIT, WITHDRAWAL, LOAN_PAID)
+HORIZON_KEY = 'archive-horizon'
+HORIZON_TIMEOUT = 60 * 5
+BATCH_SIZE = 5000
+
+
+def cutoff():
+    # Rows older than this are archived
+    return timezone.now() - timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+
+
+def horizon():
+    # Nothing newer than this is in the archive
+    cached = cache.get(HORIZON_KEY)
+    if cached is None:
+        cached = (ArchivedTransaction.objects.aggregate(newest=Max('timestamp'))['newest'],)
+        cache.add(HORIZON_KEY, cached, HORIZON_TIMEOUT)
+    return max(filter(None, [cached[0], cutoff()]))
+
+
+async def ahorizon():
+    cached = await cache.aget(HORIZON_KEY)
+    if cached is None:
+        cached = ((await ArchivedTransaction.objects.aaggregate(newest=Max('timestamp')))['newest'],)
+        await cache.aadd(HORIZON_KEY, cached, HORIZON_TIMEOUT)
+    return max(filter(None, [cached[0], cutoff()]))
+
+
+def reaches(start=None):
+    # Whether history from ``start`` on (None: all of it) may be archived
+    return start is None or start <= horizon()
+
+
+async def areaches(start=None):
+    return start is None or start <= await ahorizon()
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def merged(hot, cold, key=attrgetter('timestamp', 'pk'), reverse=False):
+    # Merges two row iterables sorted the same way into one, lazily, so
+    # chunked iterators stay chunked
+    return heapq.merge(hot, cold, key=key, reverse=reverse)
+
+
+def archive_batch(before, batch_size=BATCH_SIZE):
+    """
+    Moves up to ``batch_size`` of the oldest archivable rows older than
+    ``before`` to the archive in one DB transaction, and returns how many
+    were moved. Safe to stop at any point: a batch either moves or doesn't.
+    """
+    rows = list(
+        Transaction.objects.filter(timestamp__lt=before, transaction_type__in=ARCHIVED_TYPES)
+        .order_by('timestamp', 'id')[:batch_size]
+    )
+    if not rows:
+        return 0
+
+    # Move the horizon first: until the batch commits, readers that think
+    # the archive reaches further than it does only run one query too many
+    newest = rows[-1].timestamp
+    cached = cache.get(HORIZON_KEY)
+    if cached is None or cached[0] is None or newest > cached[0]:
+        cache.set(HORIZON_KEY, (newest,), HORIZON_TIMEOUT)
+
+    with db_transaction.atomic():
+        ArchivedTransaction.objects.bulk_create(
+            [
+                ArchivedTransaction(
+                    id=row.pk,
+                    account_id=row.account_id,
+                    amount=row.amount,
+                    balance_after_transaction=row.balance_after_transaction,
+                    transaction_type=row.transaction_type,
+                    timestamp=row.timestamp,
+                    loan_approve=row.loan_approve,
+                )
+                for row in rows
+            ]
+        )
+        Transaction.objects.filter(pk__in=[row.pk for row in rows]).delete()
+    return len(rows)
@@ -0,0 +1,108 @@
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpResponseBadRequest
+from django.views import View
+from django.views.generic.base import ContextMixin, TemplateResponseMixin
+
+from .models import Transaction, ArchivedTransaction
+from .constants import LOAN
+from . import archive
+from .idempotency import new_key
+from .pagination import akeyset_page, encode_cursor, InvalidCursor
+from .snapshots import aperiod_summary
+from .summary import aget_account_summary, asummary_key, RECENT_TRANSACTIONS
+from .views import get_date_range, filter_date_range, report_cache_timeout, DATE_RANGE_ERROR
+
+
+# Native async versions of the read-heavy pages, used instead of the ones in
+# views.py when settings.ASYNC_VIEWS is on (the ASGI profile,
+# empty_bank/settings_asgi.py). They render the same templates with the same
+# context. Under WSGI every async view would get an event loop of its own,
+# so the sync views stay the default there. `manage.py bench_asgi` compares
+# the two.
+
+
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+    # request.user loads the session synchronously, which isn't allowed on
+    # the event loop; the user is loaded with request.auser() and kept on
+    # self.user instead
+    async def dispatch(self, request, *args, **kwargs):
+        self.user = await request.auser()
+        if not self.user.is_authenticated:
+            return redirect_to_login(request.get_full_path(), self.get_login_url(), self.get_redirect_field_name())
+        return await super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
+
+
+class TransactionReportView(AsyncLoginRequiredMixin, TemplateResponseMixin, ContextMixin, View):
+    template_name = 'transactions/transaction_report.html'
+    page_size = RECENT_TRANSACTIONS
+    replica_reads = True # See core/routers.py
+
+    async def get(self, request):
+        try:
+            date_range = get_date_range(request)
+        except ValueError:
+            return HttpResponseBadRequest(DATE_RANGE_ERROR)
+        # Read before the rows, see views.TransactionReportView
+        summary_version = await asummary_key(self.user.pk)
+        account_summary = await aget_account_summary(self.user)
+        account = account_summary['account']
+        after = request.GET.get('after')
+        before = request.GET.get('before')
+        summary = None
+
+        if not (date_range or after or before):
+            balance = account_summary['balance']
+            rows = account_summary['recent_transactions']
+            next_cursor = encode_cursor(rows[-1]) if account_summary['has_more'] else None
+            previous_cursor = None
+        else:
+            queryset = Transaction.objects.filter(account=account)
+            archived = ArchivedTransaction.objects.filter(account=account)
+            if date_range:
+                start_date, end_date = date_range
+                queryset = filter_date_range(queryset, start_date, end_date)
+                if await archive.areaches(archive.day_start(start_date)):
+                    archived = filter_date_range(archived, start_date, end_date)
+                else:
+                    archived = None
+                summary = await aperiod_summary(account, start_date, end_date)
+                balance = summary['closing_balance']
+            else:
+                balance = account_summary['balance']
+            try:
+                rows, next_cursor, previous_cursor = await akeyset_page(
+                    queryset, self.page_size, after=after, before=before, archive=archived,
+                )
+            except InvalidCursor:
+                return HttpResponseBadRequest("Invalid page cursor")
+
+        return self.render_to_response(self.get_context_data(
+            object_list=rows,
+            account=account,
+            balance=balance,
+            summary=summary,
+            start_date=request.GET.get('start_date'),
+            end_date=request.GET.get('end_date'),
+            next_cursor=next_cursor,
+            previous_cursor=previous_cursor,
+            summary_version=summary_version,
+            report_cache_timeout=report_cache_timeout(),
+            # Saves the navbar a second, synchronous summary lookup
+            account_summary=account_summary,
+        ))
+
+
+class LoanListView(AsyncLoginRequiredMixin, TemplateResponseMixin, ContextMixin, View):
+    template_name = 'transactions/loan_request.html'
+    replica_reads = True
+
+    async def get(self, request):
+        account_summary = await aget_account_summary(self.user)
+        loans = Transaction.objects.filter(account=account_summary['account'], transaction_type=LOAN)
+        return self.render_to_response(self.get_context_data(
+            loans=[loan async for loan in loans.aiterator()],
+            # Each Pay Loan link gets its own key, see idempotency.py
+            idempotency_key=new_key(),
+            account_summary=account_summary,
+        ))
@@ -0,0 +1,147 @@
+import os
+import random
+import statistics
+import tempfile
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction as db_transaction
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from .models import Transaction, DailyBalance
+from .constants import DEPOSIT, WITHDRAWAL
+
+
+# Helpers shared by the benchmark commands: a throwaway database, bulk
+# seeding and latency statistics.
+
+SEED_BATCH_SIZE = 5000
+SEED_DAYS = 365
+
+
+@contextmanager
+def throwaway_database(name):
+    # Creates the test database (a temp file for SQLite, so every thread and
+    # process gets a real connection of its own) and drops it afterwards
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    if connection.vendor == 'sqlite':
+        test_settings['NAME'] = os.path.join(tempfile.mkdtemp(), f'{name}.sqlite3')
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+@contextmanager
+def backdated_timestamps():
+    # auto_now_add would stamp every seeded row with the current time
+    field = Transaction._meta.get_field('timestamp')
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def seed_accounts(users, transactions, seed=0):
+    """
+    Creates ``users`` users with accounts and ``transactions`` deposits and
+    withdrawals spread over them and over the last SEED_DAYS days, with
+    matching balances and DailyBalance rows. Returns the accounts.
+    """
+    rng = random.Random(seed)
+    password = make_password(None)
+    with db_transaction.atomic():
+        User.objects.bulk_create(
+            [User(username=f'bench{i}', email=f'bench{i}@example.com', password=password) for i in range(users)],
+            batch_size=SEED_BATCH_SIZE,
+        )
+        user_ids = User.objects.filter(username__startswith='bench').order_by('id').values_list('id', flat=True)
+        UserBankAccount.objects.bulk_create(
+            [
+                UserBankAccount(user_id=user_id, account_type='Savings', gender='Male', account_no=100000 + i)
+                for i, user_id in enumerate(user_ids)
+            ],
+            batch_size=SEED_BATCH_SIZE,
+        )
+    accounts = list(UserBankAccount.objects.select_related('user').order_by('account_no'))
+
+    per_account, extra = divmod(transactions, len(accounts)) if accounts else (0, 0)
+    snapshots = []
+    rows = (
+        row
+        for i, account in enumerate(accounts)
+        for row in _account_history(account, per_account + (i < extra), rng, snapshots)
+    )
+    with backdated_timestamps():
+        while True:
+            batch = list(islice(rows, SEED_BATCH_SIZE))
+            if not batch:
+                break
+            Transaction.objects.bulk_create(batch)
+
+    DailyBalance.objects.bulk_create(snapshots, batch_size=SEED_BATCH_SIZE)
+    UserBankAccount.objects.bulk_update(accounts, ['balance'], batch_size=SEED_BATCH_SIZE)
+    return accounts
+
+
+def _account_history(account, count, rng, snapshots):
+    # Yields the account's transactions oldest first and appends one
+    # DailyBalance per day; leaves the closing balance on the account
+    end = timezone.now() - timedelta(hours=1)
+    timestamp = end - timedelta(days=SEED_DAYS)
+    step = timedelta(days=SEED_DAYS) / max(count, 1)
+    balance = Decimal(0)
+    deposits = withdrawals = Decimal(0)
+    day = snapshot = None
+    for _ in range(count):
+        timestamp += step
+        amount = Decimal(rng.randrange(100, 5000))
+        if balance >= 500 and rng.random() < 0.4:
+            kind, amount = WITHDRAWAL, min(max(amount, Decimal(500)), balance)
+            balance -= amount
+            withdrawals += amount
+        else:
+            kind = DEPOSIT
+            balance += amount
+            deposits += amount
+        yield Transaction(
+            account=account,
+            amount=amount,
+            transaction_type=kind,
+            balance_after_transaction=balance,
+            timestamp=timestamp,
+        )
+
+        if timezone.localdate(timestamp) != day:
+            day = timezone.localdate(timestamp)
+            snapshot = DailyBalance(account=account, date=day)
+            snapshots.append(snapshot)
+        snapshot.closing_balance = balance
+        snapshot.deposit_total = deposits
+        snapshot.withdrawal_total = withdrawals
+    account.balance = balance
+
+
+def latency_summary(latencies, elapsed):
+    # Seconds in, milliseconds out
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = latencies[0] if latencies else 0
+    return {
+        'requests': len(latencies),
+        'seconds': round(elapsed, 3),
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else 0,
+        'mean_ms': round(statistics.fmean(latencies) * 1000, 3) if latencies else 0,
+        'p50_ms': round(p50 * 1000, 3),
+        'p95_ms': round(p95 * 1000, 3),
+        'p99_ms': round(p99 * 1000, 3),
+    }
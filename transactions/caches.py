@@ -0,0 +1,15 @@
+from django.conf import settings
+
+
+# Backends whose entries only the process that wrote them can see. The
+# account summaries and their versions (summary.py) and the quota counters
+# (quotas.py) are only kept in the cache when every process shares it.
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_shared():
+    # Whether every process serving requests sees the same default cache
+    return settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+from . import caches
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    # Without a shared cache, account summaries and report tables are built
+    # on every request and the quotas are counted in the database: correct
+    # with any number of workers, but slower.
+    if caches.is_shared():
+        return []
+    backend = settings.CACHES['default']['BACKEND']
+    return [Warning(
+        f'The default cache ({backend}) is not shared between processes.',
+        hint=(
+            'Set EMPTY_BANK_REDIS_URL so account summaries are cached and '
+            'quotas are counted in the cache.'
+        ),
+        id='transactions.W001',
+    )]
@@ -9,4 +9,39 @@ TRANSACTION_TYPES = (
     (WITHDRAWAL, 'Withdrawal'),
     (LOAN, 'Loan'),
     (LOAN_PAID, 'Loan Repayment'),
-)
\ No newline at end of file
+)
+
+# Notification outbox states
+NOTIFICATION_PENDING = 1
+NOTIFICATION_SENT = 2
+NOTIFICATION_FAILED = 3
+
+NOTIFICATION_STATUSES = (
+    (NOTIFICATION_PENDING, 'Pending'),
+    (NOTIFICATION_SENT, 'Sent'),
+    (NOTIFICATION_FAILED, 'Failed'),
+)
+
+# Ledger books (see ledger.py). CUSTOMER entries belong to an account, the
+# others are the bank's side of each posting.
+BOOK_CUSTOMER = 1
+BOOK_CASH = 2
+BOOK_LOANS = 3
+BOOK_SUSPENSE = 4
+
+LEDGER_BOOKS = (
+    (BOOK_CUSTOMER, 'Customer'),
+    (BOOK_CASH, 'Cash'),
+    (BOOK_LOANS, 'Loans'),
+    (BOOK_SUSPENSE, 'Suspense'),
+)
+
+# Ledger posting kinds: the transaction types (LOAN is an approved loan being
+# credited), plus the two that have no Transaction type of their own
+LOAN_REVERSED = 5
+ADJUSTMENT = 6
+
+POSTING_TYPES = TRANSACTION_TYPES + (
+    (LOAN_REVERSED, 'Loan Reversal'),
+    (ADJUSTMENT, 'Adjustment'),
+)
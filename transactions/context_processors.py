@@ -0,0 +1,10 @@
+from django.utils.functional import SimpleLazyObject
+
+from .summary import get_account_summary
+
+
+def account_summary(request):
+    # Lazy, so pages that never show the balance don't touch the cache
+    if not request.user.is_authenticated:
+        return {}
+    return {'account_summary': SimpleLazyObject(lambda: get_account_summary(request.user))}
@@ -2,6 +2,7 @@ from django import forms
 from django.db.models import Sum
 from .models import Transaction
 from .constants import DEPOSIT, WITHDRAWAL, LOAN, LOAN_PAID
+from . import shards
 
 
 class TransactionForm(forms.ModelForm):
@@ -11,6 +12,9 @@ class TransactionForm(forms.ModelForm):
         
     def __init__(self, *args, **kwargs):
         self.account = kwargs.pop('account')
+        # The balance to check against, when the caller already has it
+        # (a batch's running balance). Read from the account otherwise.
+        self.balance = kwargs.pop('balance', None)
         super().__init__(*args, **kwargs)
         self.fields['transaction_type'].disabled = True
         self.fields['transaction_type'].widget = forms.HiddenInput()
@@ -35,7 +39,7 @@ class WithdrawalForm(TransactionForm):
         account = self.account
         min_withdrawal_amount = 500                                                        
         max_withdrawal_amount = 20000
-        balance = account.balance
+        balance = shards.balance(account) if self.balance is None else self.balance
         amount = self.cleaned_data.get('amount')
         if amount < min_withdrawal_amount:
             raise forms.ValidationError(f"You need to withdraw at least {min_withdrawal_amount} $")
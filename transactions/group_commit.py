@@ -0,0 +1,139 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction as db_transaction
+
+from .models import Transaction
+from . import idempotency, services
+
+
+# Group commit for deposits, on with settings.GROUP_COMMIT_DEPOSITS. A
+# deposit is handed to one committer thread per process instead of opening
+# a DB transaction of its own. The committer takes the first deposit
+# waiting, gathers whatever else arrives within GROUP_COMMIT_WINDOW_MS (up
+# to GROUP_COMMIT_MAX_BATCH) and writes them all with services.apply_batch:
+# one DB transaction, one INSERT per table, one balance UPDATE per account.
+# Every request waits for its own deposit and gets its own Transaction back,
+# or the error that failed the group. A deposit's idempotency key is
+# completed in the same DB transaction (see idempotency.py). A request that waits longer than
+# GROUP_COMMIT_TIMEOUT cancels its deposit if the committer hasn't taken it
+# yet. If it has, the deposit may still commit and complete the key, so the
+# key is left in progress (DepositPending) rather than handed back.
+#
+# Only worth it with several requests in flight per process (a threaded
+# WSGI server); with one at a time every deposit just waits out the window.
+
+class DepositFailed(Exception):
+    pass
+
+
+class DepositPending(DepositFailed):
+    # Timed out after the committer took the deposit
+    pass
+
+
+class Committer:
+    def __init__(self, window, max_batch):
+        self.window = window # Seconds
+        self.max_batch = max_batch
+        self.queue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def submit(self, account, amount, key=None, location=''):
+        # Returns a Future for the deposit's Transaction row. key is the
+        # request's IdempotencyKey row, completed with a redirect to
+        # location when the deposit commits.
+        future = Future()
+        self.queue.put((account, amount, future, (key, location)))
+        with self.lock:
+            # Not alive in a forked child either
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='deposit-committer', daemon=True)
+                self.thread.start()
+        return future
+
+    def run(self):
+        while True:
+            # Deposits cancelled by a request that gave up waiting are
+            # dropped; the rest can't be cancelled from here on
+            batch = [item for item in self.gather() if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                self.commit(batch)
+            except Exception as e:
+                # Whatever failed, no request is left waiting and the thread
+                # lives on. The next group gets a fresh connection.
+                for _, _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                connection.close()
+
+    def gather(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def commit(self, batch):
+        entries = [
+            (number, {'account_no': account.account_no, 'type': 'deposit', 'amount': amount})
+            for number, (account, amount, _, _) in enumerate(batch)
+        ]
+        results = write(entries, [completion for _, _, _, completion in batch])
+        rows = Transaction.objects.in_bulk([result['id'] for result in results if result['ok']])
+
+        for (account, _, future, _), result in zip(batch, results):
+            if result['ok']:
+                account.balance = Decimal(result['balance_after'])
+                future.set_result(rows[result['id']])
+            else:
+                future.set_exception(DepositFailed(' '.join(result['errors'])))
+
+
+@services.retry_on_lock
+def write(entries, completions):
+    with db_transaction.atomic():
+        results = services.apply_batch(entries)
+        # apply_batch answers in the order it was given the entries
+        for (key, location), result in zip(completions, results):
+            if key is not None and result['ok']:
+                idempotency.complete(key, 302, location)
+    return results
+
+
+_committer = None
+_committer_lock = threading.Lock()
+
+
+def committer():
+    global _committer
+    with _committer_lock:
+        if _committer is None:
+            _committer = Committer(settings.GROUP_COMMIT_WINDOW_MS / 1000, settings.GROUP_COMMIT_MAX_BATCH)
+        return _committer
+
+
+def deposit(account, amount, key=None, location=''):
+    # Same as services.deposit, through the committer. Raises DepositFailed
+    # if the deposit was refused or timed out, DepositPending if it timed
+    # out and may still be made.
+    future = committer().submit(account, amount, key, location)
+    try:
+        return future.result(timeout=settings.GROUP_COMMIT_TIMEOUT)
+    except TimeoutError:
+        if future.cancel():
+            raise DepositFailed("The deposit timed out and was not made, please try again")
+        raise DepositPending("The deposit timed out, check your transaction report before trying again")
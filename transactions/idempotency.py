@@ -0,0 +1,188 @@
+import hashlib
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction as db_transaction
+from django.db.models import Q
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect
+from django.utils import timezone
+
+from .models import IdempotencyKey
+from . import services
+
+
+# Idempotency keys for the views that move money. The client sends a key as
+# the Idempotency-Key header or an idempotency_key form/query field (our
+# forms and links carry a fresh one). The first request with a key claims
+# it with a unique row; a retry with the same key gets the first request's
+# redirect back and never reaches the view. The outcome is written to the
+# row in the DB transaction that moves the money, so a crash can't leave
+# the money moved and the key unfinished, and finished outcomes are cached,
+# so a retry storm costs one cache lookup per request.
+
+TTL = timedelta(hours=24)
+# A key still in progress after this long belongs to a request that died
+# before its transaction committed, so nothing moved and a retry may take
+# it over. Longer than any request can run (GROUP_COMMIT_TIMEOUT, lock
+# retries), and than the group committer holds a deposit whose request
+# stopped waiting for it.
+STALE = timedelta(minutes=2)
+WAIT = 5 # Seconds a retry waits for the first request to finish
+POLL_INTERVAL = 0.05
+MAX_LENGTH = 64
+FIELD = 'idempotency_key'
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+UNSIGNED_FIELDS = {'csrfmiddlewaretoken', FIELD}
+
+
+def new_key():
+    return uuid.uuid4().hex
+
+
+def request_key(request):
+    return request.META.get(HEADER) or request.POST.get(FIELD) or request.GET.get(FIELD)
+
+
+def fingerprint(request):
+    # Same key with a different amount or URL is a client bug, not a retry
+    digest = hashlib.sha256(f'{request.method} {request.path}'.encode())
+    for name, values in sorted(request.POST.lists()):
+        if name not in UNSIGNED_FIELDS:
+            digest.update(f'\n{name}={values}'.encode())
+    return digest.hexdigest()
+
+
+def cache_key(user_id, key):
+    return f'idempotency:{user_id}:{key}'
+
+
+def claim(user, key, fingerprint):
+    # Returns (row, created). An expired or stale row is taken over as if
+    # it weren't there.
+    try:
+        with db_transaction.atomic():
+            return IdempotencyKey.objects.create(user=user, key=key, fingerprint=fingerprint), True
+    except IntegrityError:
+        pass
+    now = timezone.now()
+    taken_over = IdempotencyKey.objects.filter(
+        Q(created_at__lt=now - TTL) | Q(status_code=None, created_at__lt=now - STALE),
+        user=user,
+        key=key,
+    ).update(
+        fingerprint=fingerprint, status_code=None, location='', created_at=now,
+    )
+    row = IdempotencyKey.objects.filter(user=user, key=key).first()
+    if row is None:
+        # Handed back by a failed request in the meantime
+        return claim(user, key, fingerprint)
+    return row, bool(taken_over)
+
+
+def complete(row, status_code, location):
+    # Call it inside the DB transaction that moves the money
+    IdempotencyKey.objects.filter(pk=row.pk).update(status_code=status_code, location=location)
+    key = cache_key(row.user_id, row.key)
+    outcome = (row.fingerprint, status_code, location)
+    db_transaction.on_commit(lambda: cache.set(key, outcome, TTL.total_seconds()))
+
+
+def wait_for(row):
+    # Polls until the request holding the key has finished, or WAIT passes
+    deadline = time.monotonic() + WAIT
+    while row.status_code is None and time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        row = IdempotencyKey.objects.filter(pk=row.pk).first()
+        if row is None:
+            # The first request failed and handed the key back
+            return None
+    return row
+
+
+def replay(fingerprint, stored_fingerprint, status_code, location):
+    if fingerprint != stored_fingerprint:
+        return HttpResponse('This idempotency key was used for a different request.', status=422)
+    response = HttpResponseRedirect(location, status=status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+class IdempotentMixin:
+    """
+    For views that move money. A request with an idempotency key is handled
+    once; retries get the redirect the first one returned. Only redirects
+    are remembered: a form re-rendered with errors hands the key back so
+    the corrected form can be sent again. A view that redirects after a
+    failure worth retrying sets ``self.retryable = True`` to do the same.
+    A view whose money may still move after it has answered sets
+    ``self.key_pending = True``: the key stays in progress, so retries wait
+    for the outcome or get a 409, and the form is sent back with it.
+
+    The view runs in one DB transaction with the key's outcome. A view that
+    moves the money in a transaction of its own returns True from
+    completes_key() and calls complete(self.idempotency_key, ...) in it.
+    """
+    idempotent_methods = ('POST',)
+    retryable = False
+    key_pending = False
+    idempotency_key = None
+
+    def completes_key(self):
+        return False
+
+    def remembers(self, response):
+        return response.status_code in (301, 302, 303, 307, 308) and not self.retryable
+
+    def dispatch(self, request, *args, **kwargs):
+        key = request_key(request)
+        if not key or request.method not in self.idempotent_methods or not request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+        if len(key) > MAX_LENGTH:
+            return HttpResponseBadRequest(f'Idempotency keys are at most {MAX_LENGTH} characters.')
+
+        request_fingerprint = fingerprint(request)
+        stored = cache.get(cache_key(request.user.pk, key))
+        if stored:
+            return replay(request_fingerprint, *stored)
+
+        row, created = claim(request.user, key, request_fingerprint)
+        if not created:
+            row = wait_for(row)
+            if row is not None and row.status_code is not None:
+                return replay(request_fingerprint, row.fingerprint, row.status_code, row.location)
+            if row is None:
+                # The first request failed and handed the key back, this
+                # one gets to run instead
+                row, created = claim(request.user, key, request_fingerprint)
+            if not created:
+                return HttpResponse('A request with this idempotency key is still being processed.', status=409)
+
+        self.idempotency_key = row
+        try:
+            if self.completes_key():
+                response = super().dispatch(request, *args, **kwargs)
+            else:
+                response = self.dispatch_atomically(request, *args, **kwargs)
+        except BaseException:
+            row.delete()
+            raise
+        if not self.remembers(response) and not self.key_pending:
+            row.delete()
+        return response
+
+    @services.retry_on_lock
+    def dispatch_atomically(self, request, *args, **kwargs):
+        # The services can't retry a lock timeout inside this block, so the
+        # whole request is retried instead
+        with db_transaction.atomic():
+            response = super().dispatch(request, *args, **kwargs)
+            if self.remembers(response):
+                complete(self.idempotency_key, response.status_code, response['Location'])
+        return response
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['idempotency_key'] = self.idempotency_key.key if self.key_pending else new_key()
+        return context
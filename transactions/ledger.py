@@ -0,0 +1,163 @@
+from decimal import Decimal
+
+from django.db import transaction as db_transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Count, Max, Value, DecimalField, BigIntegerField, IntegerField
+from django.db.models.functions import Coalesce
+
+from accounts.models import UserBankAccount
+from .models import LedgerPosting, LedgerEntry, LedgerCheckpoint, BalanceShard
+from .constants import (
+    DEPOSIT, WITHDRAWAL, LOAN, LOAN_PAID, LOAN_REVERSED, ADJUSTMENT,
+    BOOK_CUSTOMER, BOOK_CASH, BOOK_LOANS, BOOK_SUSPENSE,
+)
+from . import shards
+
+
+# Append-only double-entry ledger. Every money movement is a LedgerPosting
+# with two LedgerEntry rows that sum to zero: the customer's side and the
+# bank's (cash for deposits and withdrawals, loans receivable for loans).
+# Nothing is ever updated; a loan reversal is a posting of its own, and a
+# repaid loan keeps both its LOAN and LOAN_PAID postings even though its
+# Transaction row now says LOAN_PAID. Deleting an account only detaches its
+# entries (account becomes NULL), they stay in the books.
+#
+# The ledger is an audit trail, not the source of the balance.
+# UserBankAccount.balance (plus its shards, see shards.py) stays the
+# balance that views, forms and the overdraft check read, and services.py
+# still moves it with the same hot-row UPDATE. The postings are inserted in
+# that DB transaction while it holds the account's row lock, so they add
+# two INSERTs per movement and take nothing away from contention on the
+# row. Checkpoints (`manage.py ledger_checkpoint`) only keep the drift
+# check cheap: it sums an account's entries since its last checkpoint and
+# reports accounts whose balance column disagrees.
+
+BATCH_SIZE = 1000
+
+# posting kind: (sign of the customer's entry, the bank's book)
+POSTINGS = {
+    DEPOSIT: (1, BOOK_CASH),
+    WITHDRAWAL: (-1, BOOK_CASH),
+    LOAN: (1, BOOK_LOANS),
+    LOAN_REVERSED: (-1, BOOK_LOANS),
+    LOAN_PAID: (-1, BOOK_LOANS),
+    # Signed amount: corrections to the customer's balance
+    ADJUSTMENT: (1, BOOK_SUSPENSE),
+}
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+CENTS = Decimal('0.01')
+
+
+def entries(posting, account, amount):
+    sign, book = POSTINGS[posting.kind]
+    return [
+        LedgerEntry(posting=posting, book=BOOK_CUSTOMER, account=account, amount=sign * amount),
+        LedgerEntry(posting=posting, book=book, amount=-sign * amount),
+    ]
+
+
+def post(kind, account, amount, transaction_id=None):
+    # Must be called inside the atomic block that moves the balance
+    posting = LedgerPosting.objects.create(kind=kind, transaction_id=transaction_id)
+    LedgerEntry.objects.bulk_create(entries(posting, account, amount))
+    return posting
+
+
+def post_many(movements):
+    # movements is a list of (kind, account, amount, transaction id); one
+    # INSERT per table per BATCH_SIZE movements
+    postings = LedgerPosting.objects.bulk_create(
+        [LedgerPosting(kind=kind, transaction_id=transaction_id) for kind, _, _, transaction_id in movements],
+        batch_size=BATCH_SIZE,
+    )
+    LedgerEntry.objects.bulk_create(
+        [
+            entry
+            for posting, (_, account, amount, _) in zip(postings, movements)
+            for entry in entries(posting, account, amount)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    return postings
+
+
+def with_ledger_state(accounts):
+    """
+    Annotates an account queryset with its latest checkpoint
+    (checkpoint_entry, checkpoint_balance) and the entries after it
+    (recent_total, recent_count, last_entry), and ledger_balance.
+    """
+    checkpoints = LedgerCheckpoint.objects.filter(account=OuterRef('pk')).order_by('-entry_id')
+    recent = (
+        LedgerEntry.objects.filter(account=OuterRef('pk'), id__gt=OuterRef('checkpoint_entry'))
+        .values('account')
+    )
+    return accounts.annotate(
+        checkpoint_entry=Coalesce(Subquery(checkpoints.values('entry_id')[:1]), 0, output_field=BigIntegerField()),
+        checkpoint_balance=Coalesce(Subquery(checkpoints.values('balance')[:1]), Value(Decimal(0)), output_field=MONEY),
+    ).annotate(
+        recent_total=Coalesce(
+            Subquery(recent.annotate(total=Sum('amount')).values('total')), Value(Decimal(0)), output_field=MONEY,
+        ),
+        recent_count=Coalesce(
+            Subquery(recent.annotate(count=Count('id')).values('count')), 0, output_field=IntegerField(),
+        ),
+        last_entry=Subquery(recent.annotate(last=Max('id')).values('last')),
+        ledger_balance=F('checkpoint_balance') + F('recent_total'),
+    )
+
+
+def balance(account):
+    # The account's balance as the ledger has it
+    accounts = with_ledger_state(UserBankAccount.objects.filter(pk=account.pk))
+    return Decimal(accounts.values_list('ledger_balance', flat=True).get()).quantize(CENTS)
+
+
+def checkpoint(start, end, min_entries=1):
+    """
+    Checkpoints every account with id in [start, end) that has at least
+    ``min_entries`` entries since its last checkpoint, and drops the older
+    checkpoints of those accounts. Returns (checkpoints written, [(account
+    id, account_no, balance, ledger balance)] for accounts whose balance
+    columns, shards included, don't match the ledger).
+    """
+    with db_transaction.atomic():
+        # Posting to an account takes its row lock (see services.py), or a
+        # shard's for a sharded account's deposit. With both locked, every
+        # entry of these accounts has committed and no new one can until the
+        # checkpoints are in.
+        in_range = UserBankAccount.objects.filter(pk__gte=start, pk__lt=end)
+        list(in_range.select_for_update().values_list('pk', flat=True))
+        list(
+            BalanceShard.objects.select_for_update()
+            .filter(account_id__gte=start, account_id__lt=end)
+            .values_list('pk', flat=True)
+        )
+        accounts = with_ledger_state(shards.with_total(in_range)).values_list(
+            'pk', 'account_no', 'total_balance', 'ledger_balance', 'recent_count', 'last_entry',
+        )
+
+        written = []
+        drifted = []
+        for pk, account_no, column, ledger_balance, recent_count, last_entry in accounts:
+            ledger_balance = Decimal(ledger_balance).quantize(CENTS)
+            column = Decimal(column).quantize(CENTS)
+            if column != ledger_balance:
+                drifted.append((pk, account_no, column, ledger_balance))
+            if recent_count and recent_count >= min_entries:
+                written.append(LedgerCheckpoint(account_id=pk, entry_id=last_entry, balance=ledger_balance))
+
+        LedgerCheckpoint.objects.bulk_create(written, batch_size=BATCH_SIZE)
+        if written:
+            newest = LedgerCheckpoint.objects.filter(account=OuterRef('account')).order_by('-entry_id').values('entry_id')[:1]
+            LedgerCheckpoint.objects.filter(
+                account_id__gte=start, account_id__lt=end, entry_id__lt=Subquery(newest),
+            ).delete()
+    return len(written), drifted
+
+
+def trial_balance():
+    # {book: total}; the totals of all books sum to zero
+    return dict(
+        LedgerEntry.objects.values('book').annotate(total=Sum('amount')).values_list('book', 'total')
+    )
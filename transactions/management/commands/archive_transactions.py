@@ -0,0 +1,50 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions import archive
+from transactions.quotas import QUOTAS
+
+
+class Command(BaseCommand):
+    help = (
+        'Move transactions older than settings.ARCHIVE_AFTER_DAYS to the '
+        'archive table, in batches of one DB transaction each. Stopping it at '
+        'any point is safe; run it again to carry on.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE)
+        parser.add_argument('--limit', type=int, help='Stop after moving this many rows')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds between batches, to leave room for other writers')
+
+    def handle(self, *args, **options):
+        longest_window = max(window for window, *_ in QUOTAS.values())
+        if timedelta(days=settings.ARCHIVE_AFTER_DAYS) <= longest_window:
+            raise CommandError(
+                f'ARCHIVE_AFTER_DAYS must be more than {longest_window.days} days, '
+                'quotas are counted from the hot table'
+            )
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+
+        # Fixed for the run, so a long run doesn't chase rows aging in
+        cutoff = archive.cutoff()
+        self.stdout.write(f'Archiving transactions older than {cutoff:%Y-%m-%d %H:%M}')
+        moved = 0
+        started = time.perf_counter()
+        while options['limit'] is None or moved < options['limit']:
+            batch_size = options['batch_size']
+            if options['limit'] is not None:
+                batch_size = min(batch_size, options['limit'] - moved)
+            count = archive.archive_batch(cutoff, batch_size)
+            if not count:
+                break
+            moved += count
+            self.stdout.write(f'{moved} moved')
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        self.stdout.write(self.style.SUCCESS(f'Done: {moved} transactions archived in {time.perf_counter() - started:.1f}s'))
@@ -0,0 +1,217 @@
+import json
+import platform
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import F
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from core import metrics
+from transactions.bench import throwaway_database, seed_accounts, latency_summary
+from transactions.models import Transaction
+from transactions.constants import LOAN, LOAN_PAID
+
+
+# flow name: URL name the metrics middleware files its requests under
+FLOWS = {
+    'deposit': 'deposit',
+    'withdrawal': 'withdrawal',
+    'loan_request': 'loan_request',
+    'pay_loan': 'pay_loan',
+    'report': 'transaction_report',
+    'report_filtered': 'transaction_report',
+    'loan_list': 'loan_list',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a throwaway database and time the deposit, withdrawal, loan and '
+        'report pages through the test client. Writes a JSON result file that '
+        'a later run can be compared against with --compare.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--transactions', type=int, default=1000000, help='Transaction rows to seed')
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per flow')
+        parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per flow')
+        parser.add_argument('--flows', nargs='+', choices=FLOWS, default=list(FLOWS))
+        parser.add_argument('--output', default='bench.json')
+        parser.add_argument('--compare', help='Earlier result file to compare against')
+        parser.add_argument('--threshold', type=float, default=10,
+                            help='Percent p95 increase or throughput drop counted as a regression')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('--users must be at least 1')
+        # The test client sends Host: testserver. Quotas are still checked,
+        # but set high enough that the flows never run into them.
+        unlimited = {account_type: dict.fromkeys(limits, 10 ** 9) for account_type, limits in settings.ACCOUNT_QUOTAS.items()}
+        with throwaway_database('bench'), override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            ACCOUNT_QUOTAS=unlimited,
+        ):
+            result = self.run_benchmark(options)
+
+        with open(options['output'], 'w') as f:
+            json.dump(result, f, indent=2)
+        self.stdout.write(f"Results written to {options['output']}")
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                previous = json.load(f)
+            regressions = self.compare(previous, result, options['threshold'])
+            if regressions:
+                raise CommandError(f"Regressed: {', '.join(regressions)}")
+
+    def run_benchmark(self, options):
+        self.rng = random.Random(options['seed'])
+
+        started = time.perf_counter()
+        accounts = seed_accounts(options['users'], options['transactions'], seed=options['seed'])
+        seed_seconds = time.perf_counter() - started
+        self.stdout.write(
+            f"Seeded {len(accounts)} accounts and {options['transactions']} transactions in {seed_seconds:.1f}s"
+        )
+
+        clients = []
+        for account in accounts:
+            client = Client()
+            client.force_login(account.user)
+            clients.append((client, account))
+
+        flows = {}
+        for name in options['flows']:
+            self.run_flow(name, clients, options['warmup'])
+            before = metrics.snapshot().get(FLOWS[name], {})
+            latencies, errors, elapsed = self.run_flow(name, clients, options['requests'])
+            after = metrics.snapshot().get(FLOWS[name], {})
+
+            flows[name] = latency_summary(latencies, elapsed)
+            flows[name]['errors'] = errors
+            requests = after.get('requests', 0) - before.get('requests', 0)
+            if requests:
+                flows[name]['queries_per_request'] = round((after['queries'] - before['queries']) / requests, 2)
+                flows[name]['sql_ms_per_request'] = round((after['sql_seconds'] - before['sql_seconds']) / requests * 1000, 3)
+            self.report(name, flows[name])
+
+        return {
+            'started_at': timezone.now().isoformat(),
+            'users': options['users'],
+            'transactions': options['transactions'],
+            'requests_per_flow': options['requests'],
+            'seed_seconds': round(seed_seconds, 1),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'flows': flows,
+        }
+
+    def run_flow(self, name, clients, count):
+        # Returns (latencies, errors, elapsed). Setup that isn't part of the
+        # flow (loan state, approved loans to pay) happens outside the timer.
+        step = getattr(self, f'flow_{name}')
+        latencies = []
+        errors = 0
+        elapsed = 0.0
+        for i in range(count):
+            client, account = clients[i % len(clients)]
+            request = step(account)
+            start = time.perf_counter()
+            response = request(client)
+            latency = time.perf_counter() - start
+            elapsed += latency
+            latencies.append(latency)
+            if not self.succeeded(name, response):
+                errors += 1
+        return latencies, errors, elapsed
+
+    def succeeded(self, name, response):
+        if name == 'pay_loan':
+            # PayLoanView redirects whether or not the loan was paid
+            return Transaction.objects.filter(pk=self.loan_id, transaction_type=LOAN_PAID).exists()
+        expected = 302 if name in ('deposit', 'withdrawal', 'loan_request') else 200
+        return response.status_code == expected
+
+    def flow_deposit(self, account):
+        amount = self.rng.randrange(100, 5000)
+        return lambda client: client.post(reverse('deposit'), {'amount': amount})
+
+    def flow_withdrawal(self, account):
+        amount = self.rng.randrange(500, 1000)
+        return lambda client: client.post(reverse('withdrawal'), {'amount': amount})
+
+    def flow_loan_request(self, account):
+        # Clear the account's loan state so the request isn't refused
+        UserBankAccount.objects.filter(pk=account.pk).update(
+            pending_loan_count=0, outstanding_loan_amount=0,
+        )
+        amount = self.rng.randrange(2000, 10000)
+        return lambda client: client.post(reverse('loan_request'), {'amount': amount})
+
+    def flow_pay_loan(self, account):
+        # An approved loan, credited the way services.approve_loan does it
+        amount = Decimal(self.rng.randrange(2000, 10000))
+        UserBankAccount.objects.filter(pk=account.pk).update(
+            balance=F('balance') + amount,
+            outstanding_loan_amount=F('outstanding_loan_amount') + amount,
+        )
+        loan = Transaction.objects.create(account=account, amount=amount, transaction_type=LOAN, loan_approve=True)
+        self.loan_id = loan.pk
+        return lambda client: client.get(reverse('pay_loan', args=[loan.pk]))
+
+    def flow_report(self, account):
+        return lambda client: client.get(reverse('transaction_report'))
+
+    def flow_report_filtered(self, account):
+        today = timezone.localdate()
+        params = {'start_date': (today - timedelta(days=30)).isoformat(), 'end_date': today.isoformat()}
+        return lambda client: client.get(reverse('transaction_report'), params)
+
+    def flow_loan_list(self, account):
+        return lambda client: client.get(reverse('loan_list'))
+
+    def report(self, name, stats):
+        line = (
+            f"{name:<16} {stats['throughput']:>8.1f} req/s  "
+            f"p50 {stats['p50_ms']:>8.2f}ms  p95 {stats['p95_ms']:>8.2f}ms  p99 {stats['p99_ms']:>8.2f}ms"
+        )
+        if 'queries_per_request' in stats:
+            line += f"  {stats['queries_per_request']:>5} queries"
+        if stats['errors']:
+            line += f"  {stats['errors']} errors"
+        self.stdout.write(line)
+
+    def compare(self, previous, current, threshold):
+        # Returns the names of flows that got slower by more than threshold %
+        self.stdout.write('')
+        self.stdout.write(f"Compared with the run from {previous.get('started_at', '?')}:")
+        regressions = []
+        for name, stats in current['flows'].items():
+            old = previous.get('flows', {}).get(name)
+            if not old:
+                continue
+            p95_change = _percent(old['p95_ms'], stats['p95_ms'])
+            throughput_change = _percent(old['throughput'], stats['throughput'])
+            line = f"{name:<16} p95 {p95_change:+7.1f}%  throughput {throughput_change:+7.1f}%"
+            if p95_change > threshold or throughput_change < -threshold:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(line))
+            else:
+                self.stdout.write(line)
+        return regressions
+
+
+def _percent(old, new):
+    return (new - old) / old * 100 if old else 0.0
@@ -0,0 +1,189 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+# Worker processes import this module before Django is set up, so nothing
+# that touches models is imported at the top
+
+PROFILES = {
+    # name: (settings module, application factory)
+    'wsgi': ('empty_bank.settings', 'django.core.wsgi.get_wsgi_application'),
+    'asgi': ('empty_bank.settings_asgi', 'django.core.asgi.get_asgi_application'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare concurrent-request throughput of the WSGI path (sync views, a '
+        'thread per request as in a threaded WSGI server) with the ASGI profile '
+        '(async views on one event loop). Each profile runs in a process of its '
+        'own against a copy of the same seeded database, requests go straight '
+        'to the application callable, so no server is needed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--transactions', type=int, default=100000, help='Transaction rows to seed')
+        parser.add_argument('--requests', type=int, default=2000, help='Timed requests per profile and concurrency')
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64])
+        parser.add_argument('--profiles', nargs='+', choices=PROFILES, default=list(PROFILES))
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('--users must be at least 1')
+        if connection.vendor != 'sqlite':
+            raise CommandError('bench_asgi copies the seeded database file, which needs SQLite')
+
+        from transactions.bench import throwaway_database, seed_accounts
+
+        workdir = tempfile.mkdtemp()
+        try:
+            with throwaway_database('bench_asgi'):
+                seed_accounts(options['users'], options['transactions'])
+                connection.close()
+                seeded = os.path.join(workdir, 'seeded.sqlite3')
+                shutil.copy(connection.settings_dict['NAME'], seeded)
+
+            self.stdout.write(f"{'profile':<8} {'concurrency':>11} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+            context = multiprocessing.get_context('spawn')
+            for profile in options['profiles']:
+                name = os.path.join(workdir, f'{profile}.sqlite3')
+                shutil.copy(seeded, name)
+                # A fresh process per profile: settings and URLconf differ
+                with context.Pool(1) as pool:
+                    results = pool.apply(serve_profile, (profile, name, options['requests'], options['concurrency']))
+                for concurrency, summary in results:
+                    self.stdout.write(
+                        f"{profile:<8} {concurrency:>11} {summary['throughput']:>9} "
+                        f"{summary['p50_ms']:>9} {summary['p95_ms']:>9} {summary['p99_ms']:>9}"
+                    )
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def serve_profile(profile, name, requests, concurrency_levels):
+    # Runs in a fresh process. Returns [(concurrency, latency summary)].
+    import django
+    settings_module, factory = PROFILES[profile]
+    os.environ['DJANGO_SETTINGS_MODULE'] = settings_module
+    settings.DATABASES['default']['NAME'] = name
+    settings.ALLOWED_HOSTS = ['testserver']
+    django.setup()
+
+    from django.test import Client
+    from django.utils.module_loading import import_string
+    from django.utils import timezone
+    from accounts.models import UserBankAccount
+    from transactions.bench import latency_summary
+
+    application = import_string(factory)()
+    send = send_wsgi if profile == 'wsgi' else send_asgi
+
+    # Logged in sessions, one per user
+    cookies = []
+    for account in UserBankAccount.objects.select_related('user'):
+        client = Client()
+        client.force_login(account.user)
+        cookies.append(f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}")
+    today = timezone.localdate()
+    paths = [
+        '/transactions/transaction_report/',
+        f'/transactions/transaction_report/?start_date={today - timedelta(days=90)}&end_date={today}',
+        '/transactions/loan_list/',
+    ]
+    work = [(paths[i % len(paths)], cookies[i % len(cookies)]) for i in range(requests)]
+
+    # Untimed: loads templates and fills the caches
+    send(application, work[:len(cookies) * len(paths)], 8)
+
+    results = []
+    for concurrency in concurrency_levels:
+        started = time.perf_counter()
+        latencies = send(application, work, concurrency)
+        results.append((concurrency, latency_summary(latencies, time.perf_counter() - started)))
+    return results
+
+
+def send_wsgi(application, work, concurrency):
+    # A thread per in-flight request, like a threaded WSGI server
+    from django.test import RequestFactory
+    factory = RequestFactory()
+
+    def request(item):
+        path, cookie = item
+        environ = factory.get(path, HTTP_COOKIE=cookie).environ
+        statuses = []
+        start = time.perf_counter()
+        response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        try:
+            for _ in response:
+                pass
+        finally:
+            response.close()
+        check_status(path, int(statuses[0].split()[0]))
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        return list(pool.map(request, work))
+
+
+def send_asgi(application, work, concurrency):
+    # Up to ``concurrency`` requests in flight on one event loop, like uvicorn
+    async def request(item, limit):
+        path, cookie = item
+        url = urlsplit(path)
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': url.path,
+            'raw_path': url.path.encode(),
+            'query_string': url.query.encode(),
+            'root_path': '',
+            'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+            'client': ('127.0.0.1', 0),
+            'server': ('testserver', 80),
+        }
+        body_sent = False
+        statuses = []
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            # The client never disconnects; Django cancels this when done
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                statuses.append(message['status'])
+
+        async with limit:
+            start = time.perf_counter()
+            await application(scope, receive, send)
+            check_status(path, statuses[0])
+            return time.perf_counter() - start
+
+    async def run():
+        limit = asyncio.Semaphore(concurrency)
+        return await asyncio.gather(*(request(item, limit) for item in work))
+
+    return asyncio.run(run())
+
+
+def check_status(path, status):
+    if status != 200:
+        raise RuntimeError(f'{path} returned {status}')
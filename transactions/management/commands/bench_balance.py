@@ -0,0 +1,121 @@
+import random
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError
+from django.test.utils import override_settings
+
+from accounts.models import UserBankAccount
+from transactions.models import Transaction
+from transactions.constants import DEPOSIT, WITHDRAWAL
+from transactions import services, quotas
+from transactions.bench import throwaway_database
+
+
+class Command(BaseCommand):
+    help = (
+        'Hammer one account with concurrent deposits and withdrawals and check '
+        'that no balance update was lost. Runs against a throwaway database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--operations', type=int, default=2000, help='Total operations across all threads')
+        parser.add_argument('--mode', choices=['atomic', 'naive'], default='atomic',
+                            help='"naive" replays the old read-modify-save code for comparison')
+
+    def handle(self, *args, **options):
+        # Thousands of withdrawals on one account would run into the daily
+        # quotas within the first second; set them out of reach, like bench
+        unlimited = {account_type: dict.fromkeys(limits, 10 ** 9) for account_type, limits in settings.ACCOUNT_QUOTAS.items()}
+        with throwaway_database('bench_balance'), override_settings(ACCOUNT_QUOTAS=unlimited):
+            self.run_benchmark(options)
+
+    def run_benchmark(self, options):
+        user = User.objects.create_user('bench_balance')
+        account = UserBankAccount.objects.create(user=user, account_type='Savings', gender='Male', account_no=1)
+
+        operation = self.atomic_operation if options['mode'] == 'atomic' else self.naive_operation
+        per_thread = options['operations'] // options['threads']
+        results = []
+
+        def worker(seed):
+            rng = random.Random(seed)
+            deposited = withdrawn = errors = 0
+            try:
+                for _ in range(per_thread):
+                    amount = Decimal(rng.choice([100, 250, 500]))
+                    kind = rng.choice([DEPOSIT, WITHDRAWAL])
+                    try:
+                        if operation(account.pk, kind, amount):
+                            if kind == DEPOSIT:
+                                deposited += amount
+                            else:
+                                withdrawn += amount
+                    except OperationalError:
+                        errors += 1
+            finally:
+                connection.close()
+            results.append((deposited, withdrawn, errors))
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        deposited = sum(r[0] for r in results)
+        withdrawn = sum(r[1] for r in results)
+        errors = sum(r[2] for r in results)
+        expected = deposited - withdrawn
+        account.refresh_from_db()
+        last = Transaction.objects.filter(account=account).order_by('-id').first()
+        negative = Transaction.objects.filter(account=account, balance_after_transaction__lt=0).count()
+        done = per_thread * options['threads'] - errors
+
+        self.stdout.write(f"mode:               {options['mode']}")
+        self.stdout.write(f"threads:            {options['threads']}")
+        self.stdout.write(f"operations:         {done} in {elapsed:.2f}s ({done / elapsed:.0f} ops/s)")
+        self.stdout.write(f"lock errors:        {errors}")
+        self.stdout.write(f"expected balance:   {expected}")
+        self.stdout.write(f"actual balance:     {account.balance}")
+        self.stdout.write(f"last balance_after: {last.balance_after_transaction if last else None}")
+        self.stdout.write(f"negative rows:      {negative}")
+
+        if account.balance == expected and negative == 0:
+            self.stdout.write(self.style.SUCCESS('No lost updates'))
+        else:
+            self.stdout.write(self.style.ERROR(f'Lost updates: balance is off by {account.balance - expected}'))
+
+    def atomic_operation(self, account_pk, kind, amount):
+        account = UserBankAccount.objects.get(pk=account_pk)
+        try:
+            if kind == DEPOSIT:
+                services.deposit(account, amount)
+            else:
+                services.withdraw(account, amount)
+        except (services.InsufficientBalance, quotas.QuotaExceeded):
+            # Refused, nothing moved
+            return False
+        return True
+
+    def naive_operation(self, account_pk, kind, amount):
+        # What DipositView / WithdrawalView used to do
+        account = UserBankAccount.objects.get(pk=account_pk)
+        if kind == WITHDRAWAL and amount > account.balance:
+            return False
+        account.balance += amount if kind == DEPOSIT else -amount
+        account.save(update_fields=['balance'])
+        Transaction.objects.create(
+            account=account,
+            amount=amount,
+            transaction_type=kind,
+            balance_after_transaction=account.balance,
+        )
+        return True
@@ -0,0 +1,79 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+
+from accounts.models import UserBankAccount
+from transactions import services
+from transactions.bench import throwaway_database, seed_accounts, latency_summary
+from transactions.group_commit import Committer
+
+
+class Command(BaseCommand):
+    help = (
+        'Run concurrent deposits from a pool of threads, once with a DB '
+        'transaction per deposit and once through the group committer for each '
+        '--windows value, and compare throughput and latency. Checks that every '
+        'deposit landed. Runs against a throwaway database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=32, help='Deposits in flight at once')
+        parser.add_argument('--deposits', type=int, default=4000, help='Total deposits per mode')
+        parser.add_argument('--accounts', type=int, default=50)
+        parser.add_argument('--windows', type=float, nargs='+', default=[1, 2, 5], help='Group commit windows in ms')
+        parser.add_argument('--max-batch', type=int, default=settings.GROUP_COMMIT_MAX_BATCH)
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['accounts'] < 1:
+            raise CommandError('--threads and --accounts must be at least 1')
+        with throwaway_database('bench_group_commit'):
+            accounts = seed_accounts(options['accounts'], 0)
+            self.stdout.write(
+                f"{'mode':<12} {'window ms':>9} {'deposits/s':>10} {'mean ms':>9} {'p50 ms':>9} "
+                f"{'p95 ms':>9} {'p99 ms':>9}  check"
+            )
+            self.run_mode('per-request', None, services.deposit, accounts, options)
+            for window in options['windows']:
+                committer = Committer(window / 1000, options['max_batch'])
+                deposit = lambda account, amount: committer.submit(account, amount).result()
+                self.run_mode('group', window, deposit, accounts, options)
+
+    def run_mode(self, mode, window, deposit, accounts, options):
+        per_thread = options['deposits'] // options['threads']
+        amount = Decimal(100)
+        before = UserBankAccount.objects.aggregate(total=Sum('balance'))['total']
+        latencies = []
+
+        def worker(offset):
+            mine = []
+            try:
+                for number in range(per_thread):
+                    account = accounts[(offset + number * options['threads']) % len(accounts)]
+                    start = time.perf_counter()
+                    deposit(account, amount)
+                    mine.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+            latencies.extend(mine)
+
+        threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        moved = UserBankAccount.objects.aggregate(total=Sum('balance'))['total'] - before
+        expected = amount * per_thread * options['threads']
+        summary = latency_summary(latencies, elapsed)
+        self.stdout.write(
+            f"{mode:<12} {window if window is not None else '-':>9} {summary['throughput']:>10} "
+            f"{summary['mean_ms']:>9} {summary['p50_ms']:>9} {summary['p95_ms']:>9} {summary['p99_ms']:>9}  "
+            + (self.style.SUCCESS('all deposits landed') if moved == expected else self.style.ERROR(f'moved {moved}, expected {expected}'))
+        )
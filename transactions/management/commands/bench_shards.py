@@ -0,0 +1,87 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction as db_transaction, OperationalError
+from django.test import override_settings
+
+from accounts.models import UserBankAccount
+from transactions import ledger, services, shards
+from transactions.bench import throwaway_database, latency_summary
+
+
+class Command(BaseCommand):
+    help = (
+        'Hammer one account with concurrent deposits, once with the balance in '
+        'the account row and once split over --shards counter rows, and compare '
+        'throughput and latency. Checks that no deposit was lost. Runs against '
+        'a throwaway database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--deposits', type=int, default=4000, help='Total deposits across all threads, per mode')
+        parser.add_argument('--shards', type=int, default=16)
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['shards'] < 1:
+            raise CommandError('--threads and --shards must be at least 1')
+        # Sharding is off by default, see BALANCE_SHARDS in settings.py
+        with throwaway_database('bench_shards'), override_settings(BALANCE_SHARDS=True):
+            self.stdout.write(
+                f"{'mode':<8} {'shards':>6} {'deposits/s':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>6}  check"
+            )
+            for number, (mode, count) in enumerate([('single', 0), ('sharded', options['shards'])], 1):
+                user = User.objects.create_user(f'bench_shards_{mode}')
+                account = UserBankAccount.objects.create(
+                    user=user, account_type='Current', gender='Male', account_no=number,
+                )
+                if count:
+                    shards.set_shards(account, count)
+                self.run_mode(mode, count, account.pk, options)
+
+    def run_mode(self, mode, count, account_pk, options):
+        per_thread = options['deposits'] // options['threads']
+        amount = Decimal(100)
+        latencies = []
+        errors = []
+
+        def worker():
+            account = UserBankAccount.objects.get(pk=account_pk)
+            mine = []
+            failed = 0
+            try:
+                for _ in range(per_thread):
+                    start = time.perf_counter()
+                    try:
+                        services.deposit(account, amount)
+                    except OperationalError:
+                        failed += 1
+                        continue
+                    mine.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+            latencies.extend(mine)
+            errors.append(failed)
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        with db_transaction.atomic():
+            shards.consolidate([account_pk])
+        account = UserBankAccount.objects.get(pk=account_pk)
+        expected = amount * len(latencies)
+        ok = account.balance == expected and ledger.balance(account) == expected
+        summary = latency_summary(latencies, elapsed)
+        self.stdout.write(
+            f"{mode:<8} {count:>6} {summary['throughput']:>10} {summary['p50_ms']:>9} "
+            f"{summary['p95_ms']:>9} {summary['p99_ms']:>9} {sum(errors):>6}  "
+            + (self.style.SUCCESS('no lost deposits') if ok else self.style.ERROR(f'balance {account.balance}, expected {expected}'))
+        )
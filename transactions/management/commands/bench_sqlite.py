@@ -0,0 +1,109 @@
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+# Worker processes import this module before Django is set up, so nothing
+# that touches models is imported at the top
+
+
+class Command(BaseCommand):
+    help = (
+        'Run deposits and small deposit batches from several processes at once '
+        'against a SQLite file, '
+        'once with the OPTIONS from settings.DATABASES and once with stock '
+        'settings, and compare write throughput and "database is locked" errors.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8)
+        parser.add_argument('--operations', type=int, default=500, help='Writes per process')
+        parser.add_argument('--accounts', type=int, default=50)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('bench_sqlite only makes sense on SQLite')
+
+        from transactions.bench import throwaway_database, seed_accounts
+
+        tuned = settings.DATABASES['default'].get('OPTIONS', {})
+        workdir = tempfile.mkdtemp()
+        try:
+            with throwaway_database('bench_sqlite'):
+                seed_accounts(options['accounts'], 0)
+                connection.close()
+                seeded = os.path.join(workdir, 'seeded.sqlite3')
+                shutil.copy(connection.settings_dict['NAME'], seeded)
+
+            for profile, db_options, retries in [('default', {}, 1), ('tuned', tuned, None)]:
+                name = os.path.join(workdir, f'{profile}.sqlite3')
+                shutil.copy(seeded, name)
+                with sqlite3.connect(name) as db:
+                    # journal_mode sticks to the file, start both from rollback mode
+                    db.execute('PRAGMA journal_mode=DELETE')
+                self.run_profile(profile, name, db_options, retries, options)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    def run_profile(self, profile, name, db_options, retries, options):
+        context = multiprocessing.get_context('spawn')
+        args = [(name, db_options, retries, options['operations'], options['accounts'], seed)
+                for seed in range(options['processes'])]
+        started = time.perf_counter()
+        with context.Pool(options['processes']) as pool:
+            results = pool.starmap(deposit_worker, args)
+        elapsed = time.perf_counter() - started
+
+        done = sum(r[0] for r in results)
+        locked = sum(r[1] for r in results)
+        with sqlite3.connect(name) as db:
+            rows = db.execute('SELECT COUNT(*) FROM transactions_transaction').fetchone()[0]
+        self.stdout.write(
+            f"{profile:<8} {options['processes']} processes  {done:>6} writes in {elapsed:6.2f}s "
+            f"({done / elapsed:7.1f}/s)  {locked} locked errors  {rows} rows written"
+        )
+
+
+def deposit_worker(name, db_options, retries, operations, accounts, seed):
+    # Runs in a fresh process: point Django at the benchmark file before the
+    # first connection is made. Returns (writes done, locked errors).
+    import django
+    settings.DATABASES['default'].update(NAME=name, OPTIONS=db_options)
+    if not db_options:
+        settings.DATABASES['default'].update(CONN_MAX_AGE=0)
+    django.setup()
+
+    from django.db import OperationalError
+    from accounts.models import UserBankAccount
+    from transactions import services
+
+    if retries is not None:
+        services.LOCK_RETRIES = retries
+    rng = random.Random(seed)
+    accounts = list(UserBankAccount.objects.values_list('pk', 'account_no'))
+    done = locked = 0
+    for i in range(operations):
+        try:
+            if i % 5:
+                account = UserBankAccount.objects.get(pk=rng.choice(accounts)[0])
+                services.deposit(account, Decimal(rng.randrange(100, 5000)))
+            else:
+                # Reads the accounts before writing, like `manage.py ingest_transactions`
+                services.apply_batch([
+                    (line, {'account_no': rng.choice(accounts)[1], 'type': 'deposit', 'amount': '500'})
+                    for line in range(5)
+                ])
+            done += 1
+        except OperationalError as e:
+            if 'locked' not in str(e):
+                raise
+            locked += 1
+    return done, locked
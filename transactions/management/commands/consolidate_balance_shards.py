@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction as db_transaction
+
+from accounts.models import UserBankAccount
+from transactions import shards
+from transactions.services import retry_on_lock
+
+BATCH_SIZE = 100
+
+
+class Command(BaseCommand):
+    help = (
+        'Move what the shards of every sharded account hold into the account '
+        'row and book it in the daily snapshots. Meant to run every minute or '
+        'so; each batch of accounts is one short DB transaction.'
+    )
+
+    def handle(self, *args, **options):
+        ids = list(UserBankAccount.objects.filter(balance_shards__gt=0).order_by('pk').values_list('pk', flat=True))
+        moved = 0
+        for start in range(0, len(ids), BATCH_SIZE):
+            moved += consolidate(ids[start:start + BATCH_SIZE])
+        self.stdout.write(self.style.SUCCESS(f'Consolidated {moved} of {len(ids)} sharded accounts'))
+
+
+@retry_on_lock
+def consolidate(ids):
+    with db_transaction.atomic():
+        return shards.consolidate(ids)
@@ -0,0 +1,45 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+
+from transactions import services
+
+
+class Command(BaseCommand):
+    help = (
+        'Load deposits and withdrawals from JSONL files. Each line is '
+        '{"account_no": ..., "type": "deposit"|"withdrawal", "amount": ...}. '
+        'Writes one JSON result per input line.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='JSONL files, or - for stdin')
+        parser.add_argument('--batch-size', type=int, default=services.INGEST_BATCH_SIZE,
+                            help='Lines committed together in one DB transaction')
+        parser.add_argument('--output', help='Write results here instead of stdout')
+
+    def handle(self, *args, **options):
+        output = open(options['output'], 'w') if options['output'] else self.stdout
+        accepted = rejected = 0
+        try:
+            for name in options['files']:
+                # Bytes, so a line that isn't UTF-8 is reported like any
+                # other bad line instead of stopping the run
+                source = sys.stdin.buffer if name == '-' else open(name, 'rb')
+                try:
+                    for result in services.ingest_jsonl_batches(source, options['batch_size']):
+                        result['file'] = name
+                        output.write(json.dumps(result) + '\n')
+                        if result['ok']:
+                            accepted += 1
+                        else:
+                            rejected += 1
+                finally:
+                    if source is not sys.stdin.buffer:
+                        source.close()
+        finally:
+            if options['output']:
+                output.close()
+
+        self.stderr.write(f'{accepted} lines accepted, {rejected} rejected')
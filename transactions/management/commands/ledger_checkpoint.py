@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import UserBankAccount
+from transactions import ledger
+from transactions.services import retry_on_lock
+
+
+class Command(BaseCommand):
+    help = (
+        'Write a ledger checkpoint for every account with enough entries since '
+        'its last one, so ledger balances stay a checkpoint plus a few entries. '
+        'Also reports accounts whose balance column differs from the ledger.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-entries', type=int, default=50, help='Entries since the last checkpoint')
+        parser.add_argument('--range-size', type=int, default=2000, help='Account ids per DB transaction')
+
+    def handle(self, *args, **options):
+        size = options['range_size']
+        if size < 1:
+            raise CommandError('--range-size must be at least 1')
+        if options['min_entries'] < 1:
+            raise CommandError('--min-entries must be at least 1')
+
+        checkpoint = retry_on_lock(ledger.checkpoint)
+        last_id = UserBankAccount.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        written = 0
+        drifted = []
+        for start in range(0, last_id + 1, size):
+            count, drift = checkpoint(start, start + size, options['min_entries'])
+            written += count
+            drifted.extend(drift)
+
+        self.stdout.write(self.style.SUCCESS(f'{written} checkpoints written'))
+        books = ledger.trial_balance()
+        if sum(books.values()):
+            self.stdout.write(self.style.ERROR(f'The ledger does not balance: {books}'))
+        if drifted:
+            self.stdout.write(self.style.ERROR(f'{len(drifted)} accounts differ from the ledger'))
+            self.stdout.write(f"{'account':>10} {'balance':>14} {'ledger':>14}")
+            for _, account_no, column, ledger_balance in drifted[:50]:
+                self.stdout.write(f'{account_no:>10} {column:>14} {ledger_balance:>14}')
+            if len(drifted) > 50:
+                self.stdout.write(f'... and {len(drifted) - 50} more')
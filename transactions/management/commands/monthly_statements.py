@@ -0,0 +1,79 @@
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from transactions import parallel
+
+# Worker processes import this module before Django is set up, so nothing
+# that touches models is imported at the top
+
+
+class Command(BaseCommand):
+    help = (
+        'Write a monthly statement for every account: opening and closing '
+        'balance and every transaction of the month, one HTML file per account. '
+        'Account id ranges are spread over a process pool; progress is '
+        'checkpointed so an interrupted run can be resumed with --resume.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--month', help='YYYY-MM, defaults to last month')
+        parser.add_argument('--output-dir', default=settings.STATEMENTS_DIR)
+        parser.add_argument('--processes', type=int, default=os.cpu_count())
+        parser.add_argument('--range-size', type=int, default=2000, help='Account ids per task')
+        parser.add_argument('--resume', action='store_true', help='Skip the ranges the checkpoint says are done')
+
+    def handle(self, *args, **options):
+        from transactions.statements import parse_month
+
+        size = options['range_size']
+        if size < 1:
+            raise CommandError('--range-size must be at least 1')
+        if options['month']:
+            try:
+                year, month = parse_month(options['month'])
+            except ValueError as e:
+                raise CommandError(e)
+        else:
+            last_month = timezone.localdate().replace(day=1) - timedelta(days=1)
+            year, month = last_month.year, last_month.month
+
+        directory = str(options['output_dir'])
+        # Kept next to the statements, so each month resumes on its own
+        checkpoint = os.path.join(directory, f'{year}-{month:02}', 'checkpoint.json')
+        state = parallel.load_state(checkpoint, size, options['resume'], written=0)
+        os.makedirs(os.path.dirname(checkpoint), exist_ok=True)
+
+        starts = parallel.pending_starts(state)
+        self.stdout.write(
+            f"Statements for {year}-{month:02}: {len(starts)} ranges of {size} account ids "
+            f"to write ({len(state['done'])} already done)"
+        )
+
+        tasks = [(start, start + size, year, month, directory) for start in starts]
+        started = time.perf_counter()
+        written = 0
+        for start, count in parallel.run(write_range, tasks, options['processes']):
+            state['done'].append(start)
+            state['written'] += count
+            written += count
+            parallel.save_state(checkpoint, state)
+        elapsed = time.perf_counter() - started
+
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        rate = f' ({written / elapsed:.0f}/s)' if elapsed and written else ''
+        self.stdout.write(self.style.SUCCESS(
+            f"{state['written']} statements in {os.path.join(directory, f'{year}-{month:02}')}, "
+            f"{written} written by this run in {elapsed:.1f}s{rate}"
+        ))
+
+
+def write_range(task):
+    from transactions import statements
+    start, end, year, month, directory = task
+    return start, statements.write_range(start, end, year, month, directory)
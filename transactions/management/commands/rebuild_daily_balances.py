@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import UserBankAccount
+from transactions.snapshots import rebuild_account
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-day DailyBalance snapshots from the Transaction history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account-no', type=int, action='append', dest='account_nos',
+                            help='Only rebuild this account (can be repeated)')
+
+    def handle(self, *args, **options):
+        accounts = UserBankAccount.objects.order_by('pk')
+        if options['account_nos']:
+            accounts = accounts.filter(account_no__in=options['account_nos'])
+
+        rebuilt = days = 0
+        for account in accounts.iterator(chunk_size=500):
+            days += rebuild_account(account)
+            rebuilt += 1
+            if rebuilt % 1000 == 0:
+                self.stdout.write(f'{rebuilt} accounts rebuilt')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {days} daily snapshots for {rebuilt} accounts'))
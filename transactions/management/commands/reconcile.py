@@ -0,0 +1,79 @@
+import json
+import os
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from transactions import parallel
+
+# Worker processes import this module before Django is set up, so nothing
+# that touches models is imported at the top
+
+
+class Command(BaseCommand):
+    help = (
+        'Check every account balance against its Transaction history and the '
+        'balance_after_transaction chain. Account id ranges are spread over a '
+        'process pool; progress is checkpointed so an interrupted run can be '
+        'resumed with --resume. Reports only, nothing is changed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count())
+        parser.add_argument('--range-size', type=int, default=5000, help='Account ids per task')
+        parser.add_argument('--checkpoint', default='reconcile.checkpoint.json')
+        parser.add_argument('--resume', action='store_true', help='Skip the ranges the checkpoint says are done')
+        parser.add_argument('--report', help='Write every mismatch to this JSONL file')
+        parser.add_argument('--skip-chain', action='store_true', help='Only compare balances')
+
+    def handle(self, *args, **options):
+        size = options['range_size']
+        if size < 1:
+            raise CommandError('--range-size must be at least 1')
+
+        state = parallel.load_state(options['checkpoint'], size, options['resume'], mismatches=[])
+        starts = parallel.pending_starts(state)
+        self.stdout.write(f"{len(starts)} ranges of {size} account ids to check ({len(state['done'])} already done)")
+
+        tasks = [(start, start + size, not options['skip_chain']) for start in starts]
+        for start, mismatches in parallel.run(check_range, tasks, options['processes']):
+            state['done'].append(start)
+            state['mismatches'].extend(mismatches)
+            parallel.save_state(options['checkpoint'], state)
+
+        self.write_report(state['mismatches'], options['report'])
+        if os.path.exists(options['checkpoint']):
+            os.remove(options['checkpoint'])
+
+    def write_report(self, mismatches, path):
+        mismatches.sort(key=lambda m: m['account_no'])
+        if path:
+            with open(path, 'w') as f:
+                for mismatch in mismatches:
+                    f.write(json.dumps(mismatch) + '\n')
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('All balances match their history'))
+            return
+
+        drift = sum(Decimal(m['difference']) for m in mismatches)
+        balance_count = sum(1 for m in mismatches if Decimal(m['difference']))
+        chain_count = sum(1 for m in mismatches if m['chain_break'])
+        self.stdout.write(self.style.ERROR(
+            f'{len(mismatches)} accounts: {balance_count} with a wrong balance (net {drift:+}), '
+            f'{chain_count} with a broken balance_after_transaction chain'
+        ))
+        self.stdout.write(f"{'account':>10} {'balance':>14} {'expected':>14} {'difference':>12}  chain break")
+        for m in mismatches[:50]:
+            self.stdout.write(
+                f"{m['account_no']:>10} {m['balance']:>14} {m['expected']:>14} {m['difference']:>12}  "
+                f"{m['chain_break'] or ''}"
+            )
+        if len(mismatches) > 50:
+            self.stdout.write(f'... and {len(mismatches) - 50} more' + ('' if path else ', use --report for all'))
+
+
+def check_range(task):
+    from transactions import reconcile
+    start, end, chain = task
+    return start, reconcile.check_range(start, end, chain=chain)
@@ -0,0 +1,28 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from accounts.models import UserBankAccount
+from transactions import services
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the denormalized loan fields on UserBankAccount '
+        '(pending count, outstanding amount) from Transaction.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        accounts = UserBankAccount.objects.order_by('pk').iterator(chunk_size=options['chunk_size'])
+        checked = fixed = 0
+        while True:
+            chunk = list(islice(accounts, options['chunk_size']))
+            if not chunk:
+                break
+            fixed += services.reconcile_loan_state(chunk)
+            checked += len(chunk)
+
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} accounts, fixed {fixed}'))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from transactions import notifications
+
+
+class Command(BaseCommand):
+    help = 'Send queued transaction emails from the Notification outbox.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=4, help='Threads sending mail in parallel')
+        parser.add_argument('--loop', action='store_true', help='Keep polling instead of exiting once the outbox is empty')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        while True:
+            batch = notifications.claim_batch(options['batch_size'])
+            if batch:
+                sent, failed = notifications.send_batch(batch, workers=options['workers'])
+                total_sent += sent
+                total_failed += failed
+                self.stdout.write(f'Sent {sent}, failed {failed}')
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Done: {total_sent} sent, {total_failed} failed'))
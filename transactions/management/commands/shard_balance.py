@@ -0,0 +1,37 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import UserBankAccount
+from transactions import shards
+
+MAX_SHARDS = 64
+
+
+class Command(BaseCommand):
+    help = (
+        "Split an account's balance over N counter rows, so concurrent deposits "
+        "don't queue on one row (see transactions/shards.py). --shards 0 moves "
+        "it back into the account row. Needs the BALANCE_SHARDS setting."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account-no', type=int, required=True)
+        parser.add_argument('--shards', type=int, required=True)
+
+    def handle(self, *args, **options):
+        count = options['shards']
+        if not 0 <= count <= MAX_SHARDS:
+            raise CommandError(f'--shards must be between 0 and {MAX_SHARDS}')
+        try:
+            account = UserBankAccount.objects.get(account_no=options['account_no'])
+        except UserBankAccount.DoesNotExist:
+            raise CommandError(f"No account {options['account_no']}")
+
+        try:
+            shards.set_shards(account, count)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        if count:
+            self.stdout.write(self.style.SUCCESS(f'Account {account.account_no} now has {count} balance shards'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Account {account.account_no} is no longer sharded'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 14:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_userbankaccount_last_loan_date_and_more'),
+        ('transactions', '0008_alter_transaction_balance_after_transaction_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['account', 'timestamp', 'id'], name='transaction_account_1b25b2_idx'),
+        ),
+    ]
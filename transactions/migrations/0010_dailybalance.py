@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-18 14:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_userbankaccount_last_loan_date_and_more'),
+        ('transactions', '0009_transaction_transaction_account_1b25b2_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('closing_balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('deposit_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('withdrawal_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('loan_total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('repayment_count', models.PositiveIntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_balances', to='accounts.userbankaccount')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'constraints': [models.UniqueConstraint(fields=('account', 'date'), name='unique_daily_balance')],
+            },
+        ),
+    ]
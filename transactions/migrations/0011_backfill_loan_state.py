@@ -0,0 +1,39 @@
+from django.db import migrations
+from django.db.models import Count, Q, Sum
+
+
+LOAN = 3
+
+
+def backfill_loan_state(apps, schema_editor):
+    UserBankAccount = apps.get_model('accounts', 'UserBankAccount')
+    Transaction = apps.get_model('transactions', 'Transaction')
+
+    state = (
+        Transaction.objects.filter(transaction_type=LOAN)
+        .values('account_id')
+        .annotate(
+            pending=Count('id', filter=Q(loan_approve=False)),
+            outstanding=Sum('amount', filter=Q(loan_approve=True)),
+        )
+    )
+    for row in state.iterator(chunk_size=2000):
+        UserBankAccount.objects.filter(pk=row['account_id']).update(
+            pending_loan_count=row['pending'],
+            outstanding_loan_amount=row['outstanding'] or 0,
+        )
+
+    for account in UserBankAccount.objects.filter(last_loan_date__isnull=False).only('pk', 'last_loan_date').iterator(chunk_size=2000):
+        UserBankAccount.objects.filter(pk=account.pk).update(loan_month=account.last_loan_date.strftime('%Y-%m'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_userbankaccount_loan_month_and_more'),
+        ('transactions', '0010_dailybalance'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_loan_state, migrations.RunPython.noop),
+    ]
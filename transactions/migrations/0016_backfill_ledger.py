@@ -0,0 +1,120 @@
+import heapq
+from decimal import Decimal
+from operator import attrgetter
+
+from django.db import migrations
+from django.db.models import Max, Sum
+
+
+DEPOSIT = 1
+WITHDRAWAL = 2
+LOAN = 3
+LOAN_PAID = 4
+ADJUSTMENT = 6
+
+BOOK_CUSTOMER = 1
+BOOK_CASH = 2
+BOOK_LOANS = 3
+BOOK_SUSPENSE = 4
+
+# Same as ledger.POSTINGS
+POSTINGS = {
+    DEPOSIT: (1, BOOK_CASH),
+    WITHDRAWAL: (-1, BOOK_CASH),
+    LOAN: (1, BOOK_LOANS),
+    LOAN_PAID: (-1, BOOK_LOANS),
+    ADJUSTMENT: (1, BOOK_SUSPENSE),
+}
+
+BATCH_SIZE = 2000
+
+
+def backfill_ledger(apps, schema_editor):
+    # Posts the whole history, archive included, in timestamp order. An
+    # approved loan gets its LOAN posting, a repaid one LOAN and LOAN_PAID;
+    # pending loans move no money. Where the balance column doesn't match
+    # the history, an ADJUSTMENT opens the ledger at the current balance so
+    # the difference stays on record. Every account ends with a checkpoint.
+    UserBankAccount = apps.get_model('accounts', 'UserBankAccount')
+    Transaction = apps.get_model('transactions', 'Transaction')
+    ArchivedTransaction = apps.get_model('transactions', 'ArchivedTransaction')
+    LedgerPosting = apps.get_model('transactions', 'LedgerPosting')
+    LedgerEntry = apps.get_model('transactions', 'LedgerEntry')
+    LedgerCheckpoint = apps.get_model('transactions', 'LedgerCheckpoint')
+
+    def stream(model):
+        return (
+            model.objects.exclude(transaction_type=LOAN, loan_approve=False)
+            .order_by('timestamp', 'id')
+            .only('id', 'account_id', 'amount', 'transaction_type', 'timestamp')
+            .iterator(chunk_size=BATCH_SIZE)
+        )
+
+    def movements():
+        for row in heapq.merge(stream(Transaction), stream(ArchivedTransaction), key=attrgetter('timestamp', 'id')):
+            if row.transaction_type == LOAN_PAID:
+                yield LOAN, row
+            yield row.transaction_type, row
+
+    def flush(batch):
+        postings = LedgerPosting.objects.bulk_create([
+            LedgerPosting(kind=kind, transaction_id=row.id, created_at=row.timestamp) for kind, row in batch
+        ])
+        entries = []
+        for posting, (kind, row) in zip(postings, batch):
+            sign, book = POSTINGS[kind]
+            entries.append(LedgerEntry(posting=posting, book=BOOK_CUSTOMER, account_id=row.account_id, amount=sign * row.amount))
+            entries.append(LedgerEntry(posting=posting, book=book, amount=-sign * row.amount))
+        LedgerEntry.objects.bulk_create(entries)
+
+    batch = []
+    for movement in movements():
+        batch.append(movement)
+        if len(batch) == BATCH_SIZE:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    totals = dict(
+        LedgerEntry.objects.filter(book=BOOK_CUSTOMER)
+        .values('account_id').annotate(total=Sum('amount')).values_list('account_id', 'total')
+    )
+    for account in UserBankAccount.objects.only('pk', 'balance').iterator(chunk_size=BATCH_SIZE):
+        difference = account.balance - Decimal(totals.get(account.pk) or 0).quantize(Decimal('0.01'))
+        if difference:
+            posting = LedgerPosting.objects.create(kind=ADJUSTMENT)
+            LedgerEntry.objects.bulk_create([
+                LedgerEntry(posting=posting, book=BOOK_CUSTOMER, account_id=account.pk, amount=difference),
+                LedgerEntry(posting=posting, book=BOOK_SUSPENSE, amount=-difference),
+            ])
+
+    checkpoints = (
+        LedgerEntry.objects.filter(book=BOOK_CUSTOMER)
+        .values('account_id').annotate(last=Max('id'), total=Sum('amount'))
+        .values_list('account_id', 'last', 'total')
+    )
+    LedgerCheckpoint.objects.bulk_create(
+        [
+            LedgerCheckpoint(account_id=account_id, entry_id=last, balance=Decimal(total).quantize(Decimal('0.01')))
+            for account_id, last, total in checkpoints.iterator(chunk_size=BATCH_SIZE)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+
+def clear_ledger(apps, schema_editor):
+    apps.get_model('transactions', 'LedgerCheckpoint').objects.all().delete()
+    apps.get_model('transactions', 'LedgerEntry').objects.all().delete()
+    apps.get_model('transactions', 'LedgerPosting').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0015_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_ledger, clear_ledger),
+    ]
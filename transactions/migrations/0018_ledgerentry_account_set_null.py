@@ -0,0 +1,20 @@
+# Generated by Django 5.2 on 2026-10-18 15:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_userbankaccount_balance_shards'),
+        ('transactions', '0017_balanceshard'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='account',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='accounts.userbankaccount'),
+        ),
+    ]
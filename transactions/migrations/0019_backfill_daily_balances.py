@@ -0,0 +1,95 @@
+import heapq
+from decimal import Decimal
+from itertools import groupby
+from operator import attrgetter
+
+from django.db import migrations
+from django.db.models import F, Value
+from django.utils import timezone
+
+
+DEPOSIT = 1
+WITHDRAWAL = 2
+LOAN = 3
+LOAN_PAID = 4
+ADJUSTMENT = 6
+BOOK_CUSTOMER = 1
+
+# Same as snapshots.TOTALS
+TOTALS = ['deposit_total', 'withdrawal_total', 'loan_total', 'repayment_count']
+
+BATCH_SIZE = 2000
+
+
+def backfill_daily_balances(apps, schema_editor):
+    # Snapshots only started with 0010, so report totals for older history
+    # were missing. Rebuilds every account's snapshots from its history,
+    # archive included, the same way as snapshots.rebuild_account (and
+    # `manage.py rebuild_daily_balances`), in one pass over all accounts.
+    Transaction = apps.get_model('transactions', 'Transaction')
+    ArchivedTransaction = apps.get_model('transactions', 'ArchivedTransaction')
+    LedgerEntry = apps.get_model('transactions', 'LedgerEntry')
+    DailyBalance = apps.get_model('transactions', 'DailyBalance')
+
+    def stream(model):
+        return (
+            model.objects.order_by('account_id', 'timestamp', 'id')
+            .only('id', 'account_id', 'amount', 'transaction_type', 'loan_approve', 'timestamp')
+            .iterator(chunk_size=BATCH_SIZE)
+        )
+
+    # Staff adjustments have no Transaction row, only ledger entries
+    adjustments = (
+        LedgerEntry.objects.filter(account__isnull=False, book=BOOK_CUSTOMER, posting__kind=ADJUSTMENT)
+        .annotate(timestamp=F('posting__created_at'), transaction_type=Value(ADJUSTMENT))
+        .order_by('account_id', 'timestamp', 'id')
+        .only('id', 'account_id', 'amount')
+        .iterator(chunk_size=BATCH_SIZE)
+    )
+    rows = heapq.merge(
+        stream(Transaction), stream(ArchivedTransaction), adjustments,
+        key=attrgetter('account_id', 'timestamp', 'id'),
+    )
+    DailyBalance.objects.all().delete()
+    batch = []
+    for account_id, account_rows in groupby(rows, key=attrgetter('account_id')):
+        running = dict.fromkeys(TOTALS, 0)
+        balance = Decimal(0)
+        snapshots = {}
+        for row in account_rows:
+            if row.transaction_type == DEPOSIT:
+                balance += row.amount
+                running['deposit_total'] += row.amount
+            elif row.transaction_type == WITHDRAWAL:
+                balance -= row.amount
+                running['withdrawal_total'] += row.amount
+            elif row.transaction_type == LOAN and row.loan_approve:
+                balance += row.amount
+                running['loan_total'] += row.amount
+            elif row.transaction_type == LOAN_PAID:
+                # Credited when approved, then paid back in full
+                running['loan_total'] += row.amount
+                running['repayment_count'] += 1
+            elif row.transaction_type == ADJUSTMENT:
+                # Signed, and in none of the totals
+                balance += row.amount
+
+            day = timezone.localdate(row.timestamp)
+            snapshots[day] = DailyBalance(account_id=account_id, date=day, closing_balance=balance, **running)
+
+        batch.extend(snapshots.values())
+        if len(batch) >= BATCH_SIZE:
+            DailyBalance.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+            batch = []
+    DailyBalance.objects.bulk_create(batch, batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transactions', '0018_ledgerentry_account_set_null'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_daily_balances, migrations.RunPython.noop),
+    ]
@@ -2,7 +2,8 @@ from django.db import models
 
 from accounts.models import UserBankAccount
 from django.contrib.auth.models import User
-from .constants import TRANSACTION_TYPES
+from django.utils import timezone
+from .constants import TRANSACTION_TYPES, NOTIFICATION_STATUSES, NOTIFICATION_PENDING, POSTING_TYPES, LEDGER_BOOKS
 
 
 class Transaction(models.Model):
@@ -22,7 +23,8 @@ class Transaction(models.Model):
         indexes = [
                 models.Index(fields=['account', 'transaction_type']),
                 models.Index(fields=['transaction_type']),
-                models.Index(fields=['timestamp'])
+                models.Index(fields=['timestamp']),
+                models.Index(fields=['account', 'timestamp', 'id']),
             ]
 
 
@@ -31,3 +33,155 @@ class LoanTransaction(Transaction):
         proxy = True
         verbose_name = 'Loan Request'
         verbose_name_plural = 'Loan Requests'
+
+
+class ArchivedTransaction(models.Model):
+    # Cold history: Transaction rows older than settings.ARCHIVE_AFTER_DAYS,
+    # moved here by `manage.py archive_transactions` with their ids, so a row
+    # reads the same from either table. Loans stay in Transaction until they
+    # are paid. Readers go through transactions/archive.py.
+    id = models.BigIntegerField(primary_key=True)
+    account = models.ForeignKey(UserBankAccount, on_delete=models.CASCADE, related_name='archived_transactions')
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    balance_after_transaction = models.DecimalField(max_digits=12, decimal_places=2, blank=True, null=True)
+    transaction_type = models.IntegerField(choices=TRANSACTION_TYPES, null=True)
+    timestamp = models.DateTimeField()
+    loan_approve = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['account', 'timestamp', 'id']),
+            models.Index(fields=['timestamp']),
+        ]
+
+
+class DailyBalance(models.Model):
+    # One row per account per day with activity. The totals are running
+    # totals since the account was opened, so the figures for any date range
+    # are the difference between two rows instead of a Sum over Transaction.
+    account = models.ForeignKey(UserBankAccount, on_delete=models.CASCADE, related_name='daily_balances')
+    date = models.DateField()
+    closing_balance = models.DecimalField(max_digits=12, decimal_places=2)
+    deposit_total = models.DecimalField(default=0, max_digits=14, decimal_places=2)
+    withdrawal_total = models.DecimalField(default=0, max_digits=14, decimal_places=2)
+    loan_total = models.DecimalField(default=0, max_digits=14, decimal_places=2)
+    repayment_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'date'], name='unique_daily_balance'),
+        ]
+
+
+class BalanceShard(models.Model):
+    # One counter of a sharded account's balance (see shards.py). The
+    # totals are what moved through the shard since the last consolidation.
+    account = models.ForeignKey(UserBankAccount, on_delete=models.CASCADE, related_name='shards')
+    shard = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(default=0, max_digits=12, decimal_places=2)
+    deposit_total = models.DecimalField(default=0, max_digits=14, decimal_places=2)
+    withdrawal_total = models.DecimalField(default=0, max_digits=14, decimal_places=2)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'shard'], name='unique_balance_shard'),
+        ]
+
+
+class LedgerPosting(models.Model):
+    # One money movement in the double-entry ledger (see ledger.py). Its
+    # entries sum to zero. Postings are never changed or deleted; a movement
+    # is undone by a posting of its own.
+    kind = models.IntegerField(choices=POSTING_TYPES)
+    # The Transaction (or ArchivedTransaction, same id) it was posted for
+    transaction_id = models.BigIntegerField(blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Ledger postings can't be changed")
+        super().save(*args, **kwargs)
+
+
+class LedgerEntry(models.Model):
+    # One side of a posting. Credits are positive, debits negative; an
+    # account's balance is the sum of its CUSTOMER entries.
+    posting = models.ForeignKey(LedgerPosting, on_delete=models.PROTECT, related_name='entries')
+    book = models.IntegerField(choices=LEDGER_BOOKS)
+    # Indexed together with id below. Deleting an account (or its user)
+    # keeps its entries, with no account, so the books still balance.
+    account = models.ForeignKey(
+        UserBankAccount, on_delete=models.SET_NULL, related_name='ledger_entries',
+        blank=True, null=True, db_index=False,
+    )
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['account', 'id']),
+            models.Index(fields=['book']),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Ledger entries can't be changed")
+        super().save(*args, **kwargs)
+
+
+class LedgerCheckpoint(models.Model):
+    # The sum of an account's ledger entries up to and including entry_id,
+    # written by `manage.py ledger_checkpoint`, so the drift check only sums
+    # the entries after it. Nothing reads the balance from here.
+    account = models.ForeignKey(UserBankAccount, on_delete=models.CASCADE, related_name='ledger_checkpoints')
+    entry_id = models.BigIntegerField()
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'entry_id'], name='unique_ledger_checkpoint'),
+        ]
+
+
+class Notification(models.Model):
+    # Outbox of transaction emails. Rows are written in the same DB
+    # transaction as the money movement and sent later by
+    # `manage.py send_notifications`, so no request waits on SMTP.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    subject = models.CharField(max_length=200)
+    template = models.CharField(max_length=200)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    status = models.IntegerField(choices=NOTIFICATION_STATUSES, default=NOTIFICATION_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    # A money-moving request that was already handled, so a retry carrying
+    # the same key gets the first answer back instead of moving money twice.
+    # status_code is empty while the first request is still running.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=64)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    location = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
@@ -0,0 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction as db_transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import Notification
+from .constants import NOTIFICATION_PENDING, NOTIFICATION_SENT, NOTIFICATION_FAILED
+
+
+MAX_ATTEMPTS = 5
+RETRY_DELAY = timedelta(seconds=30) # Doubled after every failed attempt
+CLAIM_TIMEOUT = timedelta(minutes=5) # A crashed worker's rows come back after this
+
+DEPOSIT_EMAIL = ('Deposit Successful', 'transactions/deposit_email.html')
+WITHDRAWAL_EMAIL = ('Withdrawal Message', 'transactions/withdrowal_email.html')
+LOAN_REQUEST_EMAIL = ('Loan Request Message', 'transactions/loan_email.html')
+LOAN_APPROVAL_EMAIL = ('Loan Approval', 'transactions/admin_email.html')
+
+
+def build_notification(account, amount, email):
+    subject, template = email
+    return Notification(
+        user_id=account.user_id,
+        subject=subject,
+        template=template,
+        amount=amount,
+        balance=account.balance,
+    )
+
+
+def queue_email(account, amount, email):
+    # Call inside the atomic block that moves the money, so the email exists
+    # if and only if the transaction does
+    notification = build_notification(account, amount, email)
+    notification.save()
+    return notification
+
+
+def claim_batch(batch_size):
+    # Pushes next_attempt_at forward on the rows it takes, so other workers
+    # (and this one, if it dies) leave them alone until CLAIM_TIMEOUT passes
+    now = timezone.now()
+    with db_transaction.atomic():
+        batch = list(
+            Notification.objects.select_for_update(skip_locked=True)
+            .filter(status=NOTIFICATION_PENDING, next_attempt_at__lte=now)
+            .select_related('user')
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        Notification.objects.filter(pk__in=[n.pk for n in batch]).update(next_attempt_at=now + CLAIM_TIMEOUT)
+    return batch
+
+
+def render_message(notification):
+    body = render_to_string(notification.template, {
+        'user': notification.user,
+        'amount': notification.amount,
+        'balance': notification.balance,
+    })
+    message = EmailMultiAlternatives(notification.subject, '', to=[notification.user.email])
+    message.attach_alternative(body, 'text/html')
+    return message
+
+
+def _send_chunk(messages):
+    # One mail connection per thread, reused for every message in the chunk.
+    # Returns {notification id: error or None}.
+    results = {}
+    connection = get_connection()
+    try:
+        connection.open()
+        for pk, message in messages:
+            try:
+                connection.send_messages([message])
+                results[pk] = None
+            except Exception as e:
+                results[pk] = str(e) or type(e).__name__
+    except Exception as e:
+        for pk, message in messages:
+            results.setdefault(pk, str(e) or type(e).__name__)
+    finally:
+        connection.close()
+    return results
+
+
+def send_batch(batch, workers=4):
+    # Renders in this thread, sends from a thread pool and writes the outcome
+    # back from this thread, so the pool never touches the database.
+    # Returns (sent, failed) counts.
+    messages = []
+    results = {}
+    for notification in batch:
+        try:
+            messages.append((notification.pk, render_message(notification)))
+        except Exception as e:
+            results[notification.pk] = f'Render failed: {e}'
+
+    chunks = [messages[i::workers] for i in range(workers) if messages[i::workers]]
+    if chunks:
+        with ThreadPoolExecutor(max_workers=len(chunks)) as pool:
+            for chunk_results in pool.map(_send_chunk, chunks):
+                results.update(chunk_results)
+
+    now = timezone.now()
+    sent = 0
+    for notification in batch:
+        error = results.get(notification.pk, 'Not sent')
+        notification.attempts += 1
+        if error is None:
+            notification.status = NOTIFICATION_SENT
+            notification.sent_at = now
+            notification.last_error = ''
+            sent += 1
+        else:
+            notification.last_error = error
+            if notification.attempts >= MAX_ATTEMPTS:
+                notification.status = NOTIFICATION_FAILED
+            else:
+                notification.next_attempt_at = now + RETRY_DELAY * 2 ** (notification.attempts - 1)
+
+    Notification.objects.bulk_update(batch, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'])
+    return sent, len(batch) - sent
@@ -0,0 +1,113 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils import timezone
+
+from .archive import horizon, ahorizon
+
+
+# Keyset pagination over (timestamp, id), newest first. A page is fetched
+# with "WHERE (timestamp, id) < cursor ORDER BY timestamp DESC, id DESC LIMIT n"
+# which walks the (account, timestamp, id) index, so page 1000 costs the
+# same as page 1. OFFSET would have to skip every row before the page.
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(row):
+    raw = f'{row.timestamp.isoformat()}|{row.pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    # Returns (timestamp, id); raises InvalidCursor for anything that isn't
+    # a cursor, which views answer with a 400
+    try:
+        timestamp, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        timestamp, pk = datetime.fromisoformat(timestamp), int(pk)
+    except (ValueError, UnicodeError):
+        raise InvalidCursor(cursor)
+    # encode_cursor() writes the offset; a cursor without one is taken in
+    # the current time zone, a naive timestamp can't be compared with the
+    # archive horizon
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    return timestamp, pk
+
+
+def older_than(cursor):
+    timestamp, pk = cursor
+    return Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk)
+
+
+def newer_than(cursor):
+    timestamp, pk = cursor
+    return Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=pk)
+
+
+def keyset_page(queryset, page_size, after=None, before=None, archive=None):
+    """
+    Returns (rows, next_cursor, previous_cursor) for one page, newest first.
+    ``after`` moves to older rows, ``before`` moves back to newer rows.
+    ``archive`` is the same filter over ArchivedTransaction; it is read too
+    when the page reaches back to the archive horizon (see archive.py).
+    Raises InvalidCursor if either cursor is malformed.
+    """
+    after = decode_cursor(after) if after else None
+    before = decode_cursor(before) if before else None
+    rows = list(page_query(queryset, page_size, after, before))
+    if archive is not None and reaches_archive(rows, page_size, before, horizon()):
+        rows = merge_page(rows, list(page_query(archive, page_size, after, before)), page_size, before)
+    return page_result(rows, page_size, after, before)
+
+
+async def akeyset_page(queryset, page_size, after=None, before=None, archive=None):
+    # keyset_page() for async views
+    after = decode_cursor(after) if after else None
+    before = decode_cursor(before) if before else None
+    rows = [row async for row in page_query(queryset, page_size, after, before)]
+    if archive is not None and reaches_archive(rows, page_size, before, await ahorizon()):
+        cold = [row async for row in page_query(archive, page_size, after, before)]
+        rows = merge_page(rows, cold, page_size, before)
+    return page_result(rows, page_size, after, before)
+
+
+def reaches_archive(rows, page_size, before, horizon):
+    # Archived rows are all at or before the horizon, so they can only be
+    # on this page if the page gets that far back
+    if before:
+        return before[0] <= horizon
+    return len(rows) <= page_size or rows[-1].timestamp <= horizon
+
+
+def merge_page(hot, cold, page_size, before):
+    # Both come from page_query(), oldest first when paging with ``before``
+    rows = sorted(hot + cold, key=lambda row: (row.timestamp, row.pk), reverse=not before)
+    return rows[:page_size + 1]
+
+
+def page_query(queryset, page_size, after, before):
+    # One row more than the page, to tell whether there is another page
+    if before:
+        return queryset.filter(newer_than(before)).order_by('timestamp', 'id')[:page_size + 1]
+    if after:
+        queryset = queryset.filter(older_than(after))
+    return queryset.order_by('-timestamp', '-id')[:page_size + 1]
+
+
+def page_result(rows, page_size, after, before):
+    if before:
+        has_newer = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_older = True
+    else:
+        has_older = len(rows) > page_size
+        rows = rows[:page_size]
+        has_newer = after is not None
+
+    next_cursor = encode_cursor(rows[-1]) if rows and has_older else None
+    previous_cursor = encode_cursor(rows[0]) if rows and has_newer else None
+    return rows, next_cursor, previous_cursor
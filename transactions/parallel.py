@@ -0,0 +1,63 @@
+import json
+import multiprocessing
+import os
+
+from django.core.management.base import CommandError
+from django.db import connections
+
+
+# Driver for the commands that split the accounts into id ranges and work
+# through them in a process pool (`manage.py reconcile`, `manage.py
+# monthly_statements`). The run's state is a JSON checkpoint written after
+# every finished range, so an interrupted run picks up where it stopped with
+# --resume. Worker processes import this module before Django is set up, so
+# nothing that touches models is imported at the top.
+
+
+def load_state(path, range_size, resume, **initial):
+    """
+    Returns the run's state: {'range_size', 'done': [finished range
+    starts], **initial}, or the one saved at ``path`` when resuming.
+    """
+    if not resume:
+        return {'range_size': range_size, 'done': [], **initial}
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        raise CommandError(f'No checkpoint at {path}')
+    if state['range_size'] != range_size:
+        raise CommandError(f"The checkpoint was written with --range-size {state['range_size']}")
+    return state
+
+
+def save_state(path, state):
+    # Written to a temporary file and renamed, so a crash mid-write leaves
+    # the previous checkpoint intact
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def pending_starts(state):
+    # Starts of the account id ranges the state doesn't have as done
+    from accounts.models import UserBankAccount
+
+    last_id = UserBankAccount.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    done = set(state['done'])
+    return [start for start in range(0, last_id + 1, state['range_size']) if start not in done]
+
+
+def run(func, tasks, processes):
+    # Yields func(task) for every task as the workers finish them. ``func``
+    # has to be a module-level function, the pool pickles it by name.
+    # Children open their own connections
+    connections.close_all()
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(processes, initializer=setup_worker) as pool:
+        yield from pool.imap_unordered(func, tasks)
+
+
+def setup_worker():
+    import django
+    django.setup()
@@ -0,0 +1,198 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import partial
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from .models import Transaction
+from .constants import WITHDRAWAL, LOAN, LOAN_PAID
+from . import caches
+
+
+# Per-account sliding-window limits, set per account type in
+# settings.ACCOUNT_QUOTAS. Each window is split into fixed buckets (days for
+# the 30 day window, hours for the daily ones) and slides a bucket at a time.
+#
+# The check and the write happen under the account's row lock (on SQLite,
+# the BEGIN IMMEDIATE every write starts with), so two requests for the
+# same account take turns and can't both squeeze under the limit.
+#
+# With a cache every process shares (see caches.py) the buckets are cache
+# counters, so a check is one get_many no matter how busy the account is.
+# The counter goes up with cache.incr from transaction.on_commit, so a write
+# that is refused or rolled back never uses up a slot. The lock is released
+# by the commit, a moment before the increment: a request for the same
+# account that gets in within that moment sees the counter one short.
+# Buckets the cache doesn't have (restart, eviction) are rebuilt from
+# Transaction and put back with cache.add, which never overwrites a
+# counter another request already holds.
+#
+# A per-process cache would let every worker allow the full limit, so
+# without a shared one the window is counted from Transaction on every
+# check. That is one indexed query per window.
+#
+# Batch ingestion doesn't check the quotas, but record() counts what it
+# withdrew against the next request.
+
+# name: (window, bucket, transaction types, counts amounts instead of rows)
+QUOTAS = {
+    'loans_per_30_days': (timedelta(days=30), timedelta(days=1), (LOAN, LOAN_PAID), False),
+    'withdrawals_per_day': (timedelta(days=1), timedelta(hours=1), (WITHDRAWAL,), False),
+    'withdrawn_per_day': (timedelta(days=1), timedelta(hours=1), (WITHDRAWAL,), True),
+}
+
+MESSAGES = {
+    'loans_per_30_days': "You can't take more than {limit} loans in 30 days.",
+    'withdrawals_per_day': "You can't make more than {limit} withdrawals in a day.",
+    'withdrawn_per_day': "You can't withdraw more than {limit} $ in a day. You have {remaining} $ left today.",
+}
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+def limits_for(account):
+    return settings.ACCOUNT_QUOTAS.get(account.account_type, {})
+
+
+def _units(name, value):
+    # Amounts are counted in cents so the counters stay integers for incr
+    return int(Decimal(value) * 100) if QUOTAS[name][3] else int(value)
+
+
+def _bucket_keys(account, name, now):
+    # Oldest first, the last one is the current bucket
+    window, bucket = QUOTAS[name][:2]
+    current = int(now.timestamp() // bucket.total_seconds())
+    first = current - int(window / bucket) + 1
+    return [f'quota:{account.pk}:{name}:{index}' for index in range(first, current + 1)]
+
+
+def _index(key):
+    return int(key.rsplit(':', 1)[1])
+
+
+def _timeout(name):
+    window, bucket = QUOTAS[name][:2]
+    return (window + bucket).total_seconds()
+
+
+def _count(account, name, keys):
+    # {key: usage} of one window's buckets, counted from Transaction
+    bucket, types, amounts = QUOTAS[name][1:]
+    size = bucket.total_seconds()
+    start = datetime.fromtimestamp(_index(keys[0]) * size, tz=dt_timezone.utc)
+    totals = defaultdict(int)
+    rows = Transaction.objects.filter(account=account, transaction_type__in=types, timestamp__gte=start)
+    for timestamp, amount in rows.values_list('timestamp', 'amount'):
+        totals[int(timestamp.timestamp() // size)] += _units(name, amount) if amounts else 1
+    return {key: totals[_index(key)] for key in keys}
+
+
+def _rebuild(account, name, keys):
+    # Refills missing buckets of one window from Transaction, and returns
+    # {key: count} as counted, for when the cache can't keep them
+    counted = _count(account, name, keys)
+    for key, count in counted.items():
+        cache.add(key, count, _timeout(name))
+    return counted
+
+
+def _lock(account):
+    # Held until the caller's write commits
+    list(UserBankAccount.objects.select_for_update().filter(pk=account.pk).values_list('pk', flat=True))
+
+
+def _incr(key, delta, timeout):
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # Expired between the read and now
+        if cache.add(key, delta, timeout):
+            return delta
+        return cache.incr(key, delta)
+
+
+@contextmanager
+def reserve(account, **amounts):
+    """
+    Checks usage, e.g. ``reserve(account, withdrawals_per_day=1,
+    withdrawn_per_day=amount)``, and raises QuotaExceeded if that takes any
+    window over its limit. Wrap the write in it, inside the write's atomic
+    block. The usage is only counted once that transaction commits, so a
+    write that fails or is rolled back later on uses up nothing.
+    """
+    now = timezone.now()
+    limits = limits_for(account)
+    shared = caches.is_shared()
+    checked = False
+    counted = []
+    for name, amount in amounts.items():
+        limit = limits.get(name)
+        if limit is None:
+            continue
+        if not checked:
+            _lock(account)
+            checked = True
+        keys = _bucket_keys(account, name, now)
+        delta = _units(name, amount)
+        if shared:
+            counters = cache.get_many(keys)
+            if len(counters) < len(keys):
+                counters = {**_rebuild(account, name, keys), **cache.get_many(keys)}
+            counted.append((keys[-1], delta, _timeout(name)))
+        else:
+            counters = _count(account, name, keys)
+
+        used = sum(counters.values()) + delta
+        if used > _units(name, limit):
+            remaining = max(_units(name, limit) - (used - delta), 0)
+            if QUOTAS[name][3]:
+                remaining = (Decimal(remaining) / 100).quantize(Decimal('0.01'))
+            raise QuotaExceeded(MESSAGES[name].format(limit=limit, remaining=remaining))
+    yield
+    for key, delta, timeout in counted:
+        db_transaction.on_commit(partial(_incr, key, delta, timeout))
+
+
+def record(account, **amounts):
+    """
+    Counts usage that went in without reserve(), e.g. a batch's withdrawals
+    with ``record(account, withdrawals_per_day=2, withdrawn_per_day=total)``.
+    Call it inside the atomic block that writes the rows; they are counted
+    once it commits. Without a shared cache there is nothing to do, the rows
+    are counted from Transaction.
+    """
+    if caches.is_shared():
+        now = timezone.now()
+        db_transaction.on_commit(partial(_record, account, now, amounts))
+
+
+def _record(account, now, amounts):
+    limits = limits_for(account)
+    for name, amount in amounts.items():
+        if limits.get(name) is None:
+            continue
+        keys = _bucket_keys(account, name, now)
+        counters = cache.get_many(keys)
+        if keys[-1] in counters:
+            _incr(keys[-1], _units(name, amount), _timeout(name))
+        if len(counters) < len(keys):
+            # Counted from Transaction, which has the new rows already
+            _rebuild(account, name, keys)
+
+
+def used(account, name):
+    # How much of one window the account has used, counted from Transaction
+    keys = _bucket_keys(account, name, timezone.now())
+    total = sum(_count(account, name, keys).values())
+    if QUOTAS[name][3]:
+        return (Decimal(total) / 100).quantize(Decimal('0.01'))
+    return total
@@ -0,0 +1,142 @@
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import transaction as db_transaction
+from django.db.models import F, Q, Sum, Case, When, Value, DecimalField
+
+from accounts.models import UserBankAccount
+from .models import Transaction, ArchivedTransaction, BalanceShard, LedgerEntry
+from .constants import DEPOSIT, WITHDRAWAL, LOAN, LOAN_PAID, ADJUSTMENT, BOOK_CUSTOMER
+from . import archive, shards
+
+
+# Checks UserBankAccount.balance against the Transaction history, one range
+# of account ids at a time; `manage.py reconcile` spreads the ranges over a
+# process pool. Nothing is changed, mismatches are only reported.
+#
+# The expected balance is deposits - withdrawals + approved loans. A repaid
+# loan (LOAN_PAID) was credited and paid back, so it adds nothing. Both
+# come from the whole history, archived rows included (see archive.py).
+# Staff adjustments (services.adjust_balance) have no Transaction row and
+# are taken from the ledger.
+
+CENTS = Decimal('0.01')
+
+SIGNED_AMOUNT = Case(
+    When(transaction_type=DEPOSIT, then=F('amount')),
+    When(transaction_type=WITHDRAWAL, then=-F('amount')),
+    When(transaction_type=LOAN, loan_approve=True, then=F('amount')),
+    default=Value(0),
+    output_field=DecimalField(max_digits=14, decimal_places=2),
+)
+
+
+def expected_balances(accounts):
+    # {account id: expected balance} for an account queryset/filter
+    expected = {}
+    for model in (Transaction, ArchivedTransaction):
+        rows = (
+            model.objects.filter(accounts)
+            .values('account_id')
+            .annotate(expected=Sum(SIGNED_AMOUNT))
+            .values_list('account_id', 'expected')
+        )
+        for account_id, total in rows:
+            expected[account_id] = expected.get(account_id, 0) + (total or 0)
+    for account_id, total in adjustments(accounts):
+        expected[account_id] = expected.get(account_id, 0) + total
+    return {account_id: Decimal(total).quantize(CENTS) for account_id, total in expected.items()}
+
+
+def adjustments(accounts):
+    return (
+        LedgerEntry.objects.filter(accounts, book=BOOK_CUSTOMER, posting__kind=ADJUSTMENT)
+        .values('account_id')
+        .annotate(total=Sum('amount'))
+        .values_list('account_id', 'total')
+    )
+
+
+def chain_breaks(start, end):
+    """
+    {account id: id of the first row whose balance_after_transaction doesn't
+    follow from the rows before it}. Only rows before an account's first
+    loan are checked: a loan row keeps the balance from when it was
+    approved, and approval times aren't stored.
+    """
+    def stream(model):
+        return (
+            model.objects.filter(account_id__gte=start, account_id__lt=end)
+            .order_by('account_id', 'timestamp', 'id')
+            .values_list('account_id', 'timestamp', 'id', 'transaction_type', 'amount', 'balance_after_transaction')
+            .iterator(chunk_size=5000)
+        )
+
+    rows = archive.merged(stream(Transaction), stream(ArchivedTransaction), key=itemgetter(0, 1, 2))
+    breaks = {}
+    for account_id, history in groupby(rows, key=itemgetter(0)):
+        running = Decimal(0)
+        for _, _, pk, kind, amount, balance_after in history:
+            if kind in (LOAN, LOAN_PAID):
+                break
+            running += amount if kind == DEPOSIT else -amount
+            if balance_after != running:
+                breaks[account_id] = pk
+                break
+    return breaks
+
+
+def check_range(start, end, chain=True):
+    """
+    Returns one dict per account with id in [start, end) whose balance or
+    history doesn't add up. Balance mismatches are confirmed with the
+    accounts locked, so a deposit landing mid-check isn't reported.
+    """
+    in_range = Q(account_id__gte=start, account_id__lt=end)
+    expected = expected_balances(in_range)
+    # Balances include the shards of sharded accounts, see shards.py
+    accounts = shards.with_total(UserBankAccount.objects.filter(pk__gte=start, pk__lt=end))
+    accounts = accounts.values_list('pk', 'account_no', 'total_balance')
+    suspects = [pk for pk, _, balance in accounts if balance != expected.get(pk, Decimal(0))]
+
+    mismatched = {}
+    if suspects:
+        with db_transaction.atomic():
+            list(UserBankAccount.objects.select_for_update().filter(pk__in=suspects).values_list('pk', flat=True))
+            # Shard deposits don't take the account row lock
+            list(BalanceShard.objects.select_for_update().filter(account_id__in=suspects).values_list('pk', flat=True))
+            locked = list(
+                shards.with_total(UserBankAccount.objects.filter(pk__in=suspects))
+                .values_list('pk', 'account_no', 'total_balance')
+            )
+            confirmed = expected_balances(Q(account_id__in=suspects))
+            expected.update({pk: confirmed.get(pk, Decimal(0)) for pk in suspects})
+            for pk, account_no, balance in locked:
+                if balance != expected.get(pk, Decimal(0)):
+                    mismatched[pk] = (account_no, balance)
+
+    breaks = chain_breaks(start, end) if chain else {}
+    if breaks:
+        # Concurrent deposits to different shards of an account don't wait
+        # for each other, so its chain only holds where writers are serialized.
+        # An adjustment moves the balance without a row of its own.
+        sharded = UserBankAccount.objects.filter(pk__in=breaks, balance_shards__gt=0).values_list('pk', flat=True)
+        adjusted = [account_id for account_id, _ in adjustments(Q(account_id__in=breaks))]
+        for pk in {*sharded, *adjusted}:
+            del breaks[pk]
+        broken = shards.with_total(UserBankAccount.objects.filter(pk__in=breaks).exclude(pk__in=mismatched))
+        for pk, account_no, balance in broken.values_list('pk', 'account_no', 'total_balance'):
+            mismatched[pk] = (account_no, balance)
+
+    report = []
+    for pk, (account_no, balance) in sorted(mismatched.items()):
+        balance = Decimal(balance).quantize(CENTS)
+        report.append({
+            'account_no': account_no,
+            'balance': str(balance),
+            'expected': str(expected.get(pk, Decimal(0))),
+            'difference': str(balance - expected.get(pk, Decimal(0))),
+            'chain_break': breaks.get(pk),
+        })
+    return report
@@ -0,0 +1,525 @@
+import json
+import random
+from collections import defaultdict
+from functools import wraps
+from itertools import groupby, islice
+from decimal import Decimal
+from time import sleep
+
+from django.db import OperationalError, transaction as db_transaction
+from django.db.models import F, Q, Count, Sum
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from .models import Transaction, Notification
+from .constants import DEPOSIT, WITHDRAWAL, LOAN, LOAN_PAID, LOAN_REVERSED, ADJUSTMENT
+from .snapshots import record_day
+from .summary import invalidate_account_summary
+from . import ledger, notifications, quotas, shards
+
+
+# Every change to UserBankAccount.balance goes through this module.
+# The balance is never read into Python, changed and saved back; instead a
+# conditional UPDATE moves it inside the database, so two requests hitting
+# the same account at once can't overwrite each other's result. Every
+# movement is also posted to the ledger (ledger.py) in the same DB
+# transaction, after the UPDATE has taken the account's row lock. The
+# ledger is an audit trail; the balance column stays authoritative.
+
+
+LOCK_RETRIES = 5
+LOCK_BACKOFF = 0.05 # Seconds, doubled after every attempt
+INGEST_BATCH_SIZE = 5000 # JSONL lines committed together
+
+
+class InsufficientBalance(Exception):
+    pass
+
+
+class LoanNotPayable(Exception):
+    pass
+
+
+class LoanRefused(Exception):
+    pass
+
+
+def retry_on_lock(func):
+    # SQLite answers a write that can't get the database lock within its
+    # busy timeout with "database is locked". The whole atomic block is run
+    # again after a jittered backoff. Inside a caller's atomic block there is
+    # nothing safe to retry, so the error is passed up.
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if db_transaction.get_connection().in_atomic_block:
+            return func(*args, **kwargs)
+        for attempt in range(LOCK_RETRIES):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                if 'locked' not in str(e) or attempt == LOCK_RETRIES - 1:
+                    raise
+            sleep(LOCK_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+    return wrapper
+
+
+def _change_balance(account, delta, **changes):
+    # Must be called inside an atomic block. The UPDATE takes the row lock,
+    # so the balance we read back right after it is the one we produced.
+    # Extra field changes (loan state) ride along in the same UPDATE.
+    # A sharded account is consolidated first, so the row holds it all.
+    if account.balance_shards:
+        shards.consolidate([account.pk])
+    accounts = UserBankAccount.objects.filter(pk=account.pk)
+    if delta < 0:
+        accounts = accounts.filter(balance__gte=-delta)
+
+    if not accounts.update(balance=F('balance') + delta, **changes):
+        account.refresh_from_db(fields=['balance'])
+        raise InsufficientBalance
+
+    account.balance = UserBankAccount.objects.filter(pk=account.pk).values_list('balance', flat=True).get()
+    invalidate_account_summary(account)
+    return account.balance
+
+
+@retry_on_lock
+def deposit(account, amount):
+    with db_transaction.atomic():
+        # Sharded accounts book the day when consolidated, see shards.py
+        balance = shards.deposit(account, amount) if shards.in_use(account) else None
+        if balance is None:
+            balance = _change_balance(account, amount)
+            record_day(account, balance, deposit=amount)
+        notifications.queue_email(account, amount, notifications.DEPOSIT_EMAIL)
+        row = Transaction.objects.create(
+            account=account,
+            amount=amount,
+            transaction_type=DEPOSIT,
+            balance_after_transaction=balance,
+        )
+        ledger.post(DEPOSIT, account, amount, row.pk)
+        return row
+
+
+@retry_on_lock
+def withdraw(account, amount):
+    with db_transaction.atomic(), quotas.reserve(account, withdrawals_per_day=1, withdrawn_per_day=amount):
+        balance = shards.withdraw(account, amount) if shards.in_use(account) else None
+        if balance is None:
+            balance = _change_balance(account, -amount)
+            record_day(account, balance, withdrawal=amount)
+        notifications.queue_email(account, amount, notifications.WITHDRAWAL_EMAIL)
+        row = Transaction.objects.create(
+            account=account,
+            amount=amount,
+            transaction_type=WITHDRAWAL,
+            balance_after_transaction=balance,
+        )
+        ledger.post(WITHDRAWAL, account, amount, row.pk)
+        return row
+
+
+@retry_on_lock
+def pay_loan(account, loan):
+    with db_transaction.atomic():
+        balance = _change_balance(
+            account,
+            -loan.amount,
+            outstanding_loan_amount=F('outstanding_loan_amount') - loan.amount,
+        )
+
+        # Flip the loan only if nobody else paid it in the meantime
+        paid = Transaction.objects.filter(
+            pk=loan.pk,
+            account=account,
+            transaction_type=LOAN,
+            loan_approve=True,
+        ).update(transaction_type=LOAN_PAID, balance_after_transaction=balance)
+        if not paid:
+            raise LoanNotPayable
+        record_day(account, balance, repayments=1)
+        ledger.post(LOAN_PAID, account, loan.amount, loan.pk)
+
+        loan.transaction_type = LOAN_PAID
+        loan.balance_after_transaction = balance
+        return loan
+
+
+@retry_on_lock
+def request_loan(account, amount):
+    # The loans-per-30-days quota is reserved first (see quotas.py), then
+    # the UPDATE itself checks there is no pending loan and nothing
+    # outstanding. Only a refused request reads the row back, to say why.
+    with db_transaction.atomic(), quotas.reserve(account, loans_per_30_days=1):
+        updated = UserBankAccount.objects.filter(
+            pk=account.pk,
+            pending_loan_count=0,
+            outstanding_loan_amount=0,
+        ).update(
+            pending_loan_count=F('pending_loan_count') + 1,
+            last_loan_date=timezone.localdate(),
+        )
+        if not updated:
+            account.refresh_from_db()
+            if account.pending_loan_count:
+                raise LoanRefused("Admin has not approved your previous loan request yet. Please wait.")
+            raise LoanRefused("You have an approved loan that you haven't paid yet. Please pay it first.")
+
+        invalidate_account_summary(account)
+        notifications.queue_email(account, amount, notifications.LOAN_REQUEST_EMAIL)
+        return Transaction.objects.create(
+            account=account,
+            amount=amount,
+            transaction_type=LOAN,
+            balance_after_transaction=account.balance,
+        )
+
+
+def add_pending_loan(loan):
+    # A loan created as not approved (e.g. from the admin)
+    UserBankAccount.objects.filter(pk=loan.account_id).update(pending_loan_count=F('pending_loan_count') + 1)
+    invalidate_account_summary(loan.account)
+
+
+def approve_loan(loan, was_pending=True):
+    # Credits the loan amount; the caller saves the loan row itself
+    changes = {'outstanding_loan_amount': F('outstanding_loan_amount') + loan.amount}
+    if was_pending:
+        changes['pending_loan_count'] = F('pending_loan_count') - 1
+    with db_transaction.atomic():
+        loan.balance_after_transaction = _change_balance(loan.account, loan.amount, **changes)
+        if loan.pk is None:
+            # Created approved from the admin; the posting needs its id
+            loan.save()
+        record_day(loan.account, loan.balance_after_transaction, loan=loan.amount)
+        ledger.post(LOAN, loan.account, loan.amount, loan.pk)
+        notifications.queue_email(loan.account, loan.amount, notifications.LOAN_APPROVAL_EMAIL)
+        return loan
+
+
+def reverse_loan(loan):
+    # Takes an approved loan back out of the account, it is pending again
+    with db_transaction.atomic():
+        loan.balance_after_transaction = _change_balance(
+            loan.account,
+            -loan.amount,
+            outstanding_loan_amount=F('outstanding_loan_amount') - loan.amount,
+            pending_loan_count=F('pending_loan_count') + 1,
+        )
+        record_day(loan.account, loan.balance_after_transaction, loan=-loan.amount)
+        ledger.post(LOAN_REVERSED, loan.account, loan.amount, loan.pk)
+        return loan
+
+
+@retry_on_lock
+def adjust_balance(account, amount):
+    # A manual correction by staff, e.g. from the account admin; negative
+    # takes money out. It has no Transaction row, the ledger books it
+    # against the suspense book.
+    with db_transaction.atomic():
+        balance = _change_balance(account, amount)
+        record_day(account, balance)
+        ledger.post(ADJUSTMENT, account, amount)
+        return balance
+
+
+def reconcile_loan_state(accounts):
+    # Rebuilds the denormalized loan fields of the given accounts from
+    # Transaction. Returns how many accounts had drifted.
+    accounts = list(accounts)
+    state = {
+        row['account_id']: row
+        for row in Transaction.objects.filter(
+            account__in=accounts,
+            transaction_type=LOAN,
+        ).values('account_id').annotate(
+            pending=Count('id', filter=Q(loan_approve=False)),
+            outstanding=Sum('amount', filter=Q(loan_approve=True)),
+        )
+    }
+
+    fixed = []
+    for account in accounts:
+        row = state.get(account.pk, {})
+        pending = row.get('pending', 0)
+        outstanding = row.get('outstanding') or Decimal(0)
+        if (account.pending_loan_count, account.outstanding_loan_amount) != (pending, outstanding):
+            account.pending_loan_count = pending
+            account.outstanding_loan_amount = outstanding
+            fixed.append(account)
+
+    UserBankAccount.objects.bulk_update(fixed, ['pending_loan_count', 'outstanding_loan_amount'])
+    for account in fixed:
+        invalidate_account_summary(account)
+    return len(fixed)
+
+
+# Batch ingestion (payroll, merchant settlement): each line is validated with
+# the same forms the HTML views use, all rows go in with one bulk_create and
+# every account's balance moves with a single UPDATE for the whole batch.
+
+BATCH_TYPES = {
+    'deposit': DEPOSIT,
+    'withdrawal': WITHDRAWAL,
+}
+
+BATCH_SIZE = 1000
+
+
+class BatchConflict(Exception):
+    pass
+
+
+def parse_batch_line(line):
+    entry = json.loads(line, parse_float=Decimal)
+    if not isinstance(entry, dict):
+        raise ValueError("Each line must be a JSON object")
+    return entry
+
+
+def _batch_account_no(entry):
+    # A JSON integer or a string of digits, None for anything else. Floats
+    # (parsed as Decimal) and booleans would otherwise be truncated into
+    # some other account's number.
+    account_no = entry.get('account_no')
+    if isinstance(account_no, int) and not isinstance(account_no, bool):
+        return account_no
+    if isinstance(account_no, str) and account_no.isascii() and account_no.isdigit():
+        return int(account_no)
+    return None
+
+
+def ingest_jsonl(lines, start_line=1):
+    # Returns one result dict per non-blank line
+    entries = []
+    results = []
+    for number, line in enumerate(lines, start_line):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode()
+            if not line.strip():
+                continue
+            entries.append((number, parse_batch_line(line)))
+        except UnicodeDecodeError as e:
+            results.append({'line': number, 'ok': False, 'errors': [f"Invalid UTF-8: {e}"]})
+        except ValueError as e:
+            results.append({'line': number, 'ok': False, 'errors': [f"Invalid JSON: {e}"]})
+
+    results.extend(apply_batch(entries))
+    results.sort(key=lambda result: result['line'])
+    return results
+
+
+def ingest_jsonl_batches(lines, batch_size=INGEST_BATCH_SIZE):
+    # ingest_jsonl() over ``batch_size`` lines at a time, so a large input
+    # isn't one long DB transaction holding the write lock. Yields the
+    # results batch by batch.
+    lines = iter(lines)
+    start_line = 1
+    while True:
+        chunk = list(islice(lines, batch_size))
+        if not chunk:
+            return
+        yield from ingest_jsonl(chunk, start_line=start_line)
+        start_line += len(chunk)
+
+
+def _retry_on_conflict(func, *args, retries=3):
+    for attempt in range(retries):
+        try:
+            return func(*args)
+        except BatchConflict:
+            if attempt == retries - 1:
+                raise
+
+
+@retry_on_lock
+def apply_batch(entries):
+    # entries is a list of (line_number, dict) pairs
+    return _retry_on_conflict(_apply_batch, entries)
+
+
+def _apply_batch(entries):
+    from .forms import DipositForm, WithdrawalForm
+    batch_forms = {DEPOSIT: DipositForm, WITHDRAWAL: WithdrawalForm}
+
+    with db_transaction.atomic():
+        account_nos = {_batch_account_no(entry) for _, entry in entries}
+        # The running balances below are the account rows'
+        shards.consolidate(UserBankAccount.objects.filter(account_no__in=account_nos, balance_shards__gt=0).values('pk'))
+        accounts = {
+            account.account_no: account
+            for account in UserBankAccount.objects.select_for_update().filter(account_no__in=account_nos)
+        }
+        opening = {account.pk: account.balance for account in accounts.values()}
+        moved = defaultdict(lambda: {DEPOSIT: 0, WITHDRAWAL: 0})
+        withdrawals = defaultdict(int)
+
+        results = []
+        rows = []
+        emails = []
+        for number, entry in entries:
+            account = accounts.get(_batch_account_no(entry))
+            kind = BATCH_TYPES.get(entry.get('type'))
+            if _batch_account_no(entry) is None:
+                results.append({'line': number, 'ok': False, 'errors': ["account_no must be a whole number"]})
+                continue
+            if account is None:
+                results.append({'line': number, 'ok': False, 'errors': ["Unknown account"]})
+                continue
+            if kind is None:
+                results.append({'line': number, 'ok': False, 'errors': ["Type must be 'deposit' or 'withdrawal'"]})
+                continue
+
+            # The form checks the running balance, so later withdrawals in
+            # the batch can spend earlier deposits but never overdraw the
+            # account
+            form = batch_forms[kind](
+                data={'amount': entry.get('amount')},
+                initial={'transaction_type': kind},
+                account=account,
+                balance=account.balance,
+            )
+            if not form.is_valid():
+                errors = [error for field_errors in form.errors.values() for error in field_errors]
+                results.append({'line': number, 'ok': False, 'errors': errors})
+                continue
+
+            amount = form.cleaned_data['amount']
+            account.balance += amount if kind == DEPOSIT else -amount
+            moved[account.pk][kind] += amount
+            if kind == WITHDRAWAL:
+                withdrawals[account.pk] += 1
+            email = notifications.DEPOSIT_EMAIL if kind == DEPOSIT else notifications.WITHDRAWAL_EMAIL
+            emails.append(notifications.build_notification(account, amount, email))
+            rows.append(Transaction(
+                account=account,
+                amount=amount,
+                transaction_type=kind,
+                balance_after_transaction=account.balance,
+            ))
+            results.append({'line': number, 'ok': True, 'account_no': account.account_no, 'balance_after': str(account.balance)})
+
+        Transaction.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+        Notification.objects.bulk_create(emails, batch_size=BATCH_SIZE)
+
+        for account in accounts.values():
+            if account.pk not in moved:
+                continue
+            # The balance checks guard databases that ignore
+            # select_for_update, and never let the balance go below zero
+            delta = account.balance - opening[account.pk]
+            updated = UserBankAccount.objects.filter(
+                pk=account.pk,
+                balance=opening[account.pk],
+                balance__gte=-delta,
+            ).update(balance=F('balance') + delta)
+            if not updated:
+                raise BatchConflict
+            record_day(
+                account,
+                account.balance,
+                deposit=moved[account.pk][DEPOSIT],
+                withdrawal=moved[account.pk][WITHDRAWAL],
+            )
+            invalidate_account_summary(account)
+
+        # Staff batches aren't held to the quotas, but what they withdrew
+        # counts against the customer's next withdrawal
+        for account in accounts.values():
+            if withdrawals[account.pk]:
+                quotas.record(
+                    account,
+                    withdrawals_per_day=withdrawals[account.pk],
+                    withdrawn_per_day=moved[account.pk][WITHDRAWAL],
+                )
+
+        # After the UPDATEs, which hold the accounts' row locks
+        ledger.post_many([(row.transaction_type, row.account, row.amount, row.pk) for row in rows])
+
+    ok_rows = iter(rows)
+    for result in results:
+        if result['ok']:
+            result['id'] = next(ok_rows).pk
+    return results
+
+
+# Bulk loan approval / reversal for the admin. All selected loans move in one
+# DB transaction, each account's balance with one UPDATE, and every loan gets
+# the balance_after_transaction it would have had if handled one by one.
+
+@retry_on_lock
+def bulk_approve_loans(loan_ids):
+    return _retry_on_conflict(_bulk_change_loans, loan_ids, True)
+
+
+@retry_on_lock
+def bulk_reverse_loans(loan_ids):
+    return _retry_on_conflict(_bulk_change_loans, loan_ids, False)
+
+
+def _bulk_change_loans(loan_ids, approve):
+    # Returns {'changed': [...], 'insufficient': [...], 'ignored': [...]} loan ids
+    loan_ids = set(loan_ids)
+    with db_transaction.atomic():
+        # Accounts are locked before their loans, like pay_loan does, so the
+        # two can't deadlock. A loan that moved on before its lock (paid,
+        # approved or reversed by someone else) is left out and reported
+        # as ignored.
+        candidates = Transaction.objects.filter(pk__in=loan_ids, transaction_type=LOAN, loan_approve=not approve)
+        account_ids = set(candidates.values_list('account_id', flat=True))
+        shards.consolidate(account_ids)
+        accounts = UserBankAccount.objects.select_for_update().in_bulk(account_ids)
+        loans = list(
+            candidates.select_for_update()
+            .filter(account_id__in=accounts)
+            .order_by('account_id', 'timestamp', 'id')
+        )
+
+        changed = []
+        insufficient = []
+        emails = []
+        for account_id, account_loans in groupby(loans, key=lambda loan: loan.account_id):
+            account = accounts[account_id]
+            opening = account.balance
+            moved = []
+            for loan in account_loans:
+                if not approve and account.balance < loan.amount:
+                    insufficient.append(loan.pk)
+                    continue
+                account.balance += loan.amount if approve else -loan.amount
+                loan.loan_approve = approve
+                loan.balance_after_transaction = account.balance
+                moved.append(loan)
+                if approve:
+                    emails.append(notifications.build_notification(account, loan.amount, notifications.LOAN_APPROVAL_EMAIL))
+            if not moved:
+                continue
+
+            total = sum(loan.amount for loan in moved)
+            sign = 1 if approve else -1
+            updated = UserBankAccount.objects.filter(pk=account.pk, balance=opening).update(
+                balance=F('balance') + sign * total,
+                outstanding_loan_amount=F('outstanding_loan_amount') + sign * total,
+                pending_loan_count=F('pending_loan_count') - sign * len(moved),
+            )
+            if not updated:
+                raise BatchConflict
+            record_day(account, account.balance, loan=sign * total)
+            invalidate_account_summary(account)
+            changed.extend(moved)
+
+        Transaction.objects.bulk_update(changed, ['loan_approve', 'balance_after_transaction'], batch_size=BATCH_SIZE)
+        ledger.post_many([
+            (LOAN if approve else LOAN_REVERSED, accounts[loan.account_id], loan.amount, loan.pk)
+            for loan in changed
+        ])
+        Notification.objects.bulk_create(emails, batch_size=BATCH_SIZE)
+
+    changed_ids = {loan.pk for loan in changed}
+    return {
+        'changed': sorted(changed_ids),
+        'insufficient': sorted(insufficient),
+        'ignored': sorted(loan_ids - changed_ids - set(insufficient)),
+    }
@@ -0,0 +1,167 @@
+import random
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction as db_transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value, DecimalField
+from django.db.models.functions import Coalesce
+
+from accounts.models import UserBankAccount
+from .models import BalanceShard
+from .snapshots import record_day
+from . import summary
+
+
+# Sharded balance counters for accounts that take many deposits at once
+# (merchants, payroll). An account with balance_shards = N has N BalanceShard
+# rows and its balance is UserBankAccount.balance plus theirs. A deposit
+# adds to one random shard, so concurrent deposits update different rows
+# instead of queueing on the account row. A withdrawal takes from a random
+# shard that covers it; when none does it goes through the account row as
+# usual, and services._change_balance consolidates first: every shard is
+# moved into the account row under its lock. Any other write to a sharded
+# account (loans, batches) consolidates too.
+#
+# Shard writes leave DailyBalance alone as well, its row for the day would
+# be just as hot. Each shard keeps what moved through it since the last
+# consolidation and consolidate() books that with record_day, so the daily
+# snapshots of a sharded account trail until `manage.py
+# consolidate_balance_shards`, which is meant to run every minute or so.
+#
+# Nothing here depends on the flag being current: money in the account row
+# counts whether or not the account is sharded, and a deposit whose shard is
+# gone (sharding was turned off meanwhile) goes to the account row.
+#
+# Off unless settings.BALANCE_SHARDS is set, see there for which databases
+# it is meant for.
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+CENTS = Decimal('0.01')
+
+
+def in_use(account):
+    # Whether deposits and withdrawals go through the account's shards
+    return settings.BALANCE_SHARDS and account.balance_shards > 0
+
+
+def with_total(accounts):
+    # Annotates an account queryset with total_balance, shards included
+    shards = (
+        BalanceShard.objects.filter(account=OuterRef('pk'))
+        .values('account').annotate(total=Sum('balance')).values('total')
+    )
+    return accounts.annotate(
+        total_balance=F('balance') + Coalesce(Subquery(shards), Value(Decimal(0)), output_field=MONEY),
+    )
+
+
+def total(account_id):
+    # Two plain queries cost less than with_total's one. A consolidation
+    # can't commit between them while the caller holds a shard lock; for
+    # other readers it moves the summary version on (see summary.py).
+    column = UserBankAccount.objects.filter(pk=account_id).values_list('balance', flat=True).get()
+    sharded = BalanceShard.objects.filter(account_id=account_id).aggregate(total=Sum('balance'))['total']
+    return (column + Decimal(sharded or 0)).quantize(CENTS)
+
+
+def balance(account):
+    # The account's balance; no query unless it is sharded
+    if not account.balance_shards:
+        return account.balance
+    return total(account.pk)
+
+
+async def abalance(account):
+    if not account.balance_shards:
+        return account.balance
+    column = await UserBankAccount.objects.filter(pk=account.pk).values_list('balance', flat=True).aget()
+    sharded = (await BalanceShard.objects.filter(account_id=account.pk).aaggregate(total=Sum('balance')))['total']
+    return (column + Decimal(sharded or 0)).quantize(CENTS)
+
+
+def deposit(account, amount):
+    """
+    Adds ``amount`` to a random shard of a sharded account, inside the
+    caller's atomic block. Returns the new balance (also set on
+    account.balance, like services._change_balance), or None if the shard
+    is gone and the deposit has to go to the account row.
+    """
+    shard = random.randrange(account.balance_shards)
+    updated = BalanceShard.objects.filter(account=account, shard=shard).update(
+        balance=F('balance') + amount,
+        deposit_total=F('deposit_total') + amount,
+    )
+    if not updated:
+        return None
+    return _moved(account)
+
+
+def withdraw(account, amount):
+    # Takes ``amount`` from a random shard that holds enough. Returns the new
+    # balance, or None if no shard can cover it on its own.
+    covering = list(
+        BalanceShard.objects.filter(account=account, balance__gte=amount).values_list('shard', flat=True)
+    )
+    if not covering:
+        return None
+    updated = BalanceShard.objects.filter(account=account, shard=random.choice(covering), balance__gte=amount).update(
+        balance=F('balance') - amount,
+        withdrawal_total=F('withdrawal_total') + amount,
+    )
+    if not updated:
+        return None
+    return _moved(account)
+
+
+def _moved(account):
+    account.balance = total(account.pk)
+    summary.invalidate_account_summary(account)
+    return account.balance
+
+
+def consolidate(account_ids):
+    """
+    Moves the shard balances of the given accounts (those that are sharded)
+    into their account rows, books what went through the shards in
+    DailyBalance and zeroes the shards. Must be called inside an atomic
+    block. Returns how many accounts had something to move.
+    """
+    # The account row first, then its shards, like every other writer
+    accounts = UserBankAccount.objects.select_for_update().filter(pk__in=account_ids, balance_shards__gt=0).in_bulk()
+    if not accounts:
+        return 0
+    # Locked separately, FOR UPDATE can't go with GROUP BY
+    list(BalanceShard.objects.select_for_update().filter(account_id__in=accounts).values_list('pk', flat=True))
+    pending = (
+        BalanceShard.objects.filter(account_id__in=accounts)
+        .values('account_id')
+        .annotate(moved=Sum('balance'), deposits=Sum('deposit_total'), withdrawals=Sum('withdrawal_total'))
+        .exclude(deposits=0, withdrawals=0)
+    )
+
+    moved = []
+    for row in pending:
+        account = accounts[row['account_id']]
+        UserBankAccount.objects.filter(pk=account.pk).update(balance=F('balance') + row['moved'])
+        account.balance += Decimal(row['moved']).quantize(CENTS)
+        record_day(account, account.balance, deposit=row['deposits'], withdrawal=row['withdrawals'])
+        summary.invalidate_account_summary(account)
+        moved.append(account.pk)
+
+    BalanceShard.objects.filter(account_id__in=moved).update(balance=0, deposit_total=0, withdrawal_total=0)
+    return len(moved)
+
+
+def set_shards(account, count):
+    # Splits the account's balance over ``count`` shards from now on, or
+    # stops sharding it with 0. Whatever the old shards hold is consolidated.
+    if count and not settings.BALANCE_SHARDS:
+        raise ImproperlyConfigured('Set BALANCE_SHARDS to shard account balances')
+    with db_transaction.atomic():
+        consolidate([account.pk])
+        BalanceShard.objects.filter(account=account).delete()
+        BalanceShard.objects.bulk_create([BalanceShard(account=account, shard=shard) for shard in range(count)])
+        UserBankAccount.objects.filter(pk=account.pk).update(balance_shards=count)
+        account.balance_shards = count
+        summary.invalidate_account_summary(account)
@@ -0,0 +1,123 @@
+from decimal import Decimal
+from operator import itemgetter
+
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Transaction, ArchivedTransaction, DailyBalance, LedgerEntry
+from .constants import DEPOSIT, WITHDRAWAL, LOAN, LOAN_PAID, ADJUSTMENT, BOOK_CUSTOMER
+from . import archive
+
+
+TOTALS = ['deposit_total', 'withdrawal_total', 'loan_total', 'repayment_count']
+
+
+def record_day(account, closing_balance, deposit=0, withdrawal=0, loan=0, repayments=0):
+    # Called from services.py inside the same atomic block as the balance
+    # UPDATE, which already holds the account row lock, so this never races
+    # with another write to the same account.
+    today = timezone.localdate()
+    changes = {
+        'deposit_total': deposit,
+        'withdrawal_total': withdrawal,
+        'loan_total': loan,
+        'repayment_count': repayments,
+    }
+    updated = DailyBalance.objects.filter(account=account, date=today).update(
+        closing_balance=closing_balance,
+        **{field: F(field) + change for field, change in changes.items() if change},
+    )
+    if updated:
+        return
+
+    # First write of the day: carry the running totals forward
+    previous = DailyBalance.objects.filter(account=account, date__lt=today).order_by('-date').first()
+    DailyBalance.objects.create(
+        account=account,
+        date=today,
+        closing_balance=closing_balance,
+        **{field: (getattr(previous, field) if previous else 0) + change for field, change in changes.items()},
+    )
+
+
+def period_summary(account, start_date, end_date):
+    # Opening/closing balance and totals for [start_date, end_date] from at
+    # most two rows: the last one before the range and the last one in it
+    before = DailyBalance.objects.filter(account=account, date__lt=start_date).order_by('-date').first()
+    last = DailyBalance.objects.filter(account=account, date__lte=end_date).order_by('-date').first()
+    return summarize_period(before, last)
+
+
+async def aperiod_summary(account, start_date, end_date):
+    before = await DailyBalance.objects.filter(account=account, date__lt=start_date).order_by('-date').afirst()
+    last = await DailyBalance.objects.filter(account=account, date__lte=end_date).order_by('-date').afirst()
+    return summarize_period(before, last)
+
+
+def summarize_period(before, last):
+    opening = before.closing_balance if before else Decimal(0)
+    summary = {
+        'opening_balance': opening,
+        'closing_balance': last.closing_balance if last else opening,
+    }
+    for field in TOTALS:
+        summary[field] = (getattr(last, field) if last else 0) - (getattr(before, field) if before else 0)
+    return summary
+
+
+def rebuild_account(account):
+    # Recomputes every snapshot of one account from its Transaction rows,
+    # archived ones included, and the staff adjustments in the ledger, which
+    # have no Transaction row. Approval and repayment times of loans aren't
+    # stored, so both are booked on the day the loan was requested.
+    def stream(model):
+        return (
+            model.objects.filter(account=account)
+            .order_by('timestamp', 'id')
+            .values_list('timestamp', 'id', 'transaction_type', 'amount', 'loan_approve')
+            .iterator(chunk_size=2000)
+        )
+
+    adjustments = (
+        (created_at, pk, ADJUSTMENT, amount, False)
+        for created_at, pk, amount in (
+            LedgerEntry.objects.filter(account=account, book=BOOK_CUSTOMER, posting__kind=ADJUSTMENT)
+            .order_by('posting__created_at', 'id')
+            .values_list('posting__created_at', 'id', 'amount')
+            .iterator(chunk_size=2000)
+        )
+    )
+    rows = archive.merged(
+        archive.merged(stream(Transaction), stream(ArchivedTransaction), key=itemgetter(0, 1)),
+        adjustments,
+        key=itemgetter(0, 1),
+    )
+    running = dict.fromkeys(TOTALS, 0)
+    balance = Decimal(0)
+    snapshots = {}
+    for timestamp, _, kind, amount, approved in rows:
+        if kind == DEPOSIT:
+            balance += amount
+            running['deposit_total'] += amount
+        elif kind == WITHDRAWAL:
+            balance -= amount
+            running['withdrawal_total'] += amount
+        elif kind == LOAN and approved:
+            balance += amount
+            running['loan_total'] += amount
+        elif kind == LOAN_PAID:
+            # Credited when approved, then paid back in full
+            running['loan_total'] += amount
+            running['repayment_count'] += 1
+        elif kind == ADJUSTMENT:
+            # Signed, and in none of the totals
+            balance += amount
+
+        day = timezone.localdate(timestamp)
+        snapshots[day] = DailyBalance(account=account, date=day, closing_balance=balance, **running)
+
+    with db_transaction.atomic():
+        DailyBalance.objects.filter(account=account).delete()
+        DailyBalance.objects.bulk_create(snapshots.values(), batch_size=1000)
+    return len(snapshots)
@@ -0,0 +1,134 @@
+import calendar
+import os
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from itertools import groupby
+from operator import itemgetter
+
+from django.db.models import OuterRef, Subquery
+from django.template.loader import get_template
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from .models import Transaction, ArchivedTransaction, DailyBalance
+from .constants import LOAN, LOAN_PAID, TRANSACTION_TYPES
+from . import archive
+
+
+# Monthly statements, one HTML file per account, written by
+# `manage.py monthly_statements`. The command spreads account id ranges over
+# a process pool; a range is rendered with two streamed queries no matter
+# how many accounts it holds: the accounts with their opening and closing
+# balance from the DailyBalance snapshots, and the month's transactions of
+# all of them in (account, timestamp, id) order, plus the same from the
+# archive for months it reaches.
+
+TEMPLATE = 'transactions/statement.html'
+CHUNK_SIZE = 2000
+TRANSACTION_TYPE_LABELS = dict(TRANSACTION_TYPES)
+
+
+def parse_month(value):
+    # "2025-06" -> (2025, 6)
+    try:
+        year, month = (int(part) for part in value.split('-'))
+        date(year, month, 1)
+    except ValueError:
+        raise ValueError(f'{value!r} is not a month like 2025-06')
+    return year, month
+
+
+def month_days(year, month):
+    return date(year, month, 1), date(year, month, calendar.monthrange(year, month)[1])
+
+
+def statement_path(directory, year, month, account_no):
+    # A thousand statements per directory keeps listings usable
+    return os.path.join(directory, f'{year}-{month:02}', str(account_no // 1000), f'{account_no}.html')
+
+
+def loan_status(kind, approved):
+    if kind == LOAN_PAID:
+        return 'Repaid'
+    if kind == LOAN:
+        return 'Approved' if approved else 'Pending'
+    return ''
+
+
+def write_range(start, end, year, month, directory):
+    """
+    Writes the statements of every account with id in [start, end) that was
+    opened by the end of the month, and returns how many were written.
+    Existing files are overwritten, so a range can safely be run again.
+    """
+    first_day, last_day = month_days(year, month)
+    start_time = timezone.make_aware(datetime.combine(first_day, time.min))
+    end_time = timezone.make_aware(datetime.combine(last_day + timedelta(days=1), time.min))
+
+    snapshots = DailyBalance.objects.filter(account=OuterRef('pk')).order_by('-date').values('closing_balance')
+    accounts = (
+        UserBankAccount.objects.filter(pk__gte=start, pk__lt=end, initial_deposit_date__lte=last_day)
+        .annotate(
+            opening_balance=Subquery(snapshots.filter(date__lt=first_day)[:1]),
+            closing_balance=Subquery(snapshots.filter(date__lte=last_day)[:1]),
+        )
+        .select_related('user')
+        .order_by('pk')
+    )
+    def stream(model):
+        return (
+            model.objects.filter(
+                account_id__gte=start, account_id__lt=end,
+                timestamp__gte=start_time, timestamp__lt=end_time,
+            )
+            .order_by('account_id', 'timestamp', 'id')
+            .values_list('account_id', 'timestamp', 'id', 'transaction_type', 'amount', 'balance_after_transaction', 'loan_approve')
+            .iterator(chunk_size=CHUNK_SIZE)
+        )
+
+    rows = stream(Transaction)
+    if archive.reaches(start_time):
+        rows = archive.merged(rows, stream(ArchivedTransaction), key=itemgetter(0, 1, 2))
+    histories = groupby(rows, key=itemgetter(0))
+    history = next(histories, None)
+
+    template = get_template(TEMPLATE)
+    written = 0
+    for account in accounts.iterator(chunk_size=CHUNK_SIZE):
+        # Skip rows of accounts opened after the month (backdated rows)
+        while history is not None and history[0] < account.pk:
+            history = next(histories, None)
+        transactions = []
+        if history is not None and history[0] == account.pk:
+            transactions = [
+                {
+                    'timestamp': timestamp,
+                    'type': TRANSACTION_TYPE_LABELS.get(kind),
+                    'amount': amount,
+                    'balance_after_transaction': balance_after,
+                    'loan_status': loan_status(kind, approved),
+                }
+                for _, timestamp, _, kind, amount, balance_after, approved in history[1]
+            ]
+            history = next(histories, None)
+
+        opening = account.opening_balance or Decimal(0)
+        content = template.render({
+            'account': account,
+            'month': first_day,
+            'last_day': last_day,
+            'opening_balance': opening,
+            'closing_balance': account.closing_balance if account.closing_balance is not None else opening,
+            'transactions': transactions,
+        })
+        write_file(statement_path(directory, year, month, account.account_no), content)
+        written += 1
+    return written
+
+
+def write_file(path, content):
+    # Renamed into place, so an interrupted run never leaves half a statement
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(f'{path}.tmp', path)
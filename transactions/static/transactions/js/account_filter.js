@@ -0,0 +1,13 @@
+'use strict';
+{
+    const $ = django.jQuery;
+
+    // Reload the changelist filtered on the account picked in the sidebar
+    $(document).on('change', 'select.account-filter', function() {
+        const url = new URL(this.dataset.clearUrl, window.location.href);
+        if (this.value) {
+            url.searchParams.set(this.dataset.parameter, this.value);
+        }
+        window.location.href = url.toString();
+    });
+}
@@ -0,0 +1,120 @@
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+
+from accounts.models import UserBankAccount
+from core.routers import primary_reads
+from .models import Transaction, ArchivedTransaction
+from .pagination import keyset_page, akeyset_page
+from . import caches, quotas, shards
+
+
+# Cached per-user account summary: the account with its balance, the latest
+# transactions, whether a loan is pending and how many loans were taken in
+# the loans-per-30-days quota window (quotas.py). Every write path calls
+# invalidate_account_summary(), which moves the user's summary to a new
+# version once the DB transaction commits, so a cache hit is never stale and
+# never touches the database. Versioning instead of a plain delete means a
+# reader that started building before the write can't put an old summary
+# back under the current key.
+#
+# The version has to live in a cache every process shares: a per-process
+# cache only moves the version in the worker that did the write, and the
+# others would keep serving their copy. With a per-process cache (see
+# caches.py) summaries are built on every call instead of cached, and
+# `manage.py check --deploy` warns about it (checks.py).
+
+SUMMARY_TIMEOUT = 60 * 15
+RECENT_TRANSACTIONS = 10
+
+
+def version_key(user_id):
+    return f'account-summary-version:{user_id}'
+
+
+def summary_key(user_id):
+    version = cache.get(version_key(user_id))
+    if version is None:
+        cache.add(version_key(user_id), time.time_ns(), None)
+        version = cache.get(version_key(user_id))
+    return f'account-summary:{user_id}:{version}'
+
+
+async def asummary_key(user_id):
+    version = await cache.aget(version_key(user_id))
+    if version is None:
+        await cache.aadd(version_key(user_id), time.time_ns(), None)
+        version = await cache.aget(version_key(user_id))
+    return f'account-summary:{user_id}:{version}'
+
+
+def get_account_summary(user):
+    if not caches.is_shared():
+        return build_account_summary(user)
+    key = summary_key(user.pk)
+    summary = cache.get(key)
+    if summary is None:
+        summary = build_account_summary(user)
+        cache.set(key, summary, SUMMARY_TIMEOUT)
+    return summary
+
+
+def build_account_summary(user):
+    # Always from the primary: a summary built from a lagging replica would
+    # be cached under the new version and outlive the lag
+    with primary_reads():
+        account = UserBankAccount.objects.get(user=user)
+        # Reads the archive too if the account has been quiet for long
+        recent, next_cursor, _ = keyset_page(
+            Transaction.objects.filter(account=account),
+            RECENT_TRANSACTIONS,
+            archive=ArchivedTransaction.objects.filter(account=account),
+        )
+        balance = shards.balance(account)
+        loans = quotas.used(account, 'loans_per_30_days')
+    return make_summary(account, balance, recent, next_cursor is not None, loans)
+
+
+async def aget_account_summary(user):
+    # For async views, see async_views.py
+    if not caches.is_shared():
+        return await abuild_account_summary(user)
+    key = await asummary_key(user.pk)
+    summary = await cache.aget(key)
+    if summary is None:
+        summary = await abuild_account_summary(user)
+        await cache.aset(key, summary, SUMMARY_TIMEOUT)
+    return summary
+
+
+async def abuild_account_summary(user):
+    with primary_reads():
+        account = await UserBankAccount.objects.aget(user=user)
+        recent, next_cursor, _ = await akeyset_page(
+            Transaction.objects.filter(account=account),
+            RECENT_TRANSACTIONS,
+            archive=ArchivedTransaction.objects.filter(account=account),
+        )
+        balance = await shards.abalance(account)
+        loans = await sync_to_async(quotas.used)(account, 'loans_per_30_days')
+    return make_summary(account, balance, recent, next_cursor is not None, loans)
+
+
+def make_summary(account, balance, recent, has_more, loans):
+    # balance counts the shards of a sharded account, account.balance doesn't
+    return {
+        'account': account,
+        'balance': balance,
+        'recent_transactions': recent,
+        'has_more': has_more,
+        'has_pending_loan': account.pending_loan_count > 0,
+        'loans_last_30_days': loans,
+    }
+
+
+def invalidate_account_summary(account):
+    # Runs right away outside a transaction, on commit inside one
+    key = version_key(account.user_id)
+    db_transaction.on_commit(lambda: cache.set(key, time.time_ns(), None))
@@ -1,3 +1,922 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from smtplib import SMTPException
+from importlib import import_module
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends import locmem
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, transaction as db_transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from accounts.models import UserBankAccount
+from .models import ArchivedTransaction, BalanceShard, IdempotencyKey, LedgerEntry, Notification, Transaction
+from .constants import DEPOSIT, LOAN, LOAN_PAID, NOTIFICATION_PENDING, NOTIFICATION_SENT, NOTIFICATION_FAILED
+from . import (
+    archive, async_views, caches, group_commit, idempotency, ledger, notifications, parallel, quotas,
+    reconcile, services, shards, snapshots, statements,
+)
+from .pagination import encode_cursor, decode_cursor, InvalidCursor
+from .summary import get_account_summary, RECENT_TRANSACTIONS
+
+
+def make_account(number, account_type='Savings', balance=0):
+    user = User.objects.create_user(f'user{number}', password='password')
+    account = UserBankAccount.objects.create(user=user, account_type=account_type, gender='Male', account_no=number)
+    if balance:
+        services.deposit(account, Decimal(balance))
+    return account
+
+
+def cursor(raw):
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def books_balance(test, account):
+    # The balance column, the ledger and the trial balance all agree
+    account.refresh_from_db()
+    test.assertEqual(ledger.balance(account), shards.balance(account))
+    test.assertEqual(sum(ledger.trial_balance().values()), 0)
+
+
+class CacheMixin:
+    # Summaries, quota buckets and idempotency outcomes are cached by id,
+    # and ids repeat from one test to the next
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+
+class BalanceServiceTests(CacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = make_account(1, balance=10000)
+
+    def test_withdraw_more_than_balance_moves_nothing(self):
+        with self.assertRaises(services.InsufficientBalance):
+            services.withdraw(self.account, Decimal(10001))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal(10000))
+        self.assertEqual(Transaction.objects.filter(account=self.account).count(), 1)
+        books_balance(self, self.account)
+
+    def test_rebuilt_snapshots_keep_adjustments(self):
+        services.adjust_balance(self.account, Decimal(123))
+        backfill = import_module('transactions.migrations.0019_backfill_daily_balances').backfill_daily_balances
+        rebuilds = {
+            'rebuild_daily_balances': lambda: snapshots.rebuild_account(self.account),
+            'migration 0019': lambda: backfill(apps, None),
+        }
+        for name, rebuild in rebuilds.items():
+            with self.subTest(name):
+                rebuild()
+                day = self.account.daily_balances.get()
+                self.assertEqual((day.closing_balance, day.deposit_total), (Decimal(10123), Decimal(10000)))
+
+
+class ConcurrentBalanceTests(CacheMixin, TransactionTestCase):
+    threads = 8
+
+    def run_threads(self, target):
+        errors = []
+
+        def run(number):
+            try:
+                target(number)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(number,)) for number in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_concurrent_withdrawals_never_overdraw(self):
+        account = make_account(1, 'Current', balance=5000)
+
+        def withdraw(number):
+            services.withdraw(UserBankAccount.objects.get(pk=account.pk), Decimal(1000))
+
+        errors = self.run_threads(withdraw)
+        self.assertEqual(len(errors), 3)
+        self.assertTrue(all(isinstance(e, services.InsufficientBalance) for e in errors))
+        account.refresh_from_db()
+        self.assertEqual(account.balance, 0)
+        self.assertFalse(Transaction.objects.filter(balance_after_transaction__lt=0).exists())
+        books_balance(self, account)
+
+    def test_concurrent_deposits_are_all_counted(self):
+        account = make_account(1)
+
+        def deposit(number):
+            for _ in range(5):
+                services.deposit(UserBankAccount.objects.get(pk=account.pk), Decimal(100))
+
+        self.assertEqual(self.run_threads(deposit), [])
+        account.refresh_from_db()
+        self.assertEqual(account.balance, Decimal(100 * 5 * self.threads))
+        books_balance(self, account)
+
+
+    @override_settings(BALANCE_SHARDS=True)
+    def test_concurrent_deposits_to_a_sharded_account(self):
+        account = make_account(1)
+        shards.set_shards(account, 4)
+
+        def deposit(number):
+            for _ in range(5):
+                services.deposit(UserBankAccount.objects.get(pk=account.pk), Decimal(100))
+
+        self.assertEqual(self.run_threads(deposit), [])
+        self.assertEqual(shards.total(account.pk), Decimal(100 * 5 * self.threads))
+        books_balance(self, account)
+
+
+class LoanTests(CacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = make_account(1)
+
+    def approved_loan(self, amount=2000):
+        loan = services.request_loan(self.account, Decimal(amount))
+        loan.loan_approve = True
+        services.approve_loan(loan)
+        loan.save()
+        return Transaction.objects.get(pk=loan.pk)
+
+    def test_pay_loan(self):
+        loan = self.approved_loan()
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal(2000))
+        services.pay_loan(self.account, loan)
+        self.account.refresh_from_db()
+        self.assertEqual((self.account.balance, self.account.outstanding_loan_amount), (0, 0))
+        self.assertEqual(Transaction.objects.get(pk=loan.pk).transaction_type, LOAN_PAID)
+        services.deposit(self.account, Decimal(2000))
+        with self.assertRaises(services.LoanNotPayable):
+            services.pay_loan(self.account, loan)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal(2000))
+        books_balance(self, self.account)
+
+    def test_pay_loan_without_the_money(self):
+        loan = self.approved_loan()
+        services.withdraw(self.account, Decimal(500))
+        with self.assertRaises(services.InsufficientBalance):
+            services.pay_loan(self.account, loan)
+        self.assertEqual(Transaction.objects.get(pk=loan.pk).transaction_type, LOAN)
+
+    def test_admin_approval_credits_once(self):
+        loan = services.request_loan(self.account, Decimal(2000))
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        url = reverse('admin:transactions_loantransaction_change', args=[loan.pk])
+        data = {
+            'account': self.account.pk, 'amount': '2000', 'balance_after_transaction': '0',
+            'transaction_type': LOAN, 'loan_approve': 'on',
+        }
+        for _ in range(2):
+            self.assertEqual(self.client.post(url, data).status_code, 302)
+        self.account.refresh_from_db()
+        self.assertEqual((self.account.balance, self.account.pending_loan_count), (Decimal(2000), 0))
+        books_balance(self, self.account)
+
+    def test_admin_cannot_edit_saved_amounts(self):
+        loan = self.approved_loan(5000)
+        deposit = services.deposit(self.account, Decimal(100))
+        other = make_account(2)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        data = {
+            'account': other.pk, 'amount': '9000', 'balance_after_transaction': '1',
+            'transaction_type': DEPOSIT, 'loan_approve': 'on',
+        }
+        for name, row in [('loantransaction', loan), ('transaction', deposit)]:
+            before = Transaction.objects.filter(pk=row.pk).values().get()
+            url = reverse(f'admin:transactions_{name}_change', args=[row.pk])
+            self.assertEqual(self.client.post(url, data).status_code, 302)
+            self.assertEqual(Transaction.objects.filter(pk=row.pk).values().get(), before)
+        self.assertEqual(reconcile.check_range(self.account.pk, other.pk + 1), [])
+        books_balance(self, self.account)
+        self.assertEqual(self.client.get(reverse('admin:transactions_transaction_add')).status_code, 403)
+
+    def test_reconcile_loan_state(self):
+        self.approved_loan(3000)
+        # Pending, next to the approved one the services won't allow
+        Transaction.objects.create(
+            account=self.account, amount=Decimal(2000), transaction_type=LOAN, balance_after_transaction=0,
+        )
+        UserBankAccount.objects.filter(pk=self.account.pk).update(pending_loan_count=7, outstanding_loan_amount=1)
+        out = StringIO()
+        call_command('reconcile_loan_state', stdout=out)
+        self.assertIn('Checked 1 accounts, fixed 1', out.getvalue())
+        self.account.refresh_from_db()
+        self.assertEqual((self.account.pending_loan_count, self.account.outstanding_loan_amount), (1, Decimal(3000)))
+
+
+class ReconcileTests(CacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.drifted = make_account(1, balance=1000)
+        self.broken = make_account(2, balance=1000)
+        services.withdraw(self.broken, Decimal(500))
+        make_account(3, balance=1000)
+        UserBankAccount.objects.filter(pk=self.drifted.pk).update(balance=Decimal(1200))
+        Transaction.objects.filter(account=self.broken, transaction_type=DEPOSIT).update(balance_after_transaction=900)
+
+    def test_check_range(self):
+        report = reconcile.check_range(0, 10)
+        self.assertEqual([(m['account_no'], m['difference']) for m in report], [(1, '200.00'), (2, '0.00')])
+        self.assertEqual(report[1]['chain_break'], Transaction.objects.get(account=self.broken, transaction_type=DEPOSIT).pk)
+
+    def test_command_reports_the_mismatches(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        report = os.path.join(directory, 'report.jsonl')
+        out = StringIO()
+        # Workers are separate processes with their own connections, which
+        # can't see the test database; the ranges are checked in this one
+        with mock.patch.object(parallel, 'run', lambda func, tasks, processes: map(func, tasks)):
+            call_command(
+                'reconcile', range_size=2, checkpoint=os.path.join(directory, 'checkpoint.json'), report=report,
+                stdout=out,
+            )
+        self.assertIn('2 accounts: 1 with a wrong balance (net +200.00), 1 with a broken', out.getvalue())
+        with open(report) as f:
+            self.assertEqual([json.loads(line)['account_no'] for line in f], [1, 2])
+
+
+class StatementTests(CacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = make_account(1)
+        history = [
+            (date(2025, 5, 20), services.deposit, 1000),
+            (date(2025, 6, 5), services.deposit, 500),
+            (date(2025, 6, 20), services.withdraw, 700),
+            (date(2025, 7, 2), services.deposit, 200),
+        ]
+        for day, move, amount in history:
+            row = move(self.account, Decimal(amount))
+            at = timezone.make_aware(datetime.combine(day, time(12)))
+            Transaction.objects.filter(pk=row.pk).update(timestamp=at)
+        UserBankAccount.objects.filter(pk=self.account.pk).update(initial_deposit_date=date(2025, 5, 20))
+        snapshots.rebuild_account(self.account)
+
+    def test_statement_balances_come_from_the_snapshots(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # In this process, see ReconcileTests
+        with mock.patch.object(parallel, 'run', lambda func, tasks, processes: map(func, tasks)):
+            call_command('monthly_statements', month='2025-06', output_dir=directory, stdout=StringIO())
+        with open(statements.statement_path(directory, 2025, 6, 1), encoding='utf-8') as f:
+            html = f.read()
+
+        days = self.account.daily_balances
+        opening = days.filter(date__lt=date(2025, 6, 1)).latest('date').closing_balance
+        closing = days.filter(date__lte=date(2025, 6, 30)).latest('date').closing_balance
+        self.assertEqual((opening, closing), (Decimal(1000), Decimal(800)))
+        balances = re.findall(r'(Opening|Closing) Balance</th>\s*<th class="amount">\$ ([\d,.]+)', html)
+        self.assertEqual(balances, [('Opening', '1,000.00'), ('Closing', '800.00')])
+        self.assertEqual(html.count('June 05, 2025') + html.count('June 20, 2025'), 2)
+        self.assertNotIn('July 02, 2025', html)
+
+
+class NotificationTests(CacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = make_account(1)
+        User.objects.filter(pk=self.account.user_id).update(email='user1@example.com')
+
+    def send(self):
+        call_command('send_notifications', stdout=StringIO())
+
+    def test_written_with_the_transaction(self):
+        services.deposit(self.account, Decimal(500))
+        with self.assertRaises(services.InsufficientBalance):
+            services.withdraw(self.account, Decimal(501))
+        notification = Notification.objects.get()
+        self.assertEqual((notification.amount, notification.balance), (Decimal(500), Decimal(500)))
+        self.assertEqual(mail.outbox, [])
+
+    def test_sent_once(self):
+        services.deposit(self.account, Decimal(500))
+        self.send()
+        self.send()
+        self.assertEqual([message.to for message in mail.outbox], [['user1@example.com']])
+        self.assertEqual(Notification.objects.get().status, NOTIFICATION_SENT)
+
+    def test_failed_send_is_retried_with_backoff(self):
+        services.deposit(self.account, Decimal(500))
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', side_effect=SMTPException('Mail server down')):
+            for attempt in range(1, 3):
+                Notification.objects.update(next_attempt_at=timezone.now())
+                start = timezone.now()
+                self.send()
+                notification = Notification.objects.get()
+                self.assertEqual((notification.status, notification.attempts), (NOTIFICATION_PENDING, attempt))
+                self.assertEqual(notification.last_error, 'Mail server down')
+                delay = notifications.RETRY_DELAY * 2 ** (attempt - 1)
+                self.assertGreaterEqual(notification.next_attempt_at, start + delay)
+                # Not due yet, so left alone
+                self.send()
+                self.assertEqual(Notification.objects.get().attempts, attempt)
+        Notification.objects.update(next_attempt_at=timezone.now())
+        self.send()
+        self.assertEqual(Notification.objects.get().status, NOTIFICATION_SENT)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_failed_after_the_last_attempt(self):
+        services.deposit(self.account, Decimal(500))
+        Notification.objects.update(attempts=notifications.MAX_ATTEMPTS - 1)
+        with mock.patch.object(locmem.EmailBackend, 'send_messages', side_effect=SMTPException('Mail server down')):
+            self.send()
+        self.assertEqual(Notification.objects.get().status, NOTIFICATION_FAILED)
+        Notification.objects.update(next_attempt_at=timezone.now())
+        self.send()
+        self.assertEqual(mail.outbox, [])
+
+
+class QuotaTests(CacheMixin, TransactionTestCase):
+    # Counted in the database, as with the per-process test cache. Commits
+    # for real, the cache counters go up from on_commit.
+    def setUp(self):
+        super().setUp()
+        self.account = make_account(1, balance=10000)
+
+    def test_withdrawals_per_day_quota(self):
+        for _ in range(5):
+            services.withdraw(self.account, Decimal(500))
+        with self.assertRaises(quotas.QuotaExceeded):
+            services.withdraw(self.account, Decimal(500))
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal(7500))
+        books_balance(self, self.account)
+
+    def test_refused_withdrawal_hands_its_quota_back(self):
+        for _ in range(5):
+            with self.assertRaises(services.InsufficientBalance):
+                services.withdraw(self.account, Decimal(50000))
+        services.withdraw(self.account, Decimal(500))
+
+    def test_rolled_back_withdrawal_uses_up_nothing(self):
+        for _ in range(5):
+            with self.assertRaises(RuntimeError), db_transaction.atomic():
+                services.withdraw(self.account, Decimal(500))
+                raise RuntimeError
+        services.withdraw(self.account, Decimal(500))
+
+    def test_withdrawn_per_day_quota(self):
+        account = make_account(2, balance=60000)
+        services.withdraw(account, Decimal(45000))
+        with self.assertRaisesMessage(quotas.QuotaExceeded, 'You have 5000.00 $ left today'):
+            services.withdraw(account, Decimal(6000))
+
+    def test_batch_withdrawals_count(self):
+        services.withdraw(self.account, Decimal(500))
+        services.apply_batch([(number, {'account_no': 1, 'type': 'withdrawal', 'amount': 500}) for number in range(3)])
+        services.withdraw(self.account, Decimal(500))
+        with self.assertRaises(quotas.QuotaExceeded):
+            services.withdraw(self.account, Decimal(500))
+
+    def test_loans_in_the_summary(self):
+        services.request_loan(self.account, Decimal(2000))
+        self.assertEqual(get_account_summary(self.account.user)['loans_last_30_days'], 1)
+
+
+class SharedCacheQuotaTests(QuotaTests):
+    # The same, with the counters in the cache
+    def setUp(self):
+        shared = mock.patch.object(caches, 'is_shared', return_value=True)
+        shared.start()
+        self.addCleanup(shared.stop)
+        super().setUp()
+
+    def test_quota_is_rebuilt_from_history_when_the_cache_loses_it(self):
+        for _ in range(5):
+            services.withdraw(self.account, Decimal(500))
+        cache.clear()
+        with self.assertRaises(quotas.QuotaExceeded):
+            services.withdraw(self.account, Decimal(500))
+
+    def test_batch_withdrawals_count_after_the_cache_loses_them(self):
+        services.withdraw(self.account, Decimal(500))
+        cache.clear()
+        services.apply_batch([(number, {'account_no': 1, 'type': 'withdrawal', 'amount': 500}) for number in range(4)])
+        with self.assertRaises(quotas.QuotaExceeded):
+            services.withdraw(self.account, Decimal(500))
+
+
+class AccountAdminTests(CacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = make_account(1, balance=1000)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.url = reverse('admin:accounts_userbankaccount_change', args=[self.account.pk])
+        self.data = {
+            'user': self.account.user_id, 'account_type': 'Savings', 'account_no': 1, 'gender': 'Male',
+            'balance': '99999',
+        }
+
+    def test_balance_is_not_editable(self):
+        self.assertEqual(self.client.post(self.url, {**self.data, 'account_type': 'Current'}).status_code, 302)
+        self.account.refresh_from_db()
+        self.assertEqual((self.account.account_type, self.account.balance), ('Current', Decimal(1000)))
+
+    def test_adjustment(self):
+        self.assertEqual(self.client.post(self.url, {**self.data, 'adjustment': '-250'}).status_code, 302)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal(750))
+        books_balance(self, self.account)
+        self.assertEqual(reconcile.check_range(self.account.pk, self.account.pk + 1), [])
+
+    def test_adjustment_below_zero_is_refused(self):
+        self.client.post(self.url, {**self.data, 'adjustment': '-1001'})
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal(1000))
+
+    def test_account_filter(self):
+        url = reverse('admin:transactions_transaction_changelist')
+        response = self.client.get(url, {'account': self.account.pk})
+        self.assertEqual(list(response.context['cl'].result_list), list(Transaction.objects.all()))
+        for value in ['abc', '1.5', '-1']:
+            with self.subTest(value):
+                self.assertRedirects(self.client.get(url, {'account': value}), f'{url}?e=1')
+
+
+class BulkLoanTests(CacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = make_account(1)
+
+    def approved_loan(self, amount=2000):
+        loan = services.request_loan(self.account, Decimal(amount))
+        self.assertEqual(services.bulk_approve_loans([loan.pk])['changed'], [loan.pk])
+        return Transaction.objects.get(pk=loan.pk)
+
+    def test_bulk_approve_twice_credits_once(self):
+        loan = self.approved_loan()
+        self.assertEqual(services.bulk_approve_loans([loan.pk]), {'changed': [], 'insufficient': [], 'ignored': [loan.pk]})
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal(2000))
+        books_balance(self, self.account)
+
+    def test_bulk_reverse(self):
+        loan = self.approved_loan()
+        services.withdraw(self.account, Decimal(500))
+        self.assertEqual(services.bulk_reverse_loans([loan.pk])['insufficient'], [loan.pk])
+        services.deposit(self.account, Decimal(500))
+        self.assertEqual(services.bulk_reverse_loans([loan.pk])['changed'], [loan.pk])
+        self.account.refresh_from_db()
+        self.assertEqual((self.account.balance, self.account.pending_loan_count), (0, 1))
+        books_balance(self, self.account)
+
+
+class SummaryTests(CacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = make_account(1, balance=1000)
+
+    def test_cached_with_a_shared_cache(self):
+        with mock.patch.object(caches, 'is_shared', return_value=True):
+            self.assertEqual(get_account_summary(self.account.user)['balance'], Decimal(1000))
+            # Nothing told the cache about this one
+            UserBankAccount.objects.filter(pk=self.account.pk).update(balance=Decimal(5))
+            self.assertEqual(get_account_summary(self.account.user)['balance'], Decimal(1000))
+            with self.captureOnCommitCallbacks(execute=True):
+                services.deposit(self.account, Decimal(100))
+            self.assertEqual(get_account_summary(self.account.user)['balance'], Decimal(105))
+
+    def test_built_every_time_with_a_per_process_cache(self):
+        # Another worker's write can't move this process's version
+        self.assertEqual(get_account_summary(self.account.user)['balance'], Decimal(1000))
+        UserBankAccount.objects.filter(pk=self.account.pk).update(balance=Decimal(5))
+        self.assertEqual(get_account_summary(self.account.user)['balance'], Decimal(5))
+
+
+@override_settings(BALANCE_SHARDS=True)
+class ShardTests(CacheMixin, TestCase):
+    def test_sharded_balance(self):
+        account = make_account(1, balance=1000)
+        shards.set_shards(account, 4)
+        for _ in range(8):
+            services.deposit(account, Decimal(100))
+        self.assertEqual(shards.balance(account), Decimal(1800))
+        # More than any one shard holds goes through the account row
+        services.withdraw(account, Decimal(1500))
+        self.assertEqual(shards.total(account.pk), Decimal(300))
+        books_balance(self, account)
+
+    def test_consolidate(self):
+        account = make_account(1)
+        shards.set_shards(account, 4)
+        services.deposit(account, Decimal(700))
+        with self.subTest('moved into the account row'):
+            self.assertEqual(shards.consolidate([account.pk]), 1)
+            account.refresh_from_db()
+            self.assertEqual(account.balance, Decimal(700))
+            self.assertFalse(BalanceShard.objects.filter(account=account).exclude(balance=0).exists())
+        with self.subTest('booked in the daily snapshot'):
+            day = account.daily_balances.get()
+            self.assertEqual((day.closing_balance, day.deposit_total), (Decimal(700), Decimal(700)))
+
+    def test_batch_withdrawals_see_the_running_balance(self):
+        account = make_account(1, balance=1000)
+        shards.set_shards(account, 4)
+        withdrawal = {'account_no': 1, 'type': 'withdrawal', 'amount': '600'}
+        results = services.apply_batch([(1, withdrawal), (2, withdrawal)])
+        self.assertEqual([result['ok'] for result in results], [True, False])
+        self.assertEqual(shards.total(account.pk), Decimal(400))
+        books_balance(self, account)
+
+    def test_old_shards_are_left_once_turned_off(self):
+        account = make_account(1)
+        shards.set_shards(account, 4)
+        services.deposit(account, Decimal(700))
+        with override_settings(BALANCE_SHARDS=False):
+            with self.assertRaises(ImproperlyConfigured):
+                shards.set_shards(account, 8)
+            services.deposit(account, Decimal(100))
+        account.refresh_from_db()
+        self.assertEqual(account.balance, Decimal(800))
+        self.assertFalse(BalanceShard.objects.filter(account=account).exclude(balance=0).exists())
+
+
+class LedgerTests(CacheMixin, TestCase):
+    def test_checkpoint_and_drift(self):
+        account = make_account(1, balance=1000)
+        services.withdraw(account, Decimal(500))
+        self.assertEqual(ledger.checkpoint(0, account.pk + 1), (1, []))
+        services.deposit(account, Decimal(100))
+        self.assertEqual(ledger.balance(account), Decimal(600))
+
+        UserBankAccount.objects.filter(pk=account.pk).update(balance=Decimal(999))
+        written, drifted = ledger.checkpoint(0, account.pk + 1)
+        self.assertEqual(drifted, [(account.pk, 1, Decimal('999.00'), Decimal('600.00'))])
+
+    def test_deleting_an_account_keeps_its_entries(self):
+        account = make_account(1, balance=1000)
+        account.user.delete()
+        self.assertEqual(LedgerEntry.objects.filter(account=None).count(), 2)
+        self.assertEqual(sum(ledger.trial_balance().values()), 0)
+
+
+class GroupCommitTests(CacheMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = make_account(1)
+        self.committer = group_commit.Committer(0.005, 50)
+
+    def test_deposits_are_committed_together(self):
+        futures = [self.committer.submit(self.account, Decimal(100)) for _ in range(10)]
+        rows = [future.result(timeout=10) for future in futures]
+        self.assertEqual(len({row.pk for row in rows}), 10)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal(1000))
+        books_balance(self, self.account)
+
+    def test_refused_deposit_fails_alone(self):
+        refused = self.committer.submit(self.account, Decimal(1))
+        accepted = self.committer.submit(self.account, Decimal(100))
+        self.assertIsInstance(refused.exception(timeout=10), group_commit.DepositFailed)
+        self.assertEqual(accepted.result(timeout=10).amount, Decimal(100))
+
+    def test_error_after_the_commit_resolves_every_deposit(self):
+        with mock.patch.object(Transaction.objects, 'in_bulk', return_value={}):
+            futures = [self.committer.submit(self.account, Decimal(100)) for _ in range(3)]
+            for future in futures:
+                self.assertIsNotNone(future.exception(timeout=10))
+        self.assertTrue(self.committer.thread.is_alive())
+        self.committer.submit(self.account, Decimal(100)).result(timeout=10)
+
+    @override_settings(GROUP_COMMIT_TIMEOUT=0.1)
+    def test_deposit_times_out(self):
+        slow = group_commit.Committer(5, 50)
+        with mock.patch.object(group_commit, '_committer', slow):
+            with self.assertRaisesMessage(group_commit.DepositFailed, 'was not made'):
+                group_commit.deposit(self.account, Decimal(100))
+        self.assertFalse(Transaction.objects.exists())
+
+
+class DepositViewTests(CacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = make_account(1)
+        self.client.force_login(self.account.user)
+
+    def test_replayed_deposit_moves_money_once(self):
+        data = {'amount': '500', 'idempotency_key': 'deposit-1'}
+        first = self.client.post(reverse('deposit'), data)
+        retry = self.client.post(reverse('deposit'), data)
+        self.assertEqual((first.status_code, retry.status_code), (302, 302))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_replayed_deposit_after_cache_loss(self):
+        data = {'amount': '500', 'idempotency_key': 'deposit-1'}
+        self.client.post(reverse('deposit'), data)
+        cache.clear()
+        self.assertEqual(self.client.post(reverse('deposit'), data)['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_key_reused_for_another_amount(self):
+        self.client.post(reverse('deposit'), {'amount': '500', 'idempotency_key': 'deposit-1'})
+        response = self.client.post(reverse('deposit'), {'amount': '600', 'idempotency_key': 'deposit-1'})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_invalid_form_hands_the_key_back(self):
+        self.assertEqual(self.client.post(reverse('deposit'), {'amount': '5', 'idempotency_key': 'deposit-1'}).status_code, 200)
+        self.assertEqual(self.client.post(reverse('deposit'), {'amount': '500', 'idempotency_key': 'deposit-1'}).status_code, 302)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_failed_completion_moves_no_money(self):
+        data = {'amount': '500', 'idempotency_key': 'deposit-1'}
+        with mock.patch.object(idempotency, 'complete', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post(reverse('deposit'), data)
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.client.post(reverse('deposit'), data).status_code, 302)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_stale_key_is_taken_over(self):
+        # Left in progress by a request that died before committing
+        IdempotencyKey.objects.create(user=self.account.user, key='deposit-1', fingerprint='')
+        IdempotencyKey.objects.update(created_at=timezone.now() - idempotency.STALE * 2)
+        response = self.client.post(reverse('deposit'), {'amount': '500', 'idempotency_key': 'deposit-1'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+
+    @override_settings(GROUP_COMMIT_DEPOSITS=True)
+    def test_group_commit_failure_is_shown_on_the_form(self):
+        with mock.patch.object(group_commit, 'deposit', side_effect=group_commit.DepositFailed('The deposit timed out')):
+            response = self.client.post(reverse('deposit'), {'amount': '500'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('The deposit timed out', response.context['form'].errors['amount'])
+
+class GroupCommitDepositViewTests(CacheMixin, TransactionTestCase):
+    @override_settings(GROUP_COMMIT_DEPOSITS=True)
+    def test_key_is_completed_with_the_batch(self):
+        account = make_account(1)
+        self.client.force_login(account.user)
+        data = {'amount': '500', 'idempotency_key': 'deposit-1'}
+        with mock.patch.object(group_commit, '_committer', group_commit.Committer(0.005, 50)):
+            self.assertEqual(self.client.post(reverse('deposit'), data).status_code, 302)
+            self.assertEqual(IdempotencyKey.objects.get().status_code, 302)
+            cache.clear()
+            self.assertEqual(self.client.post(reverse('deposit'), data)['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    @override_settings(GROUP_COMMIT_DEPOSITS=True, GROUP_COMMIT_TIMEOUT=0.1)
+    def test_timeout_after_the_committer_took_the_deposit_keeps_the_key(self):
+        account = make_account(1)
+        self.client.force_login(account.user)
+        data = {'amount': '500', 'idempotency_key': 'deposit-1'}
+        # The committer has taken the deposit but writes it after the
+        # request stopped waiting
+        release, written = threading.Event(), threading.Event()
+        write = group_commit.write
+
+        def slow_write(*args):
+            release.wait(10)
+            try:
+                return write(*args)
+            finally:
+                written.set()
+
+        committer = group_commit.Committer(0.005, 50)
+        with mock.patch.object(group_commit, '_committer', committer), \
+                mock.patch.object(group_commit, 'write', slow_write), \
+                mock.patch.object(idempotency, 'WAIT', 0.1):
+            response = self.client.post(reverse('deposit'), data)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.context['idempotency_key'], 'deposit-1')
+            self.assertIsNone(IdempotencyKey.objects.get().status_code)
+            self.assertEqual(self.client.post(reverse('deposit'), data).status_code, 409)
+
+            release.set()
+            self.assertTrue(written.wait(10))
+            self.assertEqual(self.client.post(reverse('deposit'), data)['Idempotent-Replayed'], 'true')
+        self.assertEqual(Transaction.objects.count(), 1)
+
+
+# The async report and loan list (async_views.py) next to the sync ones,
+# which keep their URL names, for AsyncViewTests
+urlpatterns = [
+    path('async/transaction_report/', async_views.TransactionReportView.as_view()),
+    path('async/loan_list/', async_views.LoanListView.as_view()),
+    path('', include('empty_bank.urls')),
+]
+
+
+@override_settings(ROOT_URLCONF='transactions.tests')
+class AsyncViewTests(CacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = make_account(1, balance=1000)
+        for _ in range(RECENT_TRANSACTIONS + 5):
+            services.deposit(self.account, Decimal(100))
+        services.request_loan(self.account, Decimal(2000))
+
+    async def contexts(self, path, **params):
+        await self.async_client.aforce_login(self.account.user)
+        sync = await self.async_client.get(f'/transactions/{path}/', params)
+        native = await self.async_client.get(f'/async/{path}/', params)
+        self.assertEqual((sync.status_code, native.status_code), (200, 200))
+        return sync.context, native.context
+
+    async def test_report(self):
+        today = timezone.localdate().isoformat()
+        cases = {
+            'first page': {},
+            'next page': {'after': encode_cursor(await Transaction.objects.order_by('-timestamp', '-id')[4:5].aget())},
+            'date range': {'start_date': today, 'end_date': today},
+        }
+        for name, params in cases.items():
+            with self.subTest(name):
+                sync, native = await self.contexts('transaction_report', **params)
+                self.assertTrue(sync['object_list'])
+                self.assertEqual([row.pk for row in native['object_list']], [row.pk for row in sync['object_list']])
+                for key in ['balance', 'summary', 'next_cursor', 'previous_cursor']:
+                    self.assertEqual(native[key], sync[key], key)
+
+    async def test_loan_list(self):
+        sync, native = await self.contexts('loan_list')
+        self.assertEqual([loan.pk for loan in native['loans']], [loan.pk for loan in sync['loans']])
+        self.assertEqual(len(native['loans']), 1)
+
+
+class CursorTests(TestCase):
+    def test_round_trip(self):
+        row = Transaction(pk=7, timestamp=timezone.now())
+        self.assertEqual(decode_cursor(encode_cursor(row)), (row.timestamp, 7))
+
+    def test_cursor_without_offset_is_aware(self):
+        timestamp, pk = decode_cursor(cursor('2024-01-01T00:00:00|5'))
+        self.assertTrue(timezone.is_aware(timestamp))
+
+    def test_malformed_cursors(self):
+        for raw in ['junk!!', cursor('2024-01-01'), cursor('yesterday|5'), cursor('2024-01-01|five')]:
+            with self.subTest(raw=raw), self.assertRaises(InvalidCursor):
+                decode_cursor(raw)
+
+
+class ReportTests(CacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = make_account(1)
+        for _ in range(25):
+            services.deposit(self.account, Decimal(100))
+        self.client.force_login(self.account.user)
+
+    def page_through(self):
+        ids = []
+        url = reverse('api_transactions')
+        while url:
+            page = self.client.get(url).json()
+            ids.extend(row['id'] for row in page['results'])
+            url = page['next'] and f"{reverse('api_transactions')}?after={page['next']}"
+        return ids
+
+    def test_pages_cover_every_row_once(self):
+        ids = self.page_through()
+        self.assertEqual(ids, list(Transaction.objects.order_by('-timestamp', '-id').values_list('pk', flat=True)))
+
+    def test_pages_read_through_to_the_archive(self):
+        expected = self.page_through()
+        archive.archive_batch(timezone.now() + timedelta(seconds=1), batch_size=15)
+        self.assertEqual(ArchivedTransaction.objects.count(), 15)
+        self.assertEqual(self.page_through(), expected)
+
+    def test_before_cursor_without_offset(self):
+        for url in [reverse('transaction_report'), reverse('api_transactions')]:
+            with self.subTest(url=url):
+                response = self.client.get(url, {'before': cursor('2024-01-01T00:00:00|5')})
+                self.assertEqual(response.status_code, 200)
+
+    def test_malformed_cursor_is_a_bad_request(self):
+        for url in [reverse('transaction_report'), reverse('api_transactions')]:
+            for name in ['after', 'before']:
+                with self.subTest(url=url, name=name):
+                    self.assertEqual(self.client.get(url, {name: 'junk!!'}).status_code, 400)
+
+    def test_malformed_date_range_is_a_bad_request(self):
+        ranges = [('2024-13-01', '2024-01-31'), ('2024-01-01', 'tomorrow'), ('2024-01-01', '9999-12-31')]
+        for url in [reverse('transaction_report'), reverse('statement_export')]:
+            for start_date, end_date in ranges:
+                with self.subTest(url=url, end_date=end_date):
+                    response = self.client.get(url, {'start_date': start_date, 'end_date': end_date})
+                    self.assertEqual(response.status_code, 400)
+
+    def test_date_range(self):
+        today = timezone.localdate().isoformat()
+        response = self.client.get(reverse('transaction_report'), {'start_date': today, 'end_date': today})
+        self.assertEqual(response.context['summary']['deposit_total'], Decimal(2500))
+        response = self.client.get(reverse('statement_export'), {'start_date': today, 'end_date': today, 'format': 'jsonl'})
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 25)
+
+
+class ApiEtagTests(CacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = make_account(1, balance=1000)
+        self.client.force_login(self.account.user)
+
+    def etag(self, name='api_balance'):
+        response = self.client.get(reverse(name))
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_unchanged_etag_is_not_modified(self):
+        for name in ['api_balance', 'api_transactions', 'api_loans']:
+            with self.subTest(name):
+                etag = self.etag(name)
+                response = self.client.get(reverse(name), headers={'If-None-Match': etag})
+                self.assertEqual((response.status_code, response.content), (304, b''))
+
+    def test_writes_change_the_etag(self):
+        writes = {
+            'deposit': lambda: services.deposit(self.account, Decimal(500)),
+            'withdrawal': lambda: services.withdraw(self.account, Decimal(500)),
+            'loan request': lambda: services.request_loan(self.account, Decimal(2000)),
+            # No new row, only the balance and loan state move
+            'loan approval': lambda: services.bulk_approve_loans(
+                Transaction.objects.filter(transaction_type=LOAN).values_list('pk', flat=True),
+            ),
+        }
+        etag = self.etag()
+        for name, write in writes.items():
+            with self.subTest(name):
+                write()
+                response = self.client.get(reverse('api_balance'), headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+                etag = response['ETag']
+
+
+class BatchIngestTests(CacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.account = make_account(1)
+        User.objects.create_user('staff', password='password', is_staff=True)
+        self.client = self.client_class(enforce_csrf_checks=True)
+
+    def post(self, body, username=None):
+        headers = {}
+        if username:
+            headers['Authorization'] = 'Basic ' + base64.b64encode(f'{username}:password'.encode()).decode()
+        return self.client.post(reverse('batch_transactions'), body, content_type='application/x-ndjson', headers=headers)
+
+    def test_authentication(self):
+        self.assertEqual(self.post(b'').status_code, 401)
+        self.assertEqual(self.post(b'', 'user1').status_code, 403)
+        self.client.force_login(User.objects.get(username='staff'))
+        self.assertEqual(self.post(b'').status_code, 401)
+
+    def test_results_per_line(self):
+        body = b'{"account_no": 1, "type": "deposit", "amount": 100}\n\xff\n\n{"account_no": 1, "type": "withdrawal"\n'
+        response = self.post(body, 'staff')
+        self.assertEqual(response.status_code, 200)
+        results = [json.loads(line) for line in response.content.splitlines()]
+        self.assertEqual([(result['line'], result['ok']) for result in results], [(1, True), (2, False), (4, False)])
+        self.assertIn('Invalid UTF-8', results[1]['errors'][0])
+        self.assertIn('Invalid JSON', results[2]['errors'][0])
+
+    def test_account_no_must_be_a_whole_number(self):
+        lines = [
+            {'account_no': account_no, 'type': 'deposit', 'amount': 100}
+            for account_no in [1.9, True, '1x', None, '1', 1]
+        ]
+        results = services.ingest_jsonl([json.dumps(line) for line in lines])
+        self.assertEqual([result['ok'] for result in results], [False, False, False, False, True, True])
+        self.assertEqual(results[0]['errors'], ["account_no must be a whole number"])
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal(200))
+
+    def test_batches(self):
+        lines = [b'{"account_no": 1, "type": "deposit", "amount": 100}\n'] * 5
+        results = list(services.ingest_jsonl_batches(lines, batch_size=2))
+        self.assertEqual([result['line'] for result in results], [1, 2, 3, 4, 5])
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal(500))
+        books_balance(self, self.account)
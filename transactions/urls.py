@@ -1,5 +1,10 @@
+from django.conf import settings
 from django.urls import path
-from .views import DipositView, WithdrawalView, LoanRequestView, LoanListView, PayLoanView, TransactionReportView
+from .api import BalanceApiView, TransactionApiView, LoanApiView
+from .views import DipositView, WithdrawalView, LoanRequestView, LoanListView, PayLoanView, TransactionReportView, BatchTransactionView, StatementExportView
+
+if settings.ASYNC_VIEWS:
+    from .async_views import TransactionReportView, LoanListView
 
 urlpatterns = [
     path("deposit/", DipositView.as_view(), name="deposit"),
@@ -8,5 +13,10 @@ urlpatterns = [
     path("loan_list/", LoanListView.as_view(), name="loan_list"),
     path("pay_loan/<int:loan_id>/", PayLoanView.as_view(), name="pay_loan"),
     path("transaction_report/", TransactionReportView.as_view(), name="transaction_report"),
+    path("transaction_report/export/", StatementExportView.as_view(), name="statement_export"),
+    path("batch/", BatchTransactionView.as_view(), name="batch_transactions"),
+    path("api/balance/", BalanceApiView.as_view(), name="api_balance"),
+    path("api/transactions/", TransactionApiView.as_view(), name="api_transactions"),
+    path("api/loans/", LoanApiView.as_view(), name="api_loans"),
 ]
     
\ No newline at end of file
@@ -1,17 +1,22 @@
+from django.conf import settings
 from django.shortcuts import redirect, get_object_or_404
+from django.http import HttpResponseRedirect, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, StreamingHttpResponse
 from django.db.models import Q, Sum
-from django.db import transaction as db_transaction
 
+from django.contrib.auth import authenticate
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import CreateView, ListView
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from django.contrib import messages
 from django.urls import reverse_lazy
+from django.utils.decorators import method_decorator
 from django.utils import timezone
-from django.utils.timezone import now
-from datetime import datetime
-from django.core.mail import EmailMessage, EmailMultiAlternatives
-from django.template.loader import render_to_string
+from datetime import date, datetime, time, timedelta
+import base64
+import csv
+import json
+from operator import itemgetter
 
 
 from .forms import (
@@ -19,22 +24,57 @@ from .forms import (
     WithdrawalForm, 
     LoanRequestForm
 )
-from accounts.models import UserBankAccount
-from .models import Transaction
-from .constants import DEPOSIT, WITHDRAWAL, LOAN, LOAN_PAID
+from .models import Transaction, ArchivedTransaction
+from .constants import DEPOSIT, WITHDRAWAL, LOAN, TRANSACTION_TYPES
+from . import services, quotas, archive, shards, group_commit, caches
+from .idempotency import IdempotentMixin, new_key
+from .pagination import keyset_page, encode_cursor, InvalidCursor
+from .snapshots import period_summary
+from .summary import get_account_summary, summary_key, RECENT_TRANSACTIONS
+from core.routers import reading_from_replica
 
 
-# def send_transaction_email(user, amount, subject, template):
-#     message = render_to_string(template, {
-#         'user': user,
-#         'amount': amount,
-#     })
-#     send_email = EmailMultiAlternatives(subject, '', to=[user.email])
-#     send_email.attach_alternative(message, 'text/html')
-#     send_email.send()
+TRANSACTION_TYPE_LABELS = dict(TRANSACTION_TYPES)
+REPORT_FRAGMENT_TIMEOUT = 60 * 15
 
 
-class TransactionCreateMixin(LoginRequiredMixin, CreateView):
+DATE_RANGE_ERROR = "start_date and end_date must be dates (YYYY-MM-DD)"
+
+
+def report_cache_timeout():
+    # The report table is cached per summary version and URL. Rows read from
+    # a replica may lag behind the version, and a version kept per process
+    # doesn't move on other workers' writes, so neither is cached.
+    if reading_from_replica() or not caches.is_shared():
+        return 0
+    return REPORT_FRAGMENT_TIMEOUT
+
+
+def get_date_range(request):
+    # (start_date, end_date) from the report's GET parameters, or None.
+    # Raises ValueError for a date that doesn't parse, which views answer
+    # with a 400.
+    start_date_str = request.GET.get('start_date')
+    end_date_str = request.GET.get('end_date')
+    if start_date_str and end_date_str:
+        start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+        if end_date == date.max:
+            # filter_date_range() needs the day after it
+            raise ValueError(end_date_str)
+        return start_date, end_date
+    return None
+
+
+def filter_date_range(queryset, start_date, end_date):
+    # Compare against datetimes instead of timestamp__date so the
+    # (account, timestamp, id) index can be used
+    start = timezone.make_aware(datetime.combine(start_date, time.min))
+    end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min))
+    return queryset.filter(timestamp__gte=start, timestamp__lt=end)
+
+
+class TransactionCreateMixin(LoginRequiredMixin, IdempotentMixin, CreateView):
     template_name = 'transactions/transaction_form.html'
     model = Transaction
     title = ''
@@ -62,6 +102,11 @@ class DipositView(TransactionCreateMixin):
     def get_initial(self):
         initial = {'transaction_type': DEPOSIT}
         return initial
+
+    def completes_key(self):
+        # The committer's batch transaction completes the key, see
+        # group_commit.py
+        return settings.GROUP_COMMIT_DEPOSITS
     
     def form_valid(self, form):
         amount = form.cleaned_data.get('amount')
@@ -70,19 +115,22 @@ class DipositView(TransactionCreateMixin):
         #     now = timezone.now()
         #     account.initial_deposit_date = now
         
-        account.balance += amount
-        account.save(
-            update_fields = ['balance']
-        )
+        if settings.GROUP_COMMIT_DEPOSITS:
+            try:
+                self.object = group_commit.deposit(
+                    account, amount, self.idempotency_key, str(self.success_url),
+                )
+            except group_commit.DepositFailed as e:
+                # A pending deposit is completed on the key by the committer
+                self.key_pending = self.idempotency_key is not None and isinstance(e, group_commit.DepositPending)
+                form.add_error('amount', str(e))
+                return self.form_invalid(form)
+        else:
+            self.object = services.deposit(account, amount)
         messages.success(self.request, f"{amount:.2f} $ was deposited successfully")
-        # Send email notification
-        # send_transaction_email(
-        #     user=self.request.user,
-        #     amount=amount,
-        #     subject='Deposit Successful',
-        #     template='transactions/deposit_email.html'
-        # )
-        return super().form_valid(form)
+        # The confirmation email is queued by services.deposit and sent by
+        # `manage.py send_notifications`
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class WithdrawalView(TransactionCreateMixin):
@@ -97,14 +145,19 @@ class WithdrawalView(TransactionCreateMixin):
     def form_valid(self, form):
         amount = form.cleaned_data.get('amount')
 
-        self.request.user.account.balance -= amount
-        self.request.user.account.save(
-            update_fields = ['balance']
-        )
+        # The form checked a balance that may be stale by now, the service
+        # re-checks it atomically while taking the money out
+        try:
+            self.object = services.withdraw(self.request.user.account, amount)
+        except services.InsufficientBalance:
+            form.add_error('amount', f"You cannot withdraw more than {shards.balance(self.request.user.account)} $")
+            return self.form_invalid(form)
+        except quotas.QuotaExceeded as e:
+            form.add_error('amount', str(e))
+            return self.form_invalid(form)
 
         # messages.success(self.request ,f"{amount:.2f} $ was withdrawn from your account successfully")
-        # send_transaction_email(self.request.user, amount, "Withdrawal Message", "transactions/withdrawal_email.html")
-        return super().form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class LoanRequestView(TransactionCreateMixin):
@@ -118,47 +171,17 @@ class LoanRequestView(TransactionCreateMixin):
     def form_valid(self, form):
         account = self.request.user.account
         amount = form.cleaned_data['amount']
-        today = now().date()
-        
-        # Reset loan count if month changed
-        if account.last_loan_date and account.last_loan_date.month != today.month:
-            account.loan_count = 0
-            account.save()
-            
-        # Check monthly loan limit
-        if account.loan_count >= 3:
-            form.add_error('amount', "You can't take more than 3 loans in a month.")
-            return self.form_invalid(form)
-        
-        # Rule 1: Check for any pending loan (requested but not approved yet)
-        pending_loans = Transaction.objects.filter(
-            account=account,
-            transaction_type=LOAN,
-            loan_approve=False
-        )
-        if pending_loans.exists():
-            form.add_error('amount', "Admin has not approved your previous loan request yet. Please wait.")
-            return self.form_invalid(form)
-        
 
-         # Rule 2: Check for any approved but unpaid loan
-        loan_status = Transaction.objects.filter(
-            account=account,
-            transaction_type=LOAN,
-            loan_approve=True
-        ).exclude(transaction_type=LOAN_PAID).exists()
-        if loan_status:
-            form.add_error('amount', "You have an approved loan that you haven't paid yet. Please pay it first.")
+        # The loan quota and the pending and unpaid loan rules are all
+        # checked in services.request_loan
+        try:
+            self.object = services.request_loan(account, amount)
+        except (services.LoanRefused, quotas.QuotaExceeded) as e:
+            form.add_error('amount', str(e))
             return self.form_invalid(form)
-        
-        # Update loan count and date
-        account.loan_count += 1
-        account.last_loan_date = today
-        account.save()
 
         messages.success(self.request, f"{amount:.2f} $ was requested for loan successfully")
-        # send_transaction_email(self.request.user, amount, "Loan Request Message", "transactions/loan_email.html")
-        return super().form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
         
 
@@ -167,34 +190,74 @@ class TransactionReportView(LoginRequiredMixin, ListView):
     template_name = 'transactions/transaction_report.html'
     model = Transaction
     # paginate_by = 10
+    page_size = RECENT_TRANSACTIONS # Paged with (timestamp, id) cursors, see pagination.py
+    replica_reads = True # See core/routers.py
     # context_object_name = 'transactions'
     #** if you don't want to use default context object name then you have to write in template:  object_list **#
 
+    def get(self, request, *args, **kwargs):
+        try:
+            self.date_range = get_date_range(request)
+        except ValueError:
+            return HttpResponseBadRequest(DATE_RANGE_ERROR)
+        try:
+            return super().get(request, *args, **kwargs)
+        except InvalidCursor:
+            return HttpResponseBadRequest("Invalid page cursor")
+
     def get_queryset(self):
-        self.account = UserBankAccount.objects.get(user=self.request.user) #Always get fresh account
+        # Read before the rows, so a write landing in between moves the
+        # version on and the rendered table is never cached as current
+        self.summary_version = summary_key(self.request.user.pk)
+        # The cached summary is invalidated by every write, so its account is
+        # as fresh as a direct lookup
+        account_summary = get_account_summary(self.request.user)
+        self.account = account_summary['account']
+        date_range = self.date_range
+        after = self.request.GET.get('after')
+        before = self.request.GET.get('before')
+
+        if not (date_range or after or before):
+            # First page of the plain report comes straight from the cache
+            self.filtered_balance = account_summary['balance']
+            self.summary = None
+            rows = account_summary['recent_transactions']
+            self.next_cursor = encode_cursor(rows[-1]) if account_summary['has_more'] else None
+            self.previous_cursor = None
+            return rows
+
         queryset = super().get_queryset().filter(
             account = self.account
         )
-        start_date_str = self.request.GET.get('start_date')
-        end_date_str = self.request.GET.get('end_date')
-
-        if start_date_str and end_date_str:
-            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-
-            queryset = queryset.filter(timestamp__date__gte=start_date, timestamp__date__lte=end_date)
-
-            # When filtered, get balance from latest filtered transaction
-            last_txn = queryset.order_by('-timestamp').first()
-            self.filtered_balance = last_txn.balance_after_transaction if last_txn else 0
-            
-            return queryset.distinct().order_by('-timestamp')
+        # Older pages read through to the archive, see archive.py
+        archived = ArchivedTransaction.objects.filter(account=self.account)
+
+        if date_range:
+            start_date, end_date = date_range
+            queryset = filter_date_range(queryset, start_date, end_date)
+            if archive.reaches(archive.day_start(start_date)):
+                archived = filter_date_range(archived, start_date, end_date)
+            else:
+                archived = None
+
+            # When filtered, opening/closing balance and the period totals
+            # come from the daily snapshots instead of the raw rows
+            self.summary = period_summary(self.account, start_date, end_date)
+            self.filtered_balance = self.summary['closing_balance']
 
         else:
             # Get latest actual account balance        
-            self.filtered_balance = self.account.balance
-        
-        return queryset.distinct().order_by('-timestamp')[:10] # Most recent 10
+            self.filtered_balance = account_summary['balance']
+            self.summary = None
+
+        rows, self.next_cursor, self.previous_cursor = keyset_page(
+            queryset,
+            self.page_size,
+            after=after,
+            before=before,
+            archive=archived,
+        )
+        return rows
     
     
     def get_context_data(self, **kwargs):
@@ -202,13 +265,83 @@ class TransactionReportView(LoginRequiredMixin, ListView):
         context.update({
             'account': self.account,
             'balance': self.filtered_balance,
+            'summary': self.summary,
             'start_date': self.request.GET.get('start_date'),
             'end_date': self.request.GET.get('end_date'),
+            'next_cursor': self.next_cursor,
+            'previous_cursor': self.previous_cursor,
+            'summary_version': self.summary_version,
+            'report_cache_timeout': report_cache_timeout(),
         })
         return context
 
 
-class PayLoanView(LoginRequiredMixin, View):
+class StatementExportView(LoginRequiredMixin, View):
+    # Streams the statement as CSV or JSONL. Rows are read in chunks with
+    # values_list, so memory use doesn't grow with the size of the history.
+    chunk_size = 2000
+    replica_reads = True
+    # id only orders rows with the same timestamp
+    columns = ['timestamp', 'id', 'transaction_type', 'amount', 'balance_after_transaction']
+
+    def get(self, request):
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in ('csv', 'jsonl'):
+            return HttpResponseBadRequest("format must be csv or jsonl")
+
+        queryset = Transaction.objects.filter(account__user=request.user)
+        archived = ArchivedTransaction.objects.filter(account__user=request.user)
+        try:
+            date_range = get_date_range(request)
+        except ValueError:
+            return HttpResponseBadRequest(DATE_RANGE_ERROR)
+        if date_range:
+            queryset = filter_date_range(queryset, *date_range)
+            archived = filter_date_range(archived, *date_range)
+        rows = self.stream(queryset)
+        if archive.reaches(archive.day_start(date_range[0]) if date_range else None):
+            rows = archive.merged(rows, self.stream(archived), key=itemgetter(0, 1))
+
+        if export_format == 'csv':
+            lines = self.csv_lines(rows)
+            content_type = 'text/csv'
+        else:
+            lines = self.jsonl_lines(rows)
+            content_type = 'application/x-ndjson'
+
+        response = StreamingHttpResponse(lines, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="statement.{export_format}"'
+        return response
+
+    def stream(self, queryset):
+        return queryset.order_by('timestamp', 'id').values_list(*self.columns).iterator(chunk_size=self.chunk_size)
+
+    def csv_lines(self, rows):
+        buffer = Echo()
+        writer = csv.writer(buffer)
+        yield writer.writerow(['Date', 'Transaction Type', 'Amount', 'Balance After Transaction'])
+        for timestamp, _, kind, amount, balance in rows:
+            yield writer.writerow([timestamp.isoformat(), TRANSACTION_TYPE_LABELS.get(kind), amount, balance])
+
+    def jsonl_lines(self, rows):
+        for timestamp, _, kind, amount, balance in rows:
+            yield json.dumps({
+                'timestamp': timestamp.isoformat(),
+                'transaction_type': TRANSACTION_TYPE_LABELS.get(kind),
+                'amount': str(amount),
+                'balance_after_transaction': None if balance is None else str(balance),
+            }) + '\n'
+
+
+class Echo:
+    # csv.writer needs a file; this one hands each row straight back
+    def write(self, value):
+        return value
+
+
+class PayLoanView(LoginRequiredMixin, IdempotentMixin, View):
+    idempotent_methods = ('GET',) # Paid from a link on the loan list
+
     def get(self, request, loan_id):
         loan = get_object_or_404(
             Transaction,
@@ -220,21 +353,15 @@ class PayLoanView(LoginRequiredMixin, View):
         
         account = request.user.account
         
-        if loan.amount > account.balance:
+        try:
+            services.pay_loan(account, loan)
+        except services.InsufficientBalance:
             messages.error(request, "Insufficient balance to pay loan")
+            self.retryable = True # Can work once there is money in the account
+            return redirect('loan_list')
+        except services.LoanNotPayable:
+            messages.error(request, "This loan has already been paid")
             return redirect('loan_list')
-        
-        # Process payment
-        account.balance -= loan.amount
-        loan.transaction_type = LOAN_PAID
-        loan.balance_after_transaction = account.balance
-        
-        with db_transaction.atomic():
-            account.save(update_fields=['balance'])
-            loan.save(update_fields=[
-                'transaction_type', 
-                'balance_after_transaction'
-            ])
         
         messages.success(request, "Loan paid successfully")
         return redirect('loan_list')
@@ -247,6 +374,7 @@ class LoanListView(LoginRequiredMixin, ListView):
     template_name = 'transactions/loan_request.html' 
     model = Transaction
     context_object_name = 'loans'
+    replica_reads = True
     
     # def get_queryset(self):
     #     user_account = self.request.user.account
@@ -263,5 +391,48 @@ class LoanListView(LoginRequiredMixin, ListView):
             transaction_type=LOAN
         )
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        # Each Pay Loan link gets its own key, see idempotency.py
+        context['idempotency_key'] = new_key()
+        return context
+
 
-    
\ No newline at end of file
+def basic_auth_user(request):
+    # The user named by an "Authorization: Basic" header, if the password
+    # matches, or None
+    try:
+        scheme, credentials = request.headers['Authorization'].split(' ', 1)
+        username, password = base64.b64decode(credentials).decode().split(':', 1)
+    except (KeyError, ValueError, UnicodeError):
+        return None
+    if scheme.lower() != 'basic':
+        return None
+    return authenticate(request, username=username, password=password)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class BatchTransactionView(View):
+    # For scripts: POST a JSONL body of {"account_no", "type", "amount"}
+    # lines with a staff user's credentials in HTTP Basic auth, get one JSON
+    # result line back per input line. The session cookie is never looked
+    # at, which is what makes skipping the CSRF check safe. Lines are
+    # committed INGEST_BATCH_SIZE at a time, like `manage.py
+    # ingest_transactions`.
+    http_method_names = ['post']
+
+    def dispatch(self, request, *args, **kwargs):
+        user = basic_auth_user(request)
+        if user is None:
+            response = HttpResponse("Authentication required", status=401)
+            response['WWW-Authenticate'] = 'Basic realm="batch"'
+            return response
+        if not user.is_staff:
+            return HttpResponseForbidden("Staff only")
+        request.user = user
+        return super().dispatch(request, *args, **kwargs)
+
+    def post(self, request):
+        results = services.ingest_jsonl_batches(request)
+        body = ''.join(json.dumps(result) + '\n' for result in results)
+        return HttpResponse(body, content_type='application/x-ndjson')